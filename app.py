@@ -7,44 +7,2501 @@ OZON FBO Supply Manager v3.0
 3. Варианты отгрузки - подтверждение
 """
 
-import os, json, urllib.request, urllib.error, ssl
+import os, io, re, csv, gzip, zlib, zipfile, json, contextvars, contextlib, functools, math, uuid, hashlib, sqlite3, heapq, bisect, itertools, urllib.parse, ssl, queue, threading, time, select, selectors, socket, random, http.client
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from collections import Counter, OrderedDict, defaultdict, deque
 from datetime import datetime, timedelta
 from http.server import HTTPServer, BaseHTTPRequestHandler
 
+try:
+    import openpyxl  # нужен только для загрузки XLSX
+except ImportError:
+    openpyxl = None
+try:
+    import orjson  # быстрый JSON, если установлен
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+try:
+    import brotli  # необязателен: без него интерфейс отдаётся в gzip
+except ImportError:
+    brotli = None
+try:
+    import pypdf  # нужен только для склейки этикеток в один PDF
+except ImportError:
+    pypdf = None
+try:
+    import numpy  # ускоряет расчёт грузомест, без него считается циклами
+except ImportError:
+    numpy = None
+
+# JSON-кодек: orjson, ujson или стандартный json. json_dumps всегда возвращает UTF-8 байты
+if orjson:
+    JSON_CODEC = "orjson"
+    json_loads = orjson.loads
+    def json_dumps(obj, sort_keys=False):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0))
+elif ujson:
+    JSON_CODEC = "ujson"
+    json_loads = ujson.loads
+    def json_dumps(obj, sort_keys=False):
+        return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False, sort_keys=sort_keys).encode()
+else:
+    JSON_CODEC = "json"
+    json_loads = json.loads
+    def json_dumps(obj, sort_keys=False):
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), sort_keys=sort_keys).encode()
+
 PORT = int(os.environ.get("PORT", 8080))
+WORKERS = int(os.environ.get("WORKERS", 16))
+QUEUE_LIMIT = int(os.environ.get("QUEUE_LIMIT", 64))
+CLIENT_TIMEOUT = float(os.environ.get("CLIENT_TIMEOUT", 30))  # простаивающее keep-alive соединение не держит воркер дольше
+POOL_SIZE = int(os.environ.get("POOL_SIZE", 8))
+POOL_IDLE = float(os.environ.get("POOL_IDLE", 60))
+CACHE_BYTES = int(os.environ.get("CACHE_BYTES", 32 * 1024 * 1024))
+OZON_RETRIES = int(os.environ.get("OZON_RETRIES", 3))
+CATALOG_REFRESH = int(os.environ.get("CATALOG_REFRESH", 1800))
+CATALOG_FULL_REFRESH = int(os.environ.get("CATALOG_FULL_REFRESH", 86400))
+SUPPLIES_TTL = int(os.environ.get("SUPPLIES_TTL", 60))
+SLOTS_TTL = int(os.environ.get("SLOTS_TTL", 30))
+SLOT_FANOUT = int(os.environ.get("SLOT_FANOUT", 8))
+SLOT_WATCH = float(os.environ.get("SLOT_WATCH", 60))
+POINTS_REFRESH = int(os.environ.get("POINTS_REFRESH", 3600))
+DEMAND_DAYS = int(os.environ.get("DEMAND_DAYS", 28))
+DEMAND_REFRESH = int(os.environ.get("DEMAND_REFRESH", 21600))
+DB_PATH = os.environ.get("DB_PATH", "fbo.db")
+LABEL_DIR = os.environ.get("LABEL_DIR", "labels")
+LABEL_KEEP_DAYS = float(os.environ.get("LABEL_KEEP_DAYS", 30))
+DRAFT_MAX_ITEMS = int(os.environ.get("DRAFT_MAX_ITEMS", 5000))
+XLSX_MAX_BYTES = int(os.environ.get("XLSX_MAX_BYTES", 20 * 1024 * 1024))  # XLSX (zip) читается в память целиком
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+JOB_POLL = float(os.environ.get("JOB_POLL", 3))
+JOB_TIMEOUT = float(os.environ.get("JOB_TIMEOUT", 900))
+LOG_CAPACITY = int(os.environ.get("LOG_CAPACITY", 500))
+LOG_FILE = os.environ.get("LOG_FILE", "")
+LOG_FILE_MAX = int(os.environ.get("LOG_FILE_MAX", 10 * 1024 * 1024))
+EVENTS_BACKLOG = int(os.environ.get("EVENTS_BACKLOG", 1000))
+CARGO_BATCH = int(os.environ.get("CARGO_BATCH", 100))
 OZON_CLIENT_ID = os.environ.get("OZON_CLIENT_ID", "1321895")
 OZON_API_KEY = os.environ.get("OZON_API_KEY", "1ccae2c9-ee7f-4f3f-bac1-e14e38bc11f3")
+ACCOUNTS_FILE = os.environ.get("ACCOUNTS_FILE", "accounts.json")
 
-OZON_API = "https://api-seller.ozon.ru"
-LOGS = []
+OZON_API = os.environ.get("OZON_API", "https://api-seller.ozon.ru")
 
-def log(level, ep, msg):
-    entry = {"time": datetime.now().strftime("%H:%M:%S"), "level": level, "endpoint": ep, "message": str(msg)[:500]}
-    LOGS.insert(0, entry)
-    if len(LOGS) > 500: LOGS.pop()
-    print(f"[{entry['time']}] [{level.upper()}] {ep}: {str(msg)[:100]}")
+# Справочные методы, ответы которых можно отдавать из кэша (TTL в секундах)
+CACHE_TTL = {
+    "/v1/cluster/list": 3600,
+    "/v1/warehouse/fbo/list": 300,
+    "/v1/warehouse/list": 300,
+    "/v3/product/list": 120,
+}
+# Методы, меняющие данные в кабинете: идут мимо кэша и сбрасывают его
+CACHE_INVALIDATE = {"/v1/draft/create", "/v1/supply-order/cancel"}
+# Методы, создающие черновики и заявки: их результаты сохраняются в локальной базе
+DRAFT_ENDPOINTS = {"/v1/draft/create", "/v1/draft/supply/create"}
+WAREHOUSE_ENDPOINTS = {"/v1/warehouse/fbo/list", "/v1/warehouse/list"}
+# Лимиты запросов к Seller API: метод -> [запросов в секунду, размер пачки].
+# Переопределяются JSON-объектом в OZON_RATE_LIMITS, "default" действует для остальных методов
+RATE_LIMITS = {
+    "default": [10, 20],
+    "/v1/draft/create": [1, 2],
+    "/v1/draft/supply/create": [1, 2],
+    "/v1/supply-order/cancel": [1, 2],
+    "/v1/cargoes/create": [1, 2],
+}
+RATE_LIMITS.update(json.loads(os.environ.get("OZON_RATE_LIMITS") or "{}"))
+# Методы только для чтения: одинаковые одновременные запросы объединяются в один
+READ_ONLY = set(CACHE_TTL) | {
+    "/v1/supply-order/list", "/v1/supply/list", "/v2/supply-order/list", "/v2/supply-order/get",
+    "/v1/draft/create/info", "/v1/draft/timeslot/info", "/v1/draft/supply/create/status",
+    "/v4/product/info/attributes", "/v1/cargoes/create/info", "/v1/cargoes-label/get", "/v1/cargoes-label/file",
+    "/v2/analytics/stock_on_warehouses", "/v2/posting/fbo/list",
+}
+# Методы, которые вызывает приложение. Прочие пути из /ozon/ в метриках и лимитере сводятся к "other",
+# чтобы произвольный путь от клиента не порождал новые ряды метрик и корзины лимитера
+KNOWN_ENDPOINTS = READ_ONLY | CACHE_INVALIDATE | DRAFT_ENDPOINTS | WAREHOUSE_ENDPOINTS | set(RATE_LIMITS) | {
+    "/v3/product/info/list", "/v1/cargoes-label/create",
+}
 
-def ozon_request(endpoint, body=None):
-    headers = {"Content-Type": "application/json", "Client-Id": OZON_CLIENT_ID, "Api-Key": OZON_API_KEY}
-    log("request", endpoint, f"Body: {json.dumps(body, ensure_ascii=False)[:200] if body else 'empty'}")
+def endpoint_label(endpoint):
+    return endpoint if endpoint in KNOWN_ENDPOINTS else "other"
+# Шаблоны грузомест: внутренние размеры в мм и допустимый вес в граммах.
+# Переопределяются JSON-списком в CARGO_TEMPLATES
+CARGO_TEMPLATES = json.loads(os.environ.get("CARGO_TEMPLATES") or "null") or [
+    {"name": "Коробка 30×20×20", "type": "BOX", "size": [300, 200, 200], "max_weight": 25000},
+    {"name": "Коробка 40×30×30", "type": "BOX", "size": [400, 300, 300], "max_weight": 25000},
+    {"name": "Коробка 60×40×40", "type": "BOX", "size": [600, 400, 400], "max_weight": 25000},
+    {"name": "Палета 120×80", "type": "PALLET", "size": [1200, 800, 1650], "max_weight": 500000},
+]
+
+class EventHub:
+    """Рассылка событий подписчикам /events (Server-Sent Events). Подписчик не держит
+    воркер: после заголовков сокет переходит сюда, и все сокеты обслуживает один поток
+    на selectors. publish только дописывает готовый кадр в буферы и будит этот поток."""
+    HEARTBEAT = 15                # комментарий-пинг, чтобы прокси не закрывали соединение
+    MAX_BUFFER = 1024 * 1024      # подписчик, отставший больше чем на мегабайт, отключается
+
+    def __init__(self, backlog=EVENTS_BACKLOG):
+        self.backlog = deque(maxlen=backlog)  # (id, тип, кадр, аккаунт) для повтора по Last-Event-ID
+        self.seq = itertools.count(1)
+        self.clients = {}  # сокет -> {"types": set или None, "account": Account, "out": bytearray}
+        self.lock = threading.Lock()
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.started = False
+
+    def publish(self, kind, data, account=None):
+        """Событие аккаунта account (по умолчанию текущего) получают только его подписчики."""
+        account = account or ACCOUNT.get()
+        with self.lock:
+            event_id = next(self.seq)
+            frame = b"id: %d\nevent: %s\ndata: %s\n\n" % (event_id, kind.encode(), json_dumps(data))
+            self.backlog.append((event_id, kind, frame, account))
+            if not self.clients: return
+            for client in self.clients.values():
+                if client["account"] is account and (client["types"] is None or kind in client["types"]): client["out"] += frame
+        self.wake()
+
+    def subscribe(self, sock, types=None, last_id=0, account=None):
+        """Забирает сокет с уже отправленными заголовками ответа и повторяет пропущенное после last_id."""
+        account = account or ACCOUNT.get()
+        sock.setblocking(False)
+        out = bytearray(b"retry: 3000\n\n")
+        with self.lock:
+            for event_id, kind, frame, owner in self.backlog:
+                if event_id > last_id and owner is account and (types is None or kind in types): out += frame
+            self.clients[sock] = {"types": types, "account": account, "out": out}
+            if not self.started:
+                threading.Thread(target=self.loop, name="events", daemon=True).start()
+                self.started = True
+        self.wake()
+
+    def wake(self):
+        try: self.wake_w.send(b"\0")
+        except OSError: pass  # буфер полон - поток и так проснётся
+
+    def count(self):
+        with self.lock: return len(self.clients)
+
+    def loop(self):
+        sel = selectors.DefaultSelector()
+        sel.register(self.wake_r, selectors.EVENT_READ)
+        registered = {}  # сокет -> маска, трогается только из этого потока
+        beat = time.monotonic() + self.HEARTBEAT
+        while True:
+            for key, _ in sel.select(max(beat - time.monotonic(), 0)):
+                if key.fileobj is self.wake_r:
+                    try: self.wake_r.recv(4096)
+                    except OSError: pass
+                    continue
+                try: closed = key.fileobj.recv(4096) == b""  # клиент ничего не шлёт, кроме закрытия
+                except BlockingIOError: closed = False
+                except OSError: closed = True
+                if closed: self.drop(sel, registered, key.fileobj)
+            with self.lock:
+                if time.monotonic() >= beat:
+                    beat = time.monotonic() + self.HEARTBEAT
+                    for client in self.clients.values(): client["out"] += b": ping\n\n"
+                clients = list(self.clients.items())
+            for sock, client in clients: self.flush(sel, registered, sock, client)
+
+    def flush(self, sel, registered, sock, client):
+        with self.lock:
+            try:
+                if client["out"]: del client["out"][:sock.send(client["out"])]
+            except BlockingIOError:
+                pass
+            except OSError:
+                client["out"] = None
+            pending = client["out"]
+        if pending is None or len(pending) > self.MAX_BUFFER:
+            self.drop(sel, registered, sock)
+            return
+        mask = selectors.EVENT_READ | (selectors.EVENT_WRITE if pending else 0)
+        if sock not in registered: sel.register(sock, mask)
+        elif registered[sock] != mask: sel.modify(sock, mask)
+        registered[sock] = mask
+
+    def drop(self, sel, registered, sock):
+        with self.lock: self.clients.pop(sock, None)
+        if registered.pop(sock, None) is not None: sel.unregister(sock)
+        sock.close()
+
+EVENTS = EventHub()
+
+
+class LogStore:
+    """Кольцевой буфер последних записей лога фиксированного размера.
+    Если задан путь, записи дублируются в JSON-lines файл фоновым потоком с ротацией по размеру."""
+
+    def __init__(self, capacity=LOG_CAPACITY, path=LOG_FILE, max_bytes=LOG_FILE_MAX):
+        self.entries = deque(maxlen=capacity)
+        self.seq = itertools.count(1)
+        self.lock = threading.Lock()
+        self.path, self.max_bytes = path, max_bytes
+        self.sink = queue.Queue(10000) if path else None
+        if self.sink: threading.Thread(target=self.writer, name="log-writer", daemon=True).start()
+
+    def append(self, entry):
+        with self.lock:
+            entry["id"] = next(self.seq)
+            self.entries.append(entry)
+        if self.sink:
+            try: self.sink.put_nowait(entry)
+            except queue.Full: pass  # файл не успевает - теряем запись в файле, но не блокируем запрос
+
+    def query(self, since=0, level=None, endpoint=None, limit=None):
+        """Записи новее since (id), от новых к старым, с фильтрами по уровню и подстроке endpoint."""
+        with self.lock: entries = list(self.entries)
+        out = []
+        for entry in reversed(entries):
+            if entry["id"] <= since: break
+            if level and entry["level"] != level: continue
+            if endpoint and endpoint not in entry["endpoint"]: continue
+            out.append(entry)
+            if limit and len(out) >= limit: break
+        return out
+
+    def writer(self):
+        f = open(self.path, "a", encoding="utf-8")
+        while True:
+            batch = [self.sink.get()]
+            while not self.sink.empty() and len(batch) < 1000: batch.append(self.sink.get_nowait())
+            f.write(b"".join(json_dumps(entry) + b"\n" for entry in batch).decode())
+            f.flush()
+            if f.tell() >= self.max_bytes:
+                f.close()
+                os.replace(self.path, self.path + ".1")
+                f = open(self.path, "a", encoding="utf-8")
+
+LOGS = LogStore()
+
+def log(level, ep, msg):
+    account = ACCOUNT.get()
+    entry = {"time": datetime.now().strftime("%H:%M:%S"), "level": level, "endpoint": ep, "message": str(msg)[:500],
+             "account": account.name}
+    account.logs.append(entry)
+    EVENTS.publish("log", entry, account)
+    print(f"[{entry['time']}] [{level.upper()}] {ep}: {str(msg)[:100]}" if account is ACCOUNTS.default else
+          f"[{entry['time']}] [{level.upper()}] [{account.name}] {ep}: {str(msg)[:100]}")
+
+
+class Metrics:
+    """Счётчики и гистограммы с метками, отдаются в текстовом формате Prometheus."""
+    SECONDS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+    BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+    def __init__(self):
+        self.meta = {}    # имя -> (тип, описание, границы корзин)
+        self.values = {}  # (имя, метки) -> число или [корзины..., сумма, количество]
+        self.lock = threading.Lock()
+
+    def counter(self, name, help_text):
+        self.meta[name] = ("counter", help_text, None)
+
+    def histogram(self, name, help_text, buckets=SECONDS):
+        self.meta[name] = ("histogram", help_text, buckets)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self.lock: self.values[key] = self.values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        buckets = self.meta[name][2]
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self.lock:
+            h = self.values.get(key)
+            if h is None: h = self.values[key] = [0] * len(buckets) + [0.0, 0]
+            i = bisect.bisect_left(buckets, value)
+            if i < len(buckets): h[i] += 1  # больше последней границы - только в +Inf
+            h[-2] += value
+            h[-1] += 1
+
+    @staticmethod
+    def labels(pairs, extra=()):
+        pairs = list(pairs) + list(extra)
+        if not pairs: return ""
+        esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+    def render(self):
+        with self.lock: values = {key: list(v) if isinstance(v, list) else v for key, v in self.values.items()}
+        lines = []
+        for name, (kind, help_text, buckets) in self.meta.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for (metric, labels), value in sorted(values.items()):
+                if metric != name: continue
+                if kind == "counter":
+                    lines.append(f"{name}{self.labels(labels)} {value}")
+                    continue
+                total = 0
+                for bound, n in zip(buckets, value):
+                    total += n
+                    lines.append(f"{name}_bucket{self.labels(labels, [('le', bound)])} {total}")
+                lines.append(f"{name}_bucket{self.labels(labels, [('le', '+Inf')])} {value[-1]}")
+                lines.append(f"{name}_sum{self.labels(labels)} {value[-2]}")
+                lines.append(f"{name}_count{self.labels(labels)} {value[-1]}")
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+METRICS.counter("ozon_requests_total", "Запросы к Seller API, включая повторы")
+METRICS.counter("ozon_errors_total", "Ошибки Seller API по коду ответа")
+METRICS.counter("ozon_retries_total", "Повторы запросов к Seller API")
+METRICS.counter("ozon_cache_total", "Ответы прокси /ozon/ по статусу кэша")
+METRICS.histogram("ozon_upstream_seconds", "Время ответа Seller API")
+METRICS.histogram("ozon_limiter_wait_seconds", "Ожидание в лимитере запросов")
+METRICS.histogram("ozon_backoff_seconds", "Пауза перед повтором запроса")
+METRICS.histogram("ozon_json_decode_seconds", "Разбор JSON ответа Seller API")
+METRICS.histogram("ozon_response_bytes", "Размер ответа Seller API", Metrics.BYTES)
+METRICS.counter("http_requests_total", "Запросы к приложению")
+METRICS.counter("http_rejected_total", "Запросы, отклонённые с 503 из-за переполненной очереди")
+METRICS.histogram("http_request_seconds", "Время обработки запроса к приложению")
+METRICS.histogram("http_queue_wait_seconds", "Ожидание запроса в очереди воркеров")
+METRICS.histogram("http_response_bytes", "Размер ответа приложения", Metrics.BYTES)
+
+class ConnectionPool:
+    """Keep-alive соединения к upstream, по пулу на хост, с общим SSL-контекстом."""
+    RETRYABLE = (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError, BrokenPipeError)
+
+    def __init__(self, size=POOL_SIZE, idle=POOL_IDLE, timeout=30):
+        self.size, self.idle, self.timeout = size, idle, timeout
+        self.ctx = ssl.create_default_context()
+        self.free = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def alive(conn):
+        # Простаивающий сокет не должен быть читаемым: иначе сервер его закрыл
+        if conn.sock is None: return False
+        try: readable, _, _ = select.select([conn.sock], [], [], 0)
+        except (OSError, ValueError): return False
+        return not readable
+
+    def acquire(self, scheme, host):
+        now = time.monotonic()
+        with self.lock:
+            conns = self.free.setdefault((scheme, host), [])
+            while conns:
+                conn, used = conns.pop()
+                if now - used < self.idle and self.alive(conn): return conn, True
+                conn.close()
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, timeout=self.timeout, context=self.ctx), False
+        return http.client.HTTPConnection(host, timeout=self.timeout), False
+
+    def release(self, scheme, host, conn):
+        with self.lock:
+            conns = self.free.setdefault((scheme, host), [])
+            if len(conns) < self.size:
+                conns.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def request(self, method, url, body=None, headers=None, consume=None, idempotent=False):
+        """Возвращает (status, headers, тело). consume(resp) может прочитать тело сам,
+        например потоком к клиенту; тогда вместо тела возвращается его результат.
+        Запрос, ушедший целиком, повторяется на новом сокете только при idempotent:
+        сервер мог его уже выполнить."""
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        while True:
+            conn, reused = self.acquire(parts.scheme, parts.netloc)
+            sent = False
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                sent = True
+                resp = conn.getresponse()
+            except self.RETRYABLE:
+                conn.close()
+                if reused and (not sent or idempotent): continue  # сервер закрыл keep-alive сокет, пробуем новый
+                raise
+            except Exception:
+                conn.close()
+                raise
+            try:
+                data = consume(resp) if consume else resp.read()
+            except Exception:
+                conn.close()
+                raise
+            if resp.will_close or not resp.isclosed(): conn.close()
+            else: self.release(parts.scheme, parts.netloc, conn)
+            return resp.status, resp.headers, data
+
+    def close(self):
+        with self.lock:
+            for conns in self.free.values():
+                for conn, _ in conns: conn.close()
+            self.free.clear()
+
+OZON_POOL = ConnectionPool()
+
+
+class TokenBucket:
+    """Token bucket с резервированием: при нехватке токенов вызывающий ждёт своей очереди."""
+
+    def __init__(self, rate, burst):
+        self.rate, self.burst = float(rate), float(burst)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def acquire(self):
+        """Берёт токен, при необходимости засыпает. Возвращает время ожидания в секундах."""
+        with self.lock:
+            self.refill()
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait: time.sleep(wait)
+        return wait
+
+    def pause(self, seconds):
+        """Не выдавать токены ближайшие seconds секунд (ответ 429 / Retry-After)."""
+        with self.lock:
+            self.refill()
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class RateLimiter:
+    def __init__(self, limits=RATE_LIMITS):
+        # Неверные лимиты (OZON_RATE_LIMITS, rate_limits аккаунта) должны ронять запуск, а не первый запрос
+        if "default" not in limits: raise ValueError("В лимитах запросов нет \"default\"")
+        for endpoint, limit in limits.items():
+            if not (isinstance(limit, (list, tuple)) and len(limit) == 2 and
+                    all(isinstance(v, (int, float)) and math.isfinite(v) and v > 0 for v in limit)):
+                raise ValueError(f"Лимит {endpoint}: ожидается [запросов в секунду > 0, пачка > 0], получено {limit!r}")
+        self.limits = limits
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, endpoint):
+        if endpoint not in self.limits: endpoint = endpoint_label(endpoint)  # у всех неизвестных путей одна корзина
+        with self.lock:
+            if endpoint not in self.buckets:
+                self.buckets[endpoint] = TokenBucket(*self.limits.get(endpoint, self.limits["default"]))
+            return self.buckets[endpoint]
+
+    def acquire(self, endpoint):
+        return self.bucket(endpoint).acquire()
+
+    def pause(self, endpoint, seconds):
+        self.bucket(endpoint).pause(seconds)
+
+OZON_LIMITER = RateLimiter()
+def retry_after(value):
+    """Секунды из заголовка Retry-After (число или HTTP-дата), None если заголовка нет."""
+    if not value: return None
+    try: return max(float(value), 0.0)
+    except ValueError: pass
+    try: return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError): return None
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    # Exponential backoff с full jitter
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class ResponseCache:
+    """LRU-кэш ответов с TTL на запись и ограничением по суммарному размеру в байтах."""
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.items = OrderedDict()  # key -> (expires, size, (result, сырой ответ))
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(endpoint, body):
+        return endpoint + " " + json_dumps(body or {}, sort_keys=True).decode()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None: return None
+            if item[0] <= time.monotonic():
+                self.drop(key)
+                return None
+            self.items.move_to_end(key)
+            return item[2]
+
+    def put(self, key, value, ttl, size):
+        if size > self.max_bytes: return
+        with self.lock:
+            if key in self.items: self.drop(key)
+            self.items[key] = (time.monotonic() + ttl, size, value)
+            self.size += size
+            while self.size > self.max_bytes: self.drop(next(iter(self.items)))
+
+    def drop(self, key):
+        self.size -= self.items.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+OZON_CACHE = ResponseCache()
+
+
+class Store:
+    """SQLite-хранилище (WAL) каталога, складов, справочных ответов и созданных черновиков.
+    Данные аккаунтов разделены колонкой client_id (ключи ответов и meta - префиксом Client-Id),
+    методы работают с данными текущего аккаунта. Пока open() не вызван, все операции ничего не делают."""
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS products (client_id TEXT NOT NULL, product_id INTEGER, data TEXT NOT NULL, fingerprint TEXT,
+                                         PRIMARY KEY (client_id, product_id));
+    CREATE TABLE IF NOT EXISTS warehouses (client_id TEXT NOT NULL, warehouse_id INTEGER, data TEXT NOT NULL, updated_at REAL,
+                                           PRIMARY KEY (client_id, warehouse_id));
+    CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, endpoint TEXT, data TEXT NOT NULL, fetched_at REAL);
+    CREATE TABLE IF NOT EXISTS drafts (id TEXT PRIMARY KEY, endpoint TEXT, request TEXT, response TEXT, created_at TEXT);
+    CREATE TABLE IF NOT EXISTS demand (client_id TEXT NOT NULL, sku INTEGER, cluster_id INTEGER, stock INTEGER, sold INTEGER,
+                                       PRIMARY KEY (client_id, sku, cluster_id));
+    CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """
+    # Колонки, добавленные после создания таблиц: в старую базу дописываются при open()
+    COLUMNS = [("drafts", "draft_id TEXT"), ("drafts", "client_id TEXT")]
+    # Таблицы, у которых client_id вошёл в первичный ключ: старая таблица пересоздаётся.
+    # Строки и ключи meta базы без аккаунтов достаются аккаунту по умолчанию
+    OWNED = ("products", "warehouses", "demand")
+    OWNED_META = ("catalog_synced_at", "catalog_full_at", "demand_clusters", "demand_synced_at")
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self.db = None
+        self.lock = threading.Lock()
+
+    def open(self):
+        if not self.path: return self
+        self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.migrate(ACCOUNTS.default.client_id)
+        return self
+
+    def columns(self, table):
+        return [row[1] for row in self.db.execute(f"PRAGMA table_info({table})")]
+
+    def migrate(self, owner):
+        """Создаёт таблицы и доводит старую базу до текущей схемы одной транзакцией."""
+        old = {table: cols for table in self.OWNED if (cols := self.columns(table)) and "client_id" not in cols}
+        self.db.execute("BEGIN")
+        try:
+            for table in old: self.db.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+            for statement in self.SCHEMA.split(";"):
+                if statement.strip(): self.db.execute(statement)
+            for table, cols in old.items():
+                self.db.execute(f"INSERT INTO {table} (client_id, {', '.join(cols)}) SELECT ?, {', '.join(cols)} FROM {table}_old", (owner,))
+                self.db.execute(f"DROP TABLE {table}_old")
+            for table, column in self.COLUMNS:
+                if column.split()[0] not in self.columns(table): self.db.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+            self.db.execute("UPDATE drafts SET client_id = ? WHERE client_id IS NULL", (owner,))
+            if old:
+                self.db.executemany("UPDATE meta SET key = ? WHERE key = ?", [(f"{owner}:{key}", key) for key in self.OWNED_META])
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def owner():
+        return ACCOUNT.get().client_id
+
+    @staticmethod
+    def owned(key):
+        """Ключ meta, относящийся к текущему аккаунту."""
+        return f"{ACCOUNT.get().client_id}:{key}"
+
+    def write(self, *statements):
+        """Выполняет пачку (sql, rows) одной транзакцией через executemany."""
+        if self.db is None: return
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                for sql, rows in statements: self.db.executemany(sql, rows)
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def read(self, sql, args=()):
+        if self.db is None: return []
+        with self.lock: return self.db.execute(sql, args).fetchall()
+
+    def get_meta(self, key):
+        rows = self.read("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def set_meta(self, key, value):
+        self.write(("INSERT OR REPLACE INTO meta VALUES (?, ?)", [(key, value)]))
+
+    def save_products(self, products, removed=(), synced_at=None):
+        """products: [(product_id, товар, слепок)]."""
+        owner = self.owner()
+        self.write(
+            ("INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?)",
+             [(owner, pid, json_dumps(product).decode(), fp) for pid, product, fp in products]),
+            ("DELETE FROM products WHERE client_id = ? AND product_id = ?", [(owner, pid) for pid in removed]),
+            ("INSERT OR REPLACE INTO meta VALUES (?, ?)", [(self.owned("catalog_synced_at"), synced_at)] if synced_at else []),
+        )
+
+    def products(self):
+        return [(pid, json_loads(data), fp) for pid, data, fp in
+                self.read("SELECT product_id, data, fingerprint FROM products WHERE client_id = ?", (self.owner(),))]
+
+    def save_response(self, key, endpoint, raw, data=None):
+        """raw - ответ Ozon как есть, data - он же разобранный (если уже есть)."""
+        rows = [(key, endpoint, raw.decode(), time.time())]
+        warehouses = []
+        if endpoint in WAREHOUSE_ENDPOINTS:
+            data = json_loads(raw) if data is None else data
+            items = (data.get("result") or data.get("search") or []) if isinstance(data, dict) else []
+            if isinstance(items, dict): items = items.get("items") or []
+            warehouses = [(self.owner(), w.get("warehouse_id") or w.get("id"), json_dumps(w).decode(), time.time())
+                          for w in items if isinstance(w, dict) and (w.get("warehouse_id") or w.get("id"))]
+        self.write(("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", rows),
+                   ("INSERT OR REPLACE INTO warehouses VALUES (?, ?, ?, ?)", warehouses))
+
+    def response(self, key, ttl):
+        """Сохранённый ответ моложе ttl: (сырой ответ, возраст в секундах) или None. Разбирает тот, кому нужен результат."""
+        rows = self.read("SELECT data, fetched_at FROM responses WHERE key = ?", (key,))
+        if not rows or time.time() - rows[0][1] >= ttl: return None
+        return rows[0][0].encode(), time.time() - rows[0][1]
+
+    def clear_responses(self, prefix):
+        """Сбрасывает сохранённые ответы аккаунта (ключи с префиксом Client-Id) вслед за кэшем в памяти."""
+        self.write(("DELETE FROM responses WHERE substr(key, 1, ?) = ?", [(len(prefix), prefix)]))
+
+    def warehouses(self):
+        return [json_loads(data) for data, in self.read("SELECT data FROM warehouses WHERE client_id = ? ORDER BY warehouse_id",
+                                                        (self.owner(),))]
+
+    def save_demand(self, cells, clusters, synced_at):
+        """cells: {(sku, cluster_id): (остаток, продано)}, clusters: {cluster_id: название}."""
+        owner = self.owner()
+        self.write(("DELETE FROM demand WHERE client_id = ?", [(owner,)]),
+                   ("INSERT INTO demand VALUES (?, ?, ?, ?, ?)", [(owner, sku, cid, st, so) for (sku, cid), (st, so) in cells.items()]),
+                   ("INSERT OR REPLACE INTO meta VALUES (?, ?)", [(self.owned("demand_clusters"), json_dumps(clusters).decode()),
+                                                                (self.owned("demand_synced_at"), synced_at)]))
+
+    def demand(self):
+        clusters = self.get_meta(self.owned("demand_clusters"))
+        cells = {(sku, cid): (st, so) for sku, cid, st, so in
+                 self.read("SELECT sku, cluster_id, stock, sold FROM demand WHERE client_id = ?", (self.owner(),))}
+        return cells, {int(k): v for k, v in json_loads(clusters).items()} if clusters else {}
+
+    def save_draft(self, endpoint, request, response):
+        draft_id = str(response.get("draft_id") or response.get("operation_id") or response.get("supply_order_id")
+                       or response.get("result") or f"local-{time.time_ns()}")
+        self.write(("INSERT OR REPLACE INTO drafts (id, endpoint, request, response, created_at, draft_id, client_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(draft_id, endpoint, json_dumps(request).decode(), json_dumps(response).decode(),
+                      datetime.now().isoformat(timespec="seconds"), response.get("draft_id"), self.owner())]))
+        return draft_id
+
+    def link_draft(self, operation_id, draft_id):
+        """/v1/draft/create отдаёт только operation_id: draft_id из /v1/draft/create/info дописывается к записи."""
+        self.write(("UPDATE drafts SET draft_id = ? WHERE id = ? AND client_id = ? AND draft_id IS NULL",
+                    [(str(draft_id), str(operation_id), self.owner())]))
+
+    def drafts(self, limit=100):
+        rows = self.read("SELECT id, endpoint, request, response, created_at, draft_id FROM drafts WHERE client_id = ? "
+                         "ORDER BY created_at DESC LIMIT ?", (self.owner(), limit))
+        return [{"id": i, "endpoint": ep, "request": json_loads(req), "response": json_loads(resp), "created_at": at, "draft_id": d}
+                for i, ep, req, resp, at, d in rows]
+
+    def draft(self, draft_id):
+        """Тело запроса, с которым был создан черновик draft_id (или operation_id), или None."""
+        rows = self.read("SELECT request FROM drafts WHERE client_id = ? AND (draft_id = ? OR id = ?) LIMIT 1",
+                         (self.owner(), str(draft_id), str(draft_id)))
+        return json_loads(rows[0][0]) if rows else None
+
+STORE = Store()
+
+
+class SingleFlight:
+    """Одновременные вызовы с одинаковым ключом выполняются один раз, результат получают все."""
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Возвращает (result, shared): shared=True, если результат получен от чужого вызова."""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader: call = self.calls[key] = {"done": threading.Event(), "result": None, "error": None}
+        if not leader:
+            call["done"].wait()
+            if call["error"]: raise call["error"]
+            return call["result"], True
+        try:
+            call["result"] = fn()
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock: del self.calls[key]
+            call["done"].set()
+        return call["result"], False
+
+OZON_FLIGHT = SingleFlight()
+
+
+class Account:
+    """Аккаунт продавца со своими ключами и своими пулом соединений, лимитами,
+    кэшем ответов, логом, каталогом, заявками и спросом: шумный аккаунт не расходует
+    чужие лимиты и кэш, а товары одного аккаунта не попадают в черновики другого."""
+
+    def __init__(self, name, client_id, api_key, rate_limits=None, pool=None, limiter=None, cache=None, flight=None, logs=None):
+        self.name, self.client_id, self.api_key = name, str(client_id), api_key
+        self.pool = pool or ConnectionPool()
+        self.limiter = limiter or RateLimiter({**RATE_LIMITS, **(rate_limits or {})})
+        self.cache = cache or ResponseCache()
+        self.flight = flight or SingleFlight()
+        if logs is None:
+            root, ext = os.path.splitext(LOG_FILE)
+            logs = LogStore(path=f"{root}-{name}{ext}" if LOG_FILE else "")
+        self.logs = logs
+        self.catalog = self.supplies = self.demand = None  # см. attach()
+
+    def attach(self, catalog=None, supplies=None, demand=None):
+        """Свои Catalog, Supplies и DemandPlanner; у аккаунта по умолчанию это CATALOG, SUPPLIES и DEMAND."""
+        self.catalog, self.supplies, self.demand = catalog or Catalog(), supplies or Supplies(), demand or DemandPlanner()
+        return self
+
+    @property
+    def prefix(self):
+        """Префикс ключей кэша и сохранённых ответов."""
+        return f"{self.client_id}:"
+
+    def summary(self):
+        return {"name": self.name, "client_id": self.client_id, "default": self is ACCOUNTS.default}
+
+
+class Accounts:
+    """Аккаунты из ACCOUNTS_FILE (JSON-список {"name", "client_id", "api_key", "rate_limits"}).
+    Первый становится аккаунтом по умолчанию; без файла он один - из OZON_CLIENT_ID/OZON_API_KEY."""
+
+    def __init__(self):
+        self.default = Account("default", OZON_CLIENT_ID, OZON_API_KEY, pool=OZON_POOL, limiter=OZON_LIMITER,
+                               cache=OZON_CACHE, flight=OZON_FLIGHT, logs=LOGS)
+        self.items = {self.default.name: self.default}
+
+    def load(self, path=ACCOUNTS_FILE):
+        if not path or not os.path.exists(path): return
+        with open(path, encoding="utf-8") as f: entries = json.load(f)
+        if not isinstance(entries, list) or not entries: raise ValueError(f"{path}: ожидается непустой список аккаунтов")
+        items = {}
+        for i, e in enumerate(entries):
+            if not e.get("client_id") or not e.get("api_key"): raise ValueError(f"{path}: у аккаунта {i + 1} нет client_id или api_key")
+            name = str(e.get("name") or e["client_id"])
+            if i == 0:
+                account = self.default
+                account.name, account.client_id, account.api_key = name, str(e["client_id"]), e["api_key"]
+                if e.get("rate_limits"): account.limiter = RateLimiter({**RATE_LIMITS, **e["rate_limits"]})
+            else:
+                account = Account(name, e["client_id"], e["api_key"], e.get("rate_limits")).attach()
+            items[name] = account
+        self.items = items
+
+    def get(self, selector=None):
+        """Аккаунт по имени или Client-Id; None - аккаунт по умолчанию."""
+        if selector is None or isinstance(selector, Account): return selector or self.default
+        account = self.items.get(str(selector)) or next((a for a in self.items.values() if a.client_id == str(selector)), None)
+        if account is None: raise ValueError(f"Неизвестный аккаунт: {selector}")
+        return account
+
+    def list(self):
+        return [a.summary() for a in self.items.values()]
+
+    def __iter__(self):
+        return iter(list(self.items.values()))
+
+ACCOUNTS = Accounts()
+ACCOUNT = contextvars.ContextVar("account", default=ACCOUNTS.default)  # аккаунт текущего запроса или задачи
+
+
+@contextlib.contextmanager
+def using(account):
+    """Вызовы Seller API, лог и кэш внутри блока относятся к account (имя, Client-Id или Account)."""
+    token = ACCOUNT.set(ACCOUNTS.get(account))
+    try: yield
+    finally: ACCOUNT.reset(token)
+
+def bound(fn):
+    """fn для выполнения в другом потоке (пул) от имени текущего аккаунта."""
+    account = ACCOUNT.get()
+    def run(*args):
+        with using(account): return fn(*args)
+    return run
+
+def account_arg(fn):
+    """Добавляет функции аргумент account=: вызов целиком выполняется от имени этого аккаунта."""
+    @functools.wraps(fn)
+    def call(*args, account=None, **kwargs):
+        if account is None: return fn(*args, **kwargs)
+        with using(account): return fn(*args, **kwargs)
+    return call
+
+
+class StreamAborted(Exception):
+    """Ответ уже начал уходить клиенту и оборвался: повторять запрос нельзя."""
+
+
+@account_arg
+def ozon_send(endpoint, data, consume=None, method="POST", suffix=""):
+    """Запрос к Seller API через лимитер и с повторами, без разбора ответа.
+    Возвращает (status, headers, тело); успешный ответ можно прочитать потоком через consume(resp).
+    suffix дописывается к адресу (идентификатор в пути), лимиты и метрики считаются по endpoint.
+    Сетевая ошибка после исчерпания повторов пробрасывается."""
+    account, label = ACCOUNT.get(), endpoint_label(endpoint)
+    headers = {"Content-Type": "application/json", "Client-Id": account.client_id, "Api-Key": account.api_key}
+    log("request", endpoint, f"Body: {data[:200].decode(errors='replace') if data not in (b'', b'{}') else 'empty'}")
+
+    def read(resp):
+        if not consume or resp.status >= 400: return resp.read()
+        try: return consume(resp)
+        except Exception as e: raise StreamAborted(e) from e
+
+    # 429 повторяем всегда (запрос не выполнен), 5xx и сетевые ошибки - только для чтения
+    idempotent = endpoint in READ_ONLY
+    for attempt in range(OZON_RETRIES + 1):
+        last = attempt == OZON_RETRIES
+        if attempt: METRICS.inc("ozon_retries_total", endpoint=label, account=account.name)
+        METRICS.observe("ozon_limiter_wait_seconds", account.limiter.acquire(endpoint), endpoint=label, account=account.name)
+        METRICS.inc("ozon_requests_total", endpoint=label, account=account.name)
+        started = time.perf_counter()
+        try:
+            status, resp_headers, payload = account.pool.request(method, f"{OZON_API}{endpoint}{suffix}", data, headers, read, idempotent)
+        except StreamAborted:
+            raise
+        except Exception as e:
+            METRICS.observe("ozon_upstream_seconds", time.perf_counter() - started, endpoint=label, account=account.name)
+            METRICS.inc("ozon_errors_total", endpoint=label, account=account.name, code="network")
+            if not idempotent or last: raise
+            delay = backoff_delay(attempt)
+            log("retry", endpoint, f"{str(e)[:200]}; повтор через {delay:.1f} с")
+            METRICS.observe("ozon_backoff_seconds", delay, endpoint=label, account=account.name)
+            time.sleep(delay)
+            continue
+        METRICS.observe("ozon_upstream_seconds", time.perf_counter() - started, endpoint=label, account=account.name)
+        METRICS.observe("ozon_response_bytes", len(payload) if isinstance(payload, bytes) else payload, endpoint=label, account=account.name)
+        if status >= 400: METRICS.inc("ozon_errors_total", endpoint=label, account=account.name, code=status)
+        if not last and (status == 429 or (status >= 500 and idempotent)):
+            delay = retry_after(resp_headers.get("Retry-After"))
+            if delay is None: delay = backoff_delay(attempt)
+            log("retry", endpoint, f"HTTP {status}; повтор через {delay:.1f} с")
+            if status == 429:
+                account.limiter.pause(endpoint, delay)  # следующий acquire дождётся окна
+            else:
+                METRICS.observe("ozon_backoff_seconds", delay, endpoint=label, account=account.name)
+                time.sleep(delay)
+            continue
+        if status < 400: log("success", endpoint, f"OK")
+        return status, resp_headers, payload
+
+def ozon_error(endpoint, status, raw):
+    error_body = raw.decode(errors="replace")
+    log("error", endpoint, f"HTTP {status}: {error_body[:300]}")
+    return {"error": True, "code": status, "message": error_body}
+
+def ozon_decode(endpoint, raw):
+    """(result, raw) по сырому ответу Ozon; неразборчивый ответ - ошибка, как в ozon_fetch."""
+    label, started = endpoint_label(endpoint), time.perf_counter()
+    try:
+        result = json_loads(raw)
+    except ValueError as e:
+        METRICS.inc("ozon_errors_total", endpoint=label, account=ACCOUNT.get().name, code="decode")
+        log("error", endpoint, str(e)[:300])
+        return {"error": True, "message": str(e)}, None
+    METRICS.observe("ozon_json_decode_seconds", time.perf_counter() - started, endpoint=label, account=ACCOUNT.get().name)
+    return result, raw
+
+@account_arg
+def ozon_fetch(endpoint, body=None, decode=True):
+    """Как ozon_request, но вместе с результатом возвращает сырой ответ Ozon (None при ошибке).
+    С decode=False успешный ответ не разбирается: result=None, клиенту уходит raw."""
+    data = json_dumps(body) if body else b'{}'
     try:
-        ctx = ssl.create_default_context()
-        data = json.dumps(body).encode() if body else b'{}'
-        req = urllib.request.Request(f"{OZON_API}{endpoint}", data=data, headers=headers, method="POST")
-        with urllib.request.urlopen(req, context=ctx, timeout=30) as resp:
-            result = json.loads(resp.read())
-            log("success", endpoint, f"OK")
-            return result
-    except urllib.error.HTTPError as e:
-        error_body = ""
-        try: error_body = e.read().decode()
-        except: error_body = str(e)
-        log("error", endpoint, f"HTTP {e.code}: {error_body[:300]}")
-        return {"error": True, "code": e.code, "message": error_body}
+        status, _, raw = ozon_send(endpoint, data)
     except Exception as e:
         log("error", endpoint, str(e)[:300])
-        return {"error": True, "message": str(e)}
+        return {"error": True, "message": str(e)}, None
+    if status >= 400: return ozon_error(endpoint, status, raw), None
+    return ozon_decode(endpoint, raw) if decode else (None, raw)
 
+@account_arg
+def ozon_request(endpoint, body=None):
+    return ozon_fetch(endpoint, body)[0]
+
+@account_arg
+def ozon_cached(endpoint, body=None, decode=True):
+    """ozon_request через кэш справочников (память, затем локальная база)
+    и объединение одинаковых запросов. Возвращает (result, сырой ответ или None, статус кэша).
+    decode=False - для прокси: ответ нужен только байтами, и если серверу разбор не нужен,
+    result может быть None (в кэше и SingleFlight ходит raw, разбирает тот, кому нужен result)."""
+    if endpoint not in READ_ONLY:
+        result, raw = ozon_fetch(endpoint, body)
+        if endpoint in CACHE_INVALIDATE:
+            ACCOUNT.get().cache.clear()
+            STORE.clear_responses(ACCOUNT.get().prefix)
+            ACCOUNT.get().supplies.invalidate()
+            EVENTS.publish("cache", {"cleared": True, "endpoint": endpoint})
+        if endpoint in DRAFT_ENDPOINTS and raw is not None: STORE.save_draft(endpoint, body, result)
+        return result, raw, "BYPASS"
+    ttl = CACHE_TTL.get(endpoint)
+    account = ACCOUNT.get()
+    key = account.prefix + ResponseCache.key(endpoint, body)
+    def done(result, raw, status):
+        if decode and result is None and raw is not None: result, raw = ozon_decode(endpoint, raw)
+        return result, raw, status
+
+    if ttl:
+        cached = account.cache.get(key)
+        if cached is not None: return done(*cached, "HIT")
+
+    def fetch():
+        stored = STORE.response(key, ttl) if ttl else None
+        if stored:
+            raw, age = stored
+            account.cache.put(key, (None, raw), ttl - age, len(raw))
+            return None, raw, "STORE"
+        # draft_id из /v1/draft/create/info дописывается к черновику - этот ответ разбирается всегда
+        result, raw = ozon_fetch(endpoint, body, decode=decode or endpoint == "/v1/draft/create/info")
+        if endpoint == "/v1/draft/create/info" and isinstance(result, dict) and result.get("draft_id") and (body or {}).get("operation_id"):
+            STORE.link_draft(body["operation_id"], result["draft_id"])
+        if ttl and raw is not None:
+            account.cache.put(key, (result, raw), ttl, len(raw))
+            STORE.save_response(key, endpoint, raw, result)
+            EVENTS.publish("cache", {"endpoint": endpoint, "ttl": ttl})
+        return result, raw, "MISS" if ttl else "BYPASS"
+
+    (result, raw, status), shared = account.flight.do(key, fetch)
+    return done(result, raw, "SHARED" if shared else status)
+
+def ozon_passthrough(endpoint):
+    """Ответы, которые серверу не нужны (не кэшируются, не сохраняются и не объединяются), отдаются клиенту потоком без разбора.
+    Чтения (READ_ONLY) идут через ozon_cached: одинаковые опросы статусов должны объединяться в SingleFlight."""
+    return endpoint not in READ_ONLY and endpoint not in DRAFT_ENDPOINTS and endpoint not in CACHE_INVALIDATE
+
+def chunks(seq, n):
+    seq = list(seq)
+    return [seq[i:i + n] for i in range(0, len(seq), n)]
+
+
+class ProductIndex:
+    """Инвертированный индекс по названию, offer_id, product_id и SKU:
+    точные совпадения, префиксы и нечёткий поиск по триграммам слов.
+    Ранжирование идёт по уровням оценки, поэтому вся работа сводится к операциям над множествами."""
+    EXPAND = 200  # сколько слов словаря разворачивать из одного слова запроса
+
+    def __init__(self):
+        self.postings = {}  # слово -> {вес поля: множество product_id}
+        self.trigrams = {}  # триграмма -> слова словаря
+        self.words = {}     # product_id -> {слово: вес поля}
+        self.vocab = []
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def tokenize(text):
+        return re.findall(r"\w+", str(text).lower().replace("ё", "е"))
+
+    @staticmethod
+    def grams(word):
+        word = f" {word} "
+        return {word[i:i + 3] for i in range(len(word) - 2)}
+
+    def product_words(self, product):
+        """Слова товара с весом поля: совпадение по идентификаторам весит больше, чем по названию."""
+        words = dict.fromkeys(self.tokenize(product.get("name") or ""), 1)
+        for value in [product.get("offer_id"), product.get("product_id"), *Catalog.skus(product)]:
+            if value is None: continue
+            whole = str(value).lower().replace("ё", "е")  # артикул целиком, без разбиения на слова
+            for word in {whole, *self.tokenize(value)}: words[word] = 3
+        return words
+
+    def add(self, pid, product):
+        words = self.product_words(product)
+        with self.lock:
+            self.words[pid] = words
+            for word, weight in words.items():
+                if word not in self.postings:
+                    self.postings[word] = {}
+                    if not word.isdigit():  # числа ищутся только точно и по префиксу
+                        for g in self.grams(word): self.trigrams.setdefault(g, set()).add(word)
+                    self.dirty = True
+                self.postings[word].setdefault(weight, set()).add(pid)
+
+    def remove(self, pid):
+        with self.lock:
+            for word, weight in self.words.pop(pid, {}).items():
+                posting = self.postings[word]
+                posting[weight].discard(pid)
+                if not posting[weight]: del posting[weight]
+                if posting: continue
+                del self.postings[word]
+                for g in () if word.isdigit() else self.grams(word):
+                    self.trigrams[g].discard(word)
+                    if not self.trigrams[g]: del self.trigrams[g]
+                self.dirty = True
+
+    def expand(self, word):
+        """Слова словаря, подходящие под слово запроса: {слово: качество совпадения}."""
+        matches = {word: 1.0} if word in self.postings else {}
+        i = bisect.bisect_left(self.vocab, word)
+        while i < len(self.vocab) and self.vocab[i].startswith(word) and len(matches) < self.EXPAND:
+            matches.setdefault(self.vocab[i], 0.7)
+            i += 1
+        if not matches and len(word) >= 3 and not word.isdigit():
+            grams = self.grams(word)
+            shared = Counter(w for g in grams for w in self.trigrams.get(g, ()))
+            for candidate, n in shared.most_common(self.EXPAND):
+                similarity = 2 * n / (len(grams) + len(self.grams(candidate)))
+                if similarity >= 0.5: matches[candidate] = round(similarity * 10) / 20  # шаг 0.05
+        return matches
+
+    def tiers(self, matches):
+        """Непересекающиеся уровни {оценка: product_id} для одного слова запроса и их объединение."""
+        tiers = {}
+        for match, quality in matches.items():
+            for weight, pids in self.postings[match].items():
+                tiers.setdefault(quality * weight, set()).update(pids)
+        seen = set()
+        for score in sorted(tiers, reverse=True):
+            tiers[score] -= seen
+            seen |= tiers[score]
+        return {score: pids for score, pids in tiers.items() if pids}, seen
+
+    def search(self, query, offset=0, limit=20):
+        """Все слова запроса должны совпасть. Возвращает (всего найдено, product_id страницы)."""
+        whole = query.strip().lower().replace("ё", "е")
+        need = offset + limit
+        with self.lock:
+            if self.dirty:
+                self.vocab = sorted(self.postings)
+                self.dirty = False
+            if whole in self.postings and not whole.isalpha():
+                per_word = [self.tiers({whole: 1.0})]  # точный артикул, SKU или product_id
+            else:
+                per_word = [self.tiers(self.expand(word)) for word in self.tokenize(query)]
+            if not per_word or not all(seen for _, seen in per_word): return 0, []
+            total = len(set.intersection(*sorted((seen for _, seen in per_word), key=len)))
+            # Перебираем сочетания уровней по убыванию суммарной оценки, пока не наберём страницу
+            combos = itertools.product(*(tiers.items() for tiers, _ in per_word))
+            page = []
+            for combo in sorted(combos, key=lambda c: -sum(score for score, _ in c)):
+                hit = set.intersection(*sorted((pids for _, pids in combo), key=len))
+                page.extend(heapq.nsmallest(need - len(page), hit))
+                if len(page) >= need: break
+        return total, page[offset:need]
+
+
+class Catalog:
+    """Локальный индекс товаров: полный обход /v3/product/list по last_id
+    и обогащение пачками через /v3/product/info/list."""
+    PAGE = 1000
+    BATCH = 1000
+    DIMENSIONS = ("depth", "width", "height", "dimension_unit", "weight", "weight_unit")
+
+    def __init__(self):
+        self.products = {}      # product_id -> товар (элемент списка + info)
+        self.fingerprints = {}  # product_id -> слепок элемента списка на момент загрузки info (None - info не получен)
+        self.by_offer = {}
+        self.by_sku = {}
+        self.index = ProductIndex()
+        self.synced_at = None
+        self.full_at = 0.0      # время последней полной синхронизации
+        self.last_error = None
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(item):
+        return json_dumps(item, sort_keys=True).decode()
+
+    @staticmethod
+    def skus(product):
+        skus = {product.get("sku"), product.get("fbo_sku"), product.get("fbs_sku")}
+        skus.update(src.get("sku") for src in product.get("sources") or [])
+        return {sku for sku in skus if sku}
+
+    def list_all(self):
+        listed, last_id = {}, ""
+        while True:
+            d = ozon_request("/v3/product/list", {"filter": {"visibility": "ALL"}, "last_id": last_id, "limit": self.PAGE})
+            if d.get("error"): raise RuntimeError(d.get("message") or "product list failed")
+            res = d.get("result") or {}
+            items = res.get("items") or []
+            for item in items: listed[item["product_id"]] = item
+            last_id = res.get("last_id") or ""
+            if len(items) < self.PAGE or not last_id: return listed
+
+    def fetch_info(self, ids):
+        d = ozon_request("/v3/product/info/list", {"product_id": ids})
+        if d.get("error"): raise RuntimeError(d.get("message") or "product info failed")
+        return d.get("items") or (d.get("result") or {}).get("items") or []
+
+    def fetch_dimensions(self, ids):
+        """Габариты и вес из /v4/product/info/attributes: product_id -> поля DIMENSIONS."""
+        d = ozon_request("/v4/product/info/attributes", {"filter": {"product_id": ids, "visibility": "ALL"}, "limit": len(ids), "last_id": ""})
+        if d.get("error"): raise RuntimeError(d.get("message") or "product attributes failed")
+        return {a["id"]: {k: a.get(k) for k in self.DIMENSIONS} for a in d.get("result") or [] if a.get("id")}
+
+    @staticmethod
+    def dimensions(product):
+        """((длина, ширина, высота) в мм, вес в граммах) или None, если габаритов нет."""
+        mm = {"mm": 1, "cm": 10, "in": 25.4}.get(product.get("dimension_unit"))
+        g = {"g": 1, "kg": 1000, "lb": 453.592}.get(product.get("weight_unit"), 1)
+        try: size = tuple(float(product[k]) * mm for k in ("depth", "width", "height"))
+        except (KeyError, TypeError, ValueError): return None
+        if not all(v > 0 for v in size): return None
+        return size, float(product.get("weight") or 0) * g
+
+    def sync(self, full=False):
+        """Синхронизация каталога. Без full заново запрашивает info только для
+        новых товаров, тех, у которых изменился элемент списка, и тех, чей info не пришёл.
+        Элемент списка не содержит названия, цены и габаритов: их правки видит только full."""
+        with self.sync_lock: self.pull(full)
+        return self.status()
+
+    def pull(self, full):
+        try:
+            listed = self.list_all()
+            changed = [pid for pid, item in listed.items() if full or self.fingerprints.get(pid) != self.fingerprint(item)
+                       or "dimension_unit" not in self.products.get(pid, {})]
+            with ThreadPoolExecutor(4) as pool:
+                infos = pool.map(bound(self.fetch_info), chunks(changed, self.BATCH))
+                dims = pool.map(bound(self.fetch_dimensions), chunks(changed, self.BATCH))
+                infos = [info for batch in infos for info in batch]
+                dims = {pid: d for batch in dims for pid, d in batch.items()}
+        except Exception as e:
+            self.last_error = str(e)
+            log("error", "catalog", f"Синхронизация не удалась: {e}")
+            return
+        info_by_id = {info.get("id") or info.get("product_id"): info for info in infos}
+        # Поля габаритов есть всегда (None, если атрибутов нет): иначе товар запрашивался бы на каждой синхронизации
+        saved = [(pid, {**listed[pid], **info_by_id.get(pid, {}), **(dims.get(pid) or dict.fromkeys(self.DIMENSIONS)), "product_id": pid},
+                  self.fingerprint(listed[pid]) if pid in info_by_id else None) for pid in changed]
+        removed = set(self.products) - set(listed)
+        if full or len(changed) > len(self.products) // 2:
+            products, fingerprints = dict(self.products), dict(self.fingerprints)
+            for pid in removed: del products[pid], fingerprints[pid]
+            for pid, product, fingerprint in saved: products[pid], fingerprints[pid] = product, fingerprint
+            self.rebuild(products, fingerprints)
+        else:
+            # Немного изменений: словари правятся под блокировкой, индекс поиска - своими короткими блокировками после
+            with self.lock:
+                for pid in removed: self.remove(pid)
+                for pid, product, fingerprint in saved: self.add(pid, product, fingerprint)
+            for pid in removed: self.index.remove(pid)
+            for pid, product, _ in saved:
+                self.index.remove(pid)
+                self.index.add(pid, product)
+        self.synced_at = datetime.now().isoformat(timespec="seconds")
+        if full: self.full_at = time.time()
+        self.last_error = None
+        STORE.save_products(saved, removed, self.synced_at)
+        if full: STORE.set_meta(STORE.owned("catalog_full_at"), self.full_at)
+        log("success", "catalog", f"Каталог: {len(listed)} товаров, обновлено {len(changed)}")
+        EVENTS.publish("catalog", self.status())
+
+    def load(self):
+        """Тёплый старт из локальной базы."""
+        rows = STORE.products()
+        with self.sync_lock:
+            self.rebuild({pid: product for pid, product, _ in rows}, {pid: fingerprint for pid, _, fingerprint in rows})
+            if rows: self.synced_at = STORE.get_meta(STORE.owned("catalog_synced_at"))
+            self.full_at = float(STORE.get_meta(STORE.owned("catalog_full_at")) or 0)
+        if rows: log("success", "catalog", f"Из базы загружено {len(rows)} товаров")
+
+    def rebuild(self, products, fingerprints):
+        """Индексы по новому набору товаров строятся без блокировки (на 100 тыс. товаров - секунды):
+        поиск и find до подмены работают со старыми."""
+        by_offer, by_sku, index = {}, {}, ProductIndex()
+        for pid, product in products.items():
+            if product.get("offer_id"): by_offer[product["offer_id"]] = pid
+            for sku in self.skus(product): by_sku[sku] = pid
+            index.add(pid, product)
+        index.vocab, index.dirty = sorted(index.postings), False  # словарь сортируется здесь, а не первым поиском
+        with self.lock:
+            self.products, self.fingerprints, self.by_offer, self.by_sku, self.index = products, fingerprints, by_offer, by_sku, index
+
+    def add(self, pid, product, fingerprint):
+        if pid in self.products: self.remove(pid)
+        self.products[pid] = product
+        self.fingerprints[pid] = fingerprint
+        if product.get("offer_id"): self.by_offer[product["offer_id"]] = pid
+        for sku in self.skus(product): self.by_sku[sku] = pid
+
+    def remove(self, pid):
+        product = self.products.pop(pid)
+        self.fingerprints.pop(pid, None)
+        self.by_offer.pop(product.get("offer_id"), None)
+        for sku in self.skus(product): self.by_sku.pop(sku, None)
+
+    def find(self, key):
+        """Товар по product_id, offer_id или SKU."""
+        with self.lock:
+            pid = self.by_offer.get(str(key))
+            if pid is None and str(key).isdigit():
+                pid = int(key) if int(key) in self.products else self.by_sku.get(int(key))
+            return self.products.get(pid)
+
+    def search(self, query, offset=0, limit=20):
+        if query.strip():
+            total, ids = self.index.search(query, offset, limit)
+        else:
+            with self.lock:
+                total, ids = len(self.products), list(self.products)[offset:offset + limit]
+        with self.lock:
+            items = [self.summary(self.products[pid]) for pid in ids if pid in self.products]
+        return {"total": total, "offset": offset, "limit": limit, "items": items, "synced": self.synced_at is not None}
+
+    @staticmethod
+    def summary(product):
+        return {"product_id": product["product_id"], "offer_id": product.get("offer_id"),
+                "name": product.get("name"), "sku": product.get("sku") or next(iter(Catalog.skus(product)), None)}
+
+    def status(self):
+        return {"products": len(self.products), "synced_at": self.synced_at,
+                "syncing": self.sync_lock.locked(), "error": self.last_error}
+
+    def start_refresh(self, interval=CATALOG_REFRESH, full_interval=CATALOG_FULL_REFRESH):
+        def loop():
+            while True:
+                self.sync(full_interval > 0 and time.time() - self.full_at >= full_interval)
+                time.sleep(interval)
+        threading.Thread(target=bound(loop), name="catalog-sync", daemon=True).start()
+
+CATALOG = Catalog()
+
+
+class Supplies:
+    """Заявки на поставку целиком в памяти на SUPPLIES_TTL секунд. Метод списка,
+    который ответил, запоминается; /v2 обходится по статусам параллельно,
+    детали добираются пачками через /v2/supply-order/get."""
+    PAGE = 100
+    DETAILS = 50
+    STATES = ["DATA_FILLING", "READY_TO_SUPPLY", "ACCEPTED_AT_SUPPLY_WAREHOUSE", "IN_TRANSIT",
+              "ACCEPTANCE_AT_STORAGE_WAREHOUSE", "REPORTS_CONFIRMATION_AWAITING", "REPORT_REJECTED",
+              "COMPLETED", "REJECTED_AT_SUPPLY_WAREHOUSE", "CANCELLED", "OVERDUE"]
+
+    def __init__(self, ttl=SUPPLIES_TTL):
+        self.ttl = ttl
+        self.rows = []          # от новых к старым, список заменяется целиком
+        self.source = None      # метод списка, ответивший без ошибки
+        self.loaded_at = 0.0
+        self.synced_at = None
+        self.last_error = None
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+
+    @staticmethod
+    def fetch(endpoint, body):
+        d = ozon_request(endpoint, body)
+        if d.get("error"): raise RuntimeError(f"HTTP {d.get('code')}" if d.get("code") else d.get("message"))
+        return d
+
+    def list_v2(self, endpoint):
+        def by_state(state):
+            ids, cursor = [], 0
+            while True:
+                d = self.fetch(endpoint, {"filter": {"states": [state]}, "paging": {"from_supply_order_id": cursor, "limit": self.PAGE}})
+                page = d.get("supply_order_id") or []
+                ids += page
+                cursor = d.get("last_supply_order_id") or 0
+                if len(page) < self.PAGE or not cursor: return ids
+
+        with ThreadPoolExecutor(4) as pool:
+            ids = list(dict.fromkeys(oid for part in pool.map(bound(by_state), self.STATES) for oid in part))
+            return [order for batch in pool.map(bound(self.details), chunks(ids, self.DETAILS)) for order in batch]
+
+    def details(self, ids):
+        return self.fetch("/v2/supply-order/get", {"order_ids": ids}).get("orders") or []
+
+    def list_v1(self, endpoint):
+        orders, last_id = [], ""
+        while True:
+            d = self.fetch(endpoint, {"filter": {}, "limit": self.PAGE, "last_id": last_id})
+            page = d.get("supply_orders") or d.get("result") or d.get("items") or []
+            orders += page
+            last_id = d.get("last_id") or ""
+            if len(page) < self.PAGE or not last_id: return orders
+
+    SOURCES = {"/v2/supply-order/list": list_v2, "/v1/supply-order/list": list_v1, "/v1/supply/list": list_v1}
+
+    @staticmethod
+    def row(order):
+        warehouse = order.get("drop_off_warehouse") or order.get("warehouse") or {}
+        slot = order.get("timeslot") or {}
+        slot = slot.get("timeslot") or slot  # в /v2 интервал вложен ещё раз
+        oid = order.get("supply_order_id") or order.get("supply_id") or order.get("id")
+        return {
+            "id": int(oid), "number": str(order.get("supply_order_number") or oid),
+            "state": order.get("state") or order.get("status") or "",
+            "created_at": order.get("created_date") or order.get("creation_date") or order.get("created_at") or "",
+            "timeslot_from": slot.get("from") or slot.get("from_in_timezone"),
+            "warehouse_id": warehouse.get("warehouse_id") or order.get("warehouse_id"),
+            "warehouse_name": warehouse.get("name") or "", "supplies": len(order.get("supplies") or []),
+            "supply_ids": [s["supply_id"] for s in order.get("supplies") or [] if s.get("supply_id")],
+        }
+
+    @staticmethod
+    def key(row):
+        return row["created_at"], row["id"]
+
+    def pull(self):
+        errors = []
+        for endpoint in ([self.source] if self.source else []) + [e for e in self.SOURCES if e != self.source]:
+            try:
+                orders = self.SOURCES[endpoint](self, endpoint)
+            except RuntimeError as e:
+                errors.append(f"{endpoint}: {e}")
+                continue
+            rows = sorted((self.row(o) for o in orders if o.get("supply_order_id") or o.get("supply_id") or o.get("id")),
+                          key=self.key, reverse=True)
+            with self.lock:
+                self.rows, self.source = rows, endpoint
+                self.loaded_at = time.monotonic()
+                self.synced_at = datetime.now().isoformat(timespec="seconds")
+                self.last_error = None
+            log("success", "supplies", f"Заявки: {len(rows)} через {endpoint}")
+            EVENTS.publish("supplies", {"stale": False, "total": len(rows), "synced_at": self.synced_at, "source": endpoint})
+            return
+        self.source, self.last_error = None, "; ".join(errors)
+        self.loaded_at = time.monotonic()  # до следующей попытки отдаём то, что было
+        log("error", "supplies", f"Список заявок недоступен: {self.last_error}")
+
+    def ensure(self, refresh=False):
+        requested = time.monotonic()
+        if not refresh and requested - self.loaded_at < self.ttl: return
+        with self.sync_lock:
+            if self.loaded_at >= requested: return  # обновили, пока ждали блокировку
+            self.pull()
+
+    def invalidate(self):
+        self.loaded_at = 0.0
+        EVENTS.publish("supplies", {"stale": True})
+
+    def query(self, states=(), warehouse_id=None, date_from=None, date_to=None, cursor=None, limit=100, refresh=False):
+        """Страница заявок от новых к старым после cursor и агрегаты: по статусам
+        без учёта фильтра статуса и по складам без учёта фильтра склада."""
+        after = None
+        if cursor:
+            created, _, oid = cursor.rpartition("|")
+            after = created, int(oid)
+        self.ensure(refresh)
+        with self.lock: rows = self.rows
+        dated = [r for r in rows if (not date_from or r["created_at"][:10] >= date_from)
+                 and (not date_to or r["created_at"][:10] <= date_to)]
+        state_counts = Counter(r["state"] for r in dated if not warehouse_id or r["warehouse_id"] == warehouse_id)
+        warehouses, names = Counter(), {}
+        for r in dated:
+            if states and r["state"] not in states: continue
+            warehouses[r["warehouse_id"]] += 1
+            names[r["warehouse_id"]] = r["warehouse_name"]
+        matched = [r for r in dated if (not states or r["state"] in states)
+                   and (not warehouse_id or r["warehouse_id"] == warehouse_id)]
+        start = next((i for i, r in enumerate(matched) if self.key(r) < after), len(matched)) if after else 0
+        page = matched[start:start + limit]
+        return {
+            "items": page, "total": len(matched),
+            "next_cursor": f"{page[-1]['created_at']}|{page[-1]['id']}" if start + limit < len(matched) else None,
+            "counts": {"states": dict(state_counts.most_common()),
+                       "warehouses": [{"warehouse_id": wid, "name": names[wid], "count": n} for wid, n in warehouses.most_common()]},
+            "source": self.source, "synced_at": self.synced_at, "error": self.last_error,
+        }
+
+SUPPLIES = Supplies()
+
+
+class SlotFinder:
+    """Таймслоты черновика по многим складам и датам: запросы к /v1/draft/timeslot/info
+    идут параллельно (ожидание окна - в лимитере) и сводятся в таблицу склад x день.
+    Сводка кэшируется на SLOTS_TTL секунд."""
+    WAREHOUSES = 10  # складов в одном запросе
+    DAYS = 7         # дней в одном запросе
+
+    def __init__(self, ttl=SLOTS_TTL, fanout=SLOT_FANOUT):
+        self.ttl = ttl
+        self.pool = ThreadPoolExecutor(max(fanout, 1), thread_name_prefix="slots")
+
+    @staticmethod
+    def day(value, default):
+        return datetime.strptime(str(value)[:10], "%Y-%m-%d").date() if value else default
+
+    def windows(self, first, last):
+        """Полуинтервалы [начало, конец) по DAYS дней, покрывающие first..last включительно."""
+        out = []
+        while first <= last:
+            end = min(first + timedelta(days=self.DAYS), last + timedelta(days=1))
+            out.append((f"{first}T00:00:00Z", f"{end}T00:00:00Z"))
+            first = end
+        return out
+
+    @staticmethod
+    def cluster_warehouses(cluster_ids):
+        d = ozon_cached("/v1/cluster/list", {"cluster_ids": sorted(cluster_ids), "cluster_type": "CLUSTER_TYPE_OZON"})[0]
+        if d.get("error"): raise ValueError(f"Кластеры недоступны: {str(d.get('message'))[:200]}")
+        return {w["warehouse_id"]: w.get("name") or "" for c in d.get("clusters") or [] if c.get("id") in cluster_ids
+                for lc in c.get("logistic_clusters") or [] for w in lc.get("warehouses") or [] if w.get("warehouse_id")}
+
+    def find(self, draft_id, warehouse_ids=(), cluster_ids=(), date_from=None, date_to=None, fresh=False):
+        """Все свободные слоты draft_id на складах warehouse_ids и складах кластеров cluster_ids.
+        Склады упорядочены по ближайшему слоту, затем по числу слотов; слоты - по времени.
+        Возвращает (сводка, готовый JSON из кэша или None)."""
+        if not draft_id: raise ValueError("Не передан draft_id")
+        today = datetime.now().date()
+        first = self.day(date_from, today)
+        last = max(self.day(date_to, first + timedelta(days=self.DAYS - 1)), first)
+        names = {int(w): "" for w in warehouse_ids or []}
+        if cluster_ids: names.update(self.cluster_warehouses({int(c) for c in cluster_ids}))
+        if not names: raise ValueError("Не заданы склады или кластеры")
+        ids = sorted(names)
+        cache = ACCOUNT.get().cache
+        key = ResponseCache.key("slots", {"draft_id": draft_id, "warehouse_ids": ids, "from": str(first), "to": str(last)})
+        if not fresh:
+            cached = cache.get(key)
+            if cached is not None: return cached
+
+        tasks = [(chunk, window) for chunk in chunks(ids, self.WAREHOUSES) for window in self.windows(first, last)]
+        def query(task):
+            (chunk, (start, end)) = task
+            return ozon_cached("/v1/draft/timeslot/info", {"draft_id": draft_id, "warehouse_ids": chunk,
+                                                           "date_from": start, "date_to": end})[0]
+
+        slots, seen, errors = [], set(), []
+        for d in self.pool.map(bound(query), tasks):
+            if d.get("error"):
+                errors.append(str(d.get("message"))[:300])
+                continue
+            for wh in d.get("drop_off_warehouse_timeslots") or []:
+                for day in wh.get("days") or []:
+                    for slot in day.get("timeslots") or []:
+                        start = slot.get("from_in_timezone") or slot.get("from") or ""
+                        if (wh.get("drop_off_warehouse_id"), start) in seen: continue
+                        seen.add((wh.get("drop_off_warehouse_id"), start))
+                        slots.append({"warehouse_id": wh.get("drop_off_warehouse_id"), "date": day.get("date_in_timezone") or start[:10],
+                                      "from": start, "to": slot.get("to_in_timezone") or slot.get("to"), "timeslot": slot})
+        slots.sort(key=lambda s: (s["from"], s["warehouse_id"]))
+        days = [str(first + timedelta(days=i)) for i in range((last - first).days + 1)]
+        column = {d: i for i, d in enumerate(days)}
+        grid = {w: {"warehouse_id": w, "name": names.get(w, ""), "total": 0, "first": None, "days": [0] * len(days)} for w in ids}
+        for s in slots:
+            row = grid.get(s["warehouse_id"])
+            if row is None or s["date"] not in column: continue
+            row["days"][column[s["date"]]] += 1
+            row["total"] += 1
+            row["first"] = row["first"] or s["from"]
+        result = {
+            "draft_id": draft_id, "date_from": str(first), "date_to": str(last), "days": days,
+            "warehouses": sorted(grid.values(), key=lambda r: (r["first"] is None, r["first"] or "", -r["total"])),
+            "slots": slots, "queries": len(tasks), "errors": errors, "cached": False,
+        }
+        if not errors:
+            hit = {**result, "cached": True}
+            raw = json_dumps(hit)
+            cache.put(key, (hit, raw), self.ttl, len(raw))
+        return result, None
+
+SLOTS = SlotFinder()
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Расстояние по дуге большого круга."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 12742.0 * math.asin(min(math.sqrt(a), 1.0))
+
+
+class GeoIndex:
+    """k-d дерево по точкам на единичной сфере (x, y, z). Расстояние по хорде монотонно
+    расстоянию по поверхности, поэтому ближайшие N и поиск в радиусе точны на любой широте."""
+    EARTH_KM = 6371.0
+    LEAF = 16
+
+    def __init__(self, points):
+        self.count = len(points)
+        self.root = self.build([(self.xyz(p["lat"], p["lon"]), p) for p in points])
+
+    @staticmethod
+    def xyz(lat, lon):
+        phi, lam = math.radians(lat), math.radians(lon)
+        return math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi)
+
+    def build(self, items):
+        # Узел: (None, точки) для листа или (ось, порог, левое, правое); делим по оси наибольшего разброса
+        if len(items) <= self.LEAF: return None, items
+        axis = max(range(3), key=lambda k: max(it[0][k] for it in items) - min(it[0][k] for it in items))
+        items.sort(key=lambda it: it[0][axis])
+        mid = len(items) // 2
+        return axis, items[mid][0][axis], self.build(items[:mid]), self.build(items[mid:])
+
+    def km(self, chord2):
+        return 2 * self.EARTH_KM * math.asin(min(math.sqrt(chord2) / 2, 1.0))
+
+    def nearest(self, lat, lon, n):
+        q = self.xyz(lat, lon)
+        best = []  # куча (-квадрат хорды, номер, точка) из n ближайших
+        seq = itertools.count()
+
+        def visit(node):
+            axis, rest = node[0], node[1:]
+            if axis is None:
+                for v, p in rest[0]:
+                    item = (-((v[0] - q[0]) ** 2 + (v[1] - q[1]) ** 2 + (v[2] - q[2]) ** 2), next(seq), p)
+                    if len(best) < n: heapq.heappush(best, item)
+                    elif item > best[0]: heapq.heapreplace(best, item)
+                return
+            split, left, right = rest
+            diff = q[axis] - split
+            visit(left if diff < 0 else right)
+            if len(best) < n or diff * diff < -best[0][0]: visit(right if diff < 0 else left)
+
+        if self.count and n > 0: visit(self.root)
+        return [(p, self.km(-d2)) for d2, _, p in sorted(best, reverse=True)]
+
+    def within(self, lat, lon, km):
+        q = self.xyz(lat, lon)
+        r2 = (2 * math.sin(min(km / self.EARTH_KM, math.pi) / 2)) ** 2
+        found = []
+
+        def visit(node):
+            axis, rest = node[0], node[1:]
+            if axis is None:
+                for v, p in rest[0]:
+                    d2 = (v[0] - q[0]) ** 2 + (v[1] - q[1]) ** 2 + (v[2] - q[2]) ** 2
+                    if d2 <= r2: found.append((d2, p))
+                return
+            split, left, right = rest
+            diff = q[axis] - split
+            if diff < 0 or diff * diff <= r2: visit(left)
+            if diff >= 0 or diff * diff <= r2: visit(right)
+
+        if self.count: visit(self.root)
+        found.sort(key=lambda x: x[0])
+        return [(p, self.km(d2)) for d2, p in found]
+
+
+class PointIndex:
+    """Точки отгрузки из /v1/warehouse/fbo/list с координатами: отдельный индекс на каждый
+    тип точки, обновление по расписанию, тёплый старт из последнего сохранённого ответа."""
+    TYPES = {"SC": ("SORTING", "СЦ"), "FF": ("FULL_FILL", "FULFIL", "РФЦ", "ФФ"),
+             "PPZ": ("ORDERS_RECEIVING", "ППЗ"), "PVZ": ("DELIVERY_POINT", "PICKUP", "ПВЗ")}
+    QUERY = {"filter_by_supply_type": ["CREATE_TYPE_CROSSDOCK"], "search": ""}
+    PLACES = 1024  # сколько ответов geocode помнить
+
+    def __init__(self):
+        self.points = []
+        self.grids = {}   # тип точки или None (все) -> GeoIndex
+        self.texts = []   # (название и адрес в нижнем регистре, точка) для geocode
+        self.places = OrderedDict()  # запрос geocode -> ответ (LRU), сбрасывается при обновлении
+        self.synced_at = None
+        self.last_error = None
+        self.tried = 0.0
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+
+    @classmethod
+    def kind(cls, w):
+        text = f"{w.get('warehouse_type') or w.get('type') or ''} {w.get('name') or ''}".upper()
+        return next((t for t, marks in cls.TYPES.items() if any(m in text for m in marks)), None)
+
+    @classmethod
+    def point(cls, w):
+        coords = w.get("coordinates") or w
+        try: lat, lon = float(coords.get("latitude") or coords.get("lat")), float(coords.get("longitude") or coords.get("lon"))
+        except (TypeError, ValueError): lat = lon = None
+        return {"warehouse_id": w.get("warehouse_id") or w.get("id"), "name": w.get("name") or "",
+                "address": w.get("address") or w.get("city") or "", "type": cls.kind(w), "lat": lat, "lon": lon}
+
+    def build(self, warehouses):
+        points = [p for p in map(self.point, warehouses) if p["warehouse_id"] and (p["type"] or p["lat"] is not None)]
+        located = [p for p in points if p["lat"] is not None]
+        grids = {None: GeoIndex(located), **{t: GeoIndex([p for p in located if p["type"] == t]) for t in self.TYPES}}
+        texts = [(f"{p['name']} {p['address']}".lower(), p) for p in located]
+        with self.lock: self.points, self.grids, self.texts, self.places = points, grids, texts, OrderedDict()
+        return len(points), len(located)
+
+    def load(self):
+        """Тёплый старт из ответа последней синхронизации (meta "points")."""
+        saved = STORE.get_meta("points")
+        if not saved: return
+        self.build(json_loads(saved))
+        self.synced_at = STORE.get_meta("points_synced_at")
+
+    def sync(self):
+        with self.sync_lock:
+            self.tried = time.monotonic()
+            d = ozon_request("/v1/warehouse/fbo/list", self.QUERY)
+            if d.get("error"):
+                self.last_error = str(d.get("message"))[:300]
+                log("error", "points", f"Точки отгрузки не обновлены: {self.last_error}")
+                return
+            warehouses = d.get("search") or d.get("result") or []
+            total, located = self.build(warehouses)
+            self.synced_at = datetime.now().isoformat(timespec="seconds")
+            self.last_error = None
+            STORE.write(("INSERT OR REPLACE INTO meta VALUES (?, ?)", [("points", json_dumps(warehouses).decode()),
+                                                                     ("points_synced_at", self.synced_at)]))
+        log("success", "points", f"Точки отгрузки: {total}, с координатами {located}")
+
+    def start_refresh(self, interval=POINTS_REFRESH):
+        def loop():
+            while True:
+                self.sync()
+                time.sleep(interval)
+        threading.Thread(target=loop, name="points-sync", daemon=True).start()
+
+    def geocode(self, text):
+        """Координаты по названию, городу или адресу известных точек, либо из строки "широта, долгота"."""
+        m = re.fullmatch(r"\s*(-?\d+(?:\.\d+)?)\s*[,;\s]\s*(-?\d+(?:\.\d+)?)\s*", text)
+        if m: return float(m.group(1)), float(m.group(2)), text.strip()
+        words = tuple(text.lower().split())
+        with self.lock:
+            texts, places = self.texts, self.places
+            if words in places:
+                places.move_to_end(words)
+                return places[words] or None
+        hits = [p for t, p in texts if all(w in t for w in words)]
+        found = hits and (sum(p["lat"] for p in hits) / len(hits), sum(p["lon"] for p in hits) / len(hits),
+                          hits[0]["address"] or hits[0]["name"])
+        with self.lock:
+            places[words] = found
+            while len(places) > self.PLACES: places.popitem(last=False)
+        return found or None
+
+    def query(self, kind=None, lat=None, lon=None, near=None, radius_km=None, limit=20):
+        """Точки типа kind: ближайшие limit к (lat, lon) или к near, либо все в радиусе radius_km."""
+        if not self.points and time.monotonic() - self.tried > 60: self.sync()  # первый запрос до фонового обновления
+        started = time.perf_counter()
+        label = None
+        if lat is None and near:
+            found = self.geocode(near)
+            if not found: raise ValueError(f"Не нашли точку «{near[:100]}»")
+            lat, lon, label = found
+        with self.lock: points, grid = self.points, self.grids.get(kind)
+        if lat is None:
+            items = [{**p, "distance_km": None} for p in points if not kind or p["type"] == kind][:limit]
+        else:
+            if grid is None: grid = GeoIndex([])
+            hits = grid.within(lat, lon, radius_km)[:limit] if radius_km else grid.nearest(lat, lon, limit)
+            items = [{**p, "distance_km": round(d, 1)} for p, d in hits]
+        return {"items": items, "origin": {"lat": lat, "lon": lon, "label": label} if lat is not None else None,
+                "total": len(points), "synced_at": self.synced_at, "error": self.last_error,
+                "took_ms": round((time.perf_counter() - started) * 1000, 3)}
+
+POINTS = PointIndex()
+
+
+class CargoPacker:
+    """Моногрузоместа для /v1/cargoes/create: в коробке или на палете только один SKU.
+    Для каждого товара считается, сколько единиц помещается в шаблон (шесть поворотов
+    и предельный вес); полные места берутся в шаблоне наибольшей вместимости, остаток -
+    в наименьшем подходящем. Матрица вместимости считается на numpy, без него - циклами."""
+    TURNS = list(itertools.permutations(range(3)))
+
+    def __init__(self, templates=CARGO_TEMPLATES):
+        self.templates = templates
+
+    @staticmethod
+    def template(t):
+        try:
+            size = [float(v) for v in t["size"]]
+            if len(size) != 3 or min(size) <= 0 or float(t["max_weight"]) <= 0: raise ValueError
+            return {"name": str(t.get("name") or "×".join(f"{v:g}" for v in size)), "type": str(t.get("type") or "BOX").upper(),
+                    "size": size, "max_weight": float(t["max_weight"])}
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Неверный шаблон грузоместа: {t}")
+
+    @staticmethod
+    def entry(product, quantity, reason=None):
+        sku = product.get("sku") or min(Catalog.skus(product), default=None)
+        line = {"product_id": product.get("product_id"), "sku": sku, "offer_id": product.get("offer_id"),
+                "name": product.get("name") or "", "barcode": (product.get("barcodes") or [product.get("barcode")])[0],
+                "quantity": quantity}
+        if reason: line["reason"] = reason
+        return line
+
+    @staticmethod
+    def request_items(params):
+        """Состав: params["items"] или товары сохранённого черновика params["draft_id"] (или operation_id)."""
+        if params.get("items"): return params["items"]
+        draft = STORE.draft(params["draft_id"]) if params.get("draft_id") else None
+        if draft and draft.get("items"): return draft["items"]
+        raise ValueError("Не передан состав (items) или известный draft_id")
+
+    def resolve(self, items):
+        """Суммирует количества по товарам: ({product_id: [товар, количество]}, нераспознанные строки)."""
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise ValueError("items: ожидается список объектов {sku | offer_id | product_id, quantity}")
+        wanted, unknown = {}, []
+        for item in items:
+            key = item.get("sku") or item.get("offer_id") or item.get("product_id")
+            product = ACCOUNT.get().catalog.find(key) if key else None
+            try: quantity = int(item.get("quantity") or 0)
+            except (TypeError, ValueError): quantity = 0
+            if product is None: unknown.append({"sku": item.get("sku"), "offer_id": item.get("offer_id"), "quantity": quantity,
+                                                "reason": "Товар не найден в каталоге"})
+            elif quantity > 0: wanted.setdefault(product["product_id"], [product, 0])[1] += quantity
+        return wanted, unknown
+
+    def layout(self, sizes, weights, quantities, templates):
+        """Для каждого товара: (вместимость места, шаблон полных мест, шаблон остатка).
+        Вместимость - максимум по поворотам единицы, ограниченный предельным весом."""
+        volumes = [math.prod(t["size"]) for t in templates]
+        if numpy is not None:
+            units = numpy.asarray(sizes, dtype=float)[:, self.TURNS]            # товар x поворот x ось
+            boxes = numpy.asarray([t["size"] for t in templates], dtype=float)  # шаблон x ось
+            cap = numpy.floor(boxes[None, :, None, :] / units[:, None, :, :] + 1e-9).prod(axis=3).max(axis=2)
+            w = numpy.asarray(weights, dtype=float)[:, None]
+            limit = numpy.floor(numpy.asarray([t["max_weight"] for t in templates])[None, :] / numpy.where(w > 0, w, 1))
+            cap = numpy.minimum(cap, numpy.where(w > 0, limit, cap)).astype(numpy.int64)
+            best, vol = cap.max(axis=1), numpy.asarray(volumes)[None, :]
+            rest = numpy.asarray(quantities) % numpy.maximum(best, 1)
+            big = numpy.where(cap == best[:, None], vol, numpy.inf).argmin(axis=1)
+            small = numpy.where(cap >= rest[:, None], vol, numpy.inf).argmin(axis=1)
+            return list(zip(best.tolist(), big.tolist(), small.tolist()))
+        rows = []
+        for size, weight, quantity in zip(sizes, weights, quantities):
+            cap = [min(max(math.prod(int(b / size[i] + 1e-9) for b, i in zip(t["size"], turn)) for turn in self.TURNS),
+                       int(t["max_weight"] // weight) if weight > 0 else math.inf) for t in templates]
+            best = max(cap)
+            rest = quantity % max(best, 1)
+            rows.append((best, min((i for i, c in enumerate(cap) if c == best), key=volumes.__getitem__),
+                         min((i for i, c in enumerate(cap) if c >= rest), key=volumes.__getitem__)))
+        return rows
+
+    def plan(self, items, kind=None, templates=None):
+        """Грузоместа для состава items: по строке на товар с группами одинаковых мест."""
+        started = time.perf_counter()
+        kind = (kind or "BOX").upper()
+        templates = [t for t in map(self.template, templates or self.templates) if t["type"] == kind]
+        if not templates: raise ValueError(f"Нет шаблонов грузомест типа {kind}")
+        wanted, unpacked = self.resolve(items)
+        packable = []
+        for product, quantity in wanted.values():
+            dims = Catalog.dimensions(product)
+            if dims is None: unpacked.append(self.entry(product, quantity, "Нет габаритов в каталоге"))
+            else: packable.append((product, quantity, *dims))
+        rows = self.layout(*zip(*[(p[2], p[3], p[1]) for p in packable]), templates) if packable else []
+        lines, places, volume, weight, used = [], 0, 0.0, 0.0, 0.0
+        for (product, quantity, size, unit_weight), (best, big, small) in zip(packable, rows):
+            if best <= 0:
+                unpacked.append(self.entry(product, quantity, "Не помещается ни в один шаблон"))
+                continue
+            full, rest = divmod(quantity, best)
+            groups = ([(templates[big], full, best)] if full else []) + ([(templates[small], 1, rest)] if rest else [])
+            lines.append({**self.entry(product, quantity), "per_place": best, "places": [
+                {"template": t["name"], "count": count, "quantity": q} for t, count, q in groups]})
+            places += full + bool(rest)
+            volume += sum(math.prod(t["size"]) * count for t, count, _ in groups)
+            used += math.prod(size) * quantity
+            weight += unit_weight * quantity
+        return {"type": kind, "places": places, "items": lines, "unpacked": unpacked,
+                "volume_l": round(volume / 1e6, 1), "weight_kg": round(weight / 1000, 2),
+                "fill": round(used / volume, 3) if volume else 0, "engine": "numpy" if numpy is not None else "python",
+                "took_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+    def estimate(self, items):
+        """Объём, вес и эквивалент в палетах для произвольного состава. Удельные значения
+        по товарам отдаются вместе с итогами: клиент пересчитывает итог сам при смене количества."""
+        wanted, missing = self.resolve(items)
+        pallet = next((t for t in map(self.template, self.templates) if t["type"] == "PALLET"), None)
+        lines, units, volume, weight = [], 0, 0.0, 0.0
+        for product, quantity in wanted.values():
+            dims = Catalog.dimensions(product)
+            if dims is None:
+                missing.append(self.entry(product, quantity, "Нет габаритов в каталоге"))
+                continue
+            unit_volume, unit_weight = math.prod(dims[0]) / 1e6, dims[1] / 1000
+            lines.append({"product_id": product["product_id"], "quantity": quantity,
+                          "unit_volume_l": round(unit_volume, 4), "unit_weight_kg": round(unit_weight, 4)})
+            units += quantity
+            volume += unit_volume * quantity
+            weight += unit_weight * quantity
+        pallets = max(volume * 1e6 / math.prod(pallet["size"]), weight * 1000 / pallet["max_weight"]) if pallet else None
+        return {"units": units, "volume_l": round(volume, 2), "weight_kg": round(weight, 2),
+                "pallets": pallets and round(pallets, 2), "items": lines, "missing": missing,
+                "pallet": pallet and {"name": pallet["name"], "volume_l": math.prod(pallet["size"]) / 1e6,
+                                      "max_weight_kg": pallet["max_weight"] / 1000}}
+
+    @staticmethod
+    def cargoes(plan):
+        """Элементы cargoes для /v1/cargoes/create: по одному на каждое место плана."""
+        cargoes = []
+        for line in plan["items"]:
+            for group in line["places"]:
+                for _ in range(group["count"]):
+                    cargoes.append({"key": str(len(cargoes) + 1), "value": {"type": plan["type"], "items": [
+                        {"barcode": line["barcode"], "quantity": group["quantity"], "quant": 1}]}})
+        return cargoes
+
+CARGOES = CargoPacker()
+
+
+class LabelStore:
+    """Этикетки грузомест на диске: файл на поставку (и набор грузомест), повторное
+    скачивание не ходит в Ozon. Файл пишется потоком во временный и переименовывается.
+    У каждого аккаунта свой подкаталог по Client-Id: чужие этикетки по ключу не найти."""
+    CHUNK = 64 * 1024
+    NAME = re.compile(r"(merged-)?\d+-[0-9a-f]{12}")
+
+    def __init__(self, path=LABEL_DIR, keep_days=LABEL_KEEP_DAYS):
+        self.path, self.keep_days = path, keep_days
+
+    @staticmethod
+    def key(supply_id, cargo_ids=()):
+        return f"{supply_id}-{hashlib.sha1(','.join(map(str, sorted(cargo_ids))).encode()).hexdigest()[:12]}"
+
+    def folder(self):
+        return os.path.join(self.path, re.sub(r"[^0-9A-Za-z_-]", "_", ACCOUNT.get().client_id))
+
+    def file(self, key):
+        """Путь к готовому файлу или None; key из запроса проверяется, в путь попадает только имя."""
+        if not self.NAME.fullmatch(key or ""): return None
+        path = os.path.join(self.folder(), f"{key}.pdf")
+        return path if os.path.exists(path) else None
+
+    def write(self, key, fill):
+        """fill(f) пишет содержимое во временный файл; готовый файл появляется атомарно."""
+        os.makedirs(self.folder(), exist_ok=True)
+        path = os.path.join(self.folder(), f"{key}.pdf")
+        tmp = f"{path}.{uuid.uuid4().hex[:8]}.part"
+        try:
+            with open(tmp, "wb") as f: result = fill(f)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp): os.remove(tmp)
+        return result
+
+    def download(self, file_guid, key):
+        """Скачивает /v1/cargoes-label/file/{file_guid} потоком в файл key, возвращает размер."""
+        def fill(f):
+            def consume(resp):
+                size = 0
+                while chunk := resp.read(self.CHUNK):
+                    f.write(chunk)
+                    size += len(chunk)
+                return size
+            status, _, payload = ozon_send("/v1/cargoes-label/file", b"", consume, "GET", f"/{urllib.parse.quote(str(file_guid))}")
+            if status >= 400: raise JobError(f"/v1/cargoes-label/file: HTTP {status} {payload[:200].decode(errors='replace')}")
+            return payload
+        return self.write(key, fill)
+
+    def merged(self, keys):
+        """Один PDF из нескольких (нужен pypdf); результат тоже остаётся на диске."""
+        key = f"merged-{len(keys)}-{hashlib.sha1(','.join(keys).encode()).hexdigest()[:12]}"
+        if self.file(key): return key
+        writer = pypdf.PdfWriter()
+        for k in keys: writer.append(self.file(k))
+        self.write(key, writer.write)
+        return key
+
+    def url(self, keys):
+        """Ссылка для браузера: заголовка X-Ozon-Account у неё не будет, поэтому аккаунт - в параметре."""
+        account = ACCOUNT.get()
+        query = "" if account is ACCOUNTS.default else f"account={urllib.parse.quote(account.client_id)}"
+        if len(keys) == 1: return f"/labels/{keys[0]}.pdf" + (f"?{query}" if query else "")
+        return f"/labels/download?keys={','.join(keys)}" + (f"&{query}" if query else "")
+
+    def files(self, folder=None):
+        try: return [e for e in os.scandir(folder or self.folder()) if e.is_file() and e.name.endswith(".pdf")]
+        except FileNotFoundError: return []
+
+    def invalidate(self, supply_id):
+        """Состав грузомест поставки изменился: её файлы и все склейки (в них могли попасть старые) удаляются."""
+        for e in self.files():
+            if e.name.startswith((f"{supply_id}-", "merged-")):
+                try: os.remove(e.path)
+                except FileNotFoundError: pass
+
+    def evict(self):
+        """Удаляет файлы старше keep_days дней (0 - хранить всегда). Аккаунт по умолчанию дочищает и
+        файлы в корне LABEL_DIR, оставшиеся от раскладки без подкаталогов."""
+        if self.keep_days <= 0: return
+        cutoff = time.time() - self.keep_days * 86400
+        legacy = self.files(self.path) if ACCOUNT.get() is ACCOUNTS.default else []
+        for e in self.files() + legacy:
+            try:
+                if e.stat().st_mtime < cutoff: os.remove(e.path)
+            except FileNotFoundError: pass
+
+LABELS = LabelStore()
+
+
+class DemandPlanner:
+    """Пополнение по спросу: остатки по кластерам из /v2/analytics/stock_on_warehouses и продажи
+    за DEMAND_DAYS дней из /v2/posting/fbo/list (кластер доставки) сводятся в матрицы SKU x кластер.
+    Рекомендация = спрос в день x (дни покрытия + срок доставки) - остаток; на numpy
+    считается разом по всей матрице, без него - циклом по ячейкам."""
+    PAGE = 1000
+    FANOUT = 4
+
+    def __init__(self, days=DEMAND_DAYS):
+        self.days = days
+        self.skus, self.cluster_ids, self.names = [], [], {}
+        self.stock = self.sold = None
+        self.cells = 0
+        self.synced_at = None
+        self.last_error = None
+        self.tried = 0.0
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+
+    def paged(self, endpoint, body, items):
+        """Все страницы offset-пагинации, по FANOUT страниц параллельно."""
+        def page(offset):
+            d = ozon_request(endpoint, {**body, "offset": offset, "limit": self.PAGE})
+            if d.get("error"): raise RuntimeError(f"{endpoint}: {str(d.get('message'))[:200]}")
+            return items(d)
+
+        out, offset = [], 0
+        with ThreadPoolExecutor(self.FANOUT) as pool:
+            while True:
+                pages = list(pool.map(bound(page), range(offset, offset + self.FANOUT * self.PAGE, self.PAGE)))
+                for rows in pages: out.extend(rows)
+                if any(len(rows) < self.PAGE for rows in pages): return out
+                offset += self.FANOUT * self.PAGE
+
+    def clusters(self):
+        d = ozon_cached("/v1/cluster/list", {"cluster_type": "CLUSTER_TYPE_OZON"})[0]
+        if d.get("error"): raise RuntimeError(f"/v1/cluster/list: {str(d.get('message'))[:200]}")
+        names, warehouses = {}, {}
+        for c in d.get("clusters") or []:
+            names[c["id"]] = c.get("name") or ""
+            for lc in c.get("logistic_clusters") or []:
+                for w in lc.get("warehouses") or []: warehouses[(w.get("name") or "").upper()] = c["id"]
+        return names, warehouses
+
+    def pull(self):
+        self.tried = time.monotonic()
+        started = time.perf_counter()
+        since = datetime.now() - timedelta(days=self.days)
+        try:
+            names, warehouses = self.clusters()
+            stocks = self.paged("/v2/analytics/stock_on_warehouses", {"warehouse_type": "ALL"},
+                                lambda d: (d.get("result") or {}).get("rows") or [])
+            postings = self.paged("/v2/posting/fbo/list", {
+                "dir": "ASC", "filter": {"since": since.isoformat(timespec="seconds") + "Z",
+                                         "to": datetime.now().isoformat(timespec="seconds") + "Z", "status": ""},
+                "with": {"financial_data": True}}, lambda d: d.get("result") or [])
+        except (RuntimeError, KeyError) as e:
+            self.last_error = str(e)
+            log("error", "demand", f"Остатки и продажи не загружены: {e}")
+            return
+        by_name = {name.upper(): cid for cid, name in names.items()}
+        cells, unmatched = {}, 0
+        for r in stocks:
+            cid = warehouses.get((r.get("warehouse_name") or "").upper())
+            if cid is None or not r.get("sku"):
+                unmatched += 1
+                continue
+            cell = cells.setdefault((int(r["sku"]), cid), [0, 0])
+            cell[0] += int(r.get("free_to_sell_amount") or 0) + int(r.get("promised_amount") or 0)
+        for p in postings:
+            cid = by_name.get(((p.get("financial_data") or {}).get("cluster_to") or "").upper())
+            if cid is None or p.get("status") == "cancelled":
+                unmatched += cid is None
+                continue
+            for item in p.get("products") or []:
+                if item.get("sku"): cells.setdefault((int(item["sku"]), cid), [0, 0])[1] += int(item.get("quantity") or 0)
+        synced_at = datetime.now().isoformat(timespec="seconds")
+        self.build(cells, names, synced_at)
+        STORE.save_demand(cells, names, synced_at)
+        log("success", "demand", f"Спрос: {len(stocks)} строк остатков, {len(postings)} отправлений, "
+                                 f"{len(cells)} пар SKU-кластер, без кластера {unmatched}, {time.perf_counter() - started:.1f} с")
+
+    def build(self, cells, names, synced_at):
+        skus, ids = sorted({sku for sku, _ in cells}), sorted(names)
+        row, col = {sku: i for i, sku in enumerate(skus)}, {cid: j for j, cid in enumerate(ids)}
+        if numpy is not None:
+            stock, sold = numpy.zeros((len(skus), len(ids))), numpy.zeros((len(skus), len(ids)))
+            if cells:
+                r = numpy.fromiter((row[sku] for sku, _ in cells), numpy.int64, len(cells))
+                c = numpy.fromiter((col[cid] for _, cid in cells), numpy.int64, len(cells))
+                values = numpy.array(list(cells.values()), dtype=float)
+                stock[r, c], sold[r, c] = values[:, 0], values[:, 1]
+        else:
+            stock, sold = [[0] * len(ids) for _ in skus], [[0] * len(ids) for _ in skus]
+            for (sku, cid), (st, so) in cells.items():
+                stock[row[sku]][col[cid]], sold[row[sku]][col[cid]] = st, so
+        with self.lock:
+            self.skus, self.cluster_ids, self.names, self.stock, self.sold = skus, ids, names, stock, sold
+            self.cells, self.synced_at, self.last_error = len(cells), synced_at, None
+
+    def load(self):
+        """Тёплый старт из локальной базы."""
+        cells, names = STORE.demand()
+        if names: self.build(cells, names, STORE.get_meta(STORE.owned("demand_synced_at")))
+
+    def sync(self):
+        with self.sync_lock: self.pull()
+        return self.status()
+
+    def status(self):
+        return {"skus": len(self.skus), "clusters": len(self.cluster_ids), "cells": self.cells, "days": self.days,
+                "synced_at": self.synced_at, "syncing": self.sync_lock.locked(), "error": self.last_error}
+
+    def start_refresh(self, interval=DEMAND_REFRESH):
+        def loop():
+            while True:
+                self.sync()
+                time.sleep(interval)
+        threading.Thread(target=bound(loop), name="demand-sync", daemon=True).start()
+
+    def need(self, stock, sold, cols, horizon, min_qty, top):
+        """Рекомендации по столбцам cols: top самых больших [(строка, столбец, количество)],
+        число ненулевых рекомендаций и сумма по каждому кластеру."""
+        if numpy is not None:
+            pick = slice(None) if len(cols) == stock.shape[1] else cols  # без копии всей матрицы
+            need = numpy.maximum(numpy.ceil(sold[:, pick] * (horizon / self.days) - stock[:, pick] - 1e-9), 0)
+            need[need < min_qty] = 0
+            r, c = numpy.nonzero(need)
+            q = need[r, c]
+            idx = numpy.arange(len(q))
+            if top < len(q):
+                # порог top-го значения; при равенстве - первые по (строка, столбец), как в цикле ниже
+                threshold = numpy.partition(q, len(q) - top)[len(q) - top]
+                above = numpy.nonzero(q > threshold)[0]
+                idx = numpy.concatenate([above, numpy.nonzero(q == threshold)[0][:top - len(above)]])
+            idx = idx[numpy.lexsort((c[idx], r[idx], -q[idx]))]
+            cells = list(zip(r[idx].tolist(), [cols[j] for j in c[idx].tolist()], q[idx].astype(int).tolist()))
+            return cells, len(q), need.sum(axis=0).astype(int).tolist()
+        cells, totals = [], [0] * len(cols)
+        for i, (stock_row, sold_row) in enumerate(zip(stock, sold)):
+            for k, j in enumerate(cols):
+                q = max(math.ceil(sold_row[j] * horizon / self.days - stock_row[j] - 1e-9), 0)
+                if q >= min_qty and q > 0:
+                    cells.append((i, j, q))
+                    totals[k] += q
+        return heapq.nsmallest(top, cells, key=lambda cell: (-cell[2], cell[0], cell[1])), len(cells), totals
+
+    def plan(self, cover_days=28, lead_days=7, cluster_ids=(), min_qty=1, limit=500):
+        """Рекомендуемые количества по SKU и кластерам, самые большие сверху. Для одного
+        кластера в ответе есть готовый состав черновика (draft) для /v1/draft/create.
+        Без данных запускает загрузку в фоне и сразу отвечает с syncing: true."""
+        syncing = self.sync_lock.locked()
+        if not self.skus and not syncing and time.monotonic() - self.tried > 60:
+            self.tried, syncing = time.monotonic(), True
+            threading.Thread(target=bound(self.sync), name="demand-sync", daemon=True).start()
+        started, catalog = time.perf_counter(), ACCOUNT.get().catalog
+        with self.lock: skus, ids, names, stock, sold = self.skus, self.cluster_ids, self.names, self.stock, self.sold
+        cols = [j for j, cid in enumerate(ids) if not cluster_ids or cid in cluster_ids]
+        top = max(limit, DRAFT_MAX_ITEMS if len(cols) == 1 else 0)
+        cells, lines, totals = (self.need(stock, sold, cols, cover_days + lead_days, min_qty, top) if skus and cols
+                                else ([], 0, [0] * len(cols)))
+        value = (lambda m, i, j: float(m[i, j])) if numpy is not None else (lambda m, i, j: m[i][j])
+
+        def line(i, j, q):
+            product = catalog.find(skus[i]) or {}
+            st, so = value(stock, i, j), value(sold, i, j)
+            ads = so / self.days
+            return {"sku": skus[i], "offer_id": product.get("offer_id"), "name": product.get("name"),
+                    "cluster_id": ids[j], "cluster_name": names.get(ids[j], ""), "stock": int(st), "sold": int(so),
+                    "ads": round(ads, 3), "cover_days": round(st / ads, 1) if ads else None, "quantity": q}
+
+        result = {"lines": lines, "units": sum(totals), "items": [line(*cell) for cell in cells[:limit]],
+                  "clusters": [{"cluster_id": ids[j], "name": names.get(ids[j], ""), "units": total}
+                               for j, total in zip(cols, totals)],
+                  "cover_days": cover_days, "lead_days": lead_days, "days": self.days, "synced_at": self.synced_at,
+                  "syncing": syncing, "error": self.last_error, "engine": "numpy" if numpy is not None else "python"}
+        if len(cols) == 1:
+            picked = cells[:DRAFT_MAX_ITEMS]
+            found = [(catalog.find(skus[i]), q) for i, _, q in picked]
+            result["draft"] = {"cluster_ids": [ids[cols[0]]], "items": [{"sku": skus[i], "quantity": q} for i, _, q in picked],
+                               "products": [{**Catalog.summary(p), "quantity": q} for p, q in found if p]}
+        result["took_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return result
+
+DEMAND = DemandPlanner()
+ACCOUNTS.default.attach(CATALOG, SUPPLIES, DEMAND)
+
+
+def int_arg(params, name, default):
+    try: return int(params.get(name, default))
+    except ValueError: return default
+
+
+class BodyStream(io.RawIOBase):
+    """Тело запроса длиной Content-Length как поток, без чтения целиком в память."""
+
+    def __init__(self, rfile, length):
+        self.rfile, self.left = rfile, length
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.left <= 0: return 0
+        n = self.rfile.readinto(memoryview(b)[:self.left]) or 0
+        self.left -= n
+        return n
+
+
+# Колонки файла массовой загрузки и их допустимые заголовки
+UPLOAD_COLUMNS = {
+    "offer_id": {"offer_id", "offer", "артикул"},
+    "sku": {"sku", "ozon_sku", "ozon sku"},
+    "quantity": {"quantity", "qty", "количество", "кол-во"},
+    "warehouse_id": {"warehouse_id", "warehouse", "склад"},
+    "cluster_id": {"cluster_id", "cluster", "кластер"},
+}
+
+def upload_rows(stream, xlsx=False):
+    """Строки CSV/XLSX по одной: (номер строки в файле, {колонка: значение})."""
+    if xlsx:
+        if openpyxl is None: raise ValueError("Для загрузки XLSX установите openpyxl")
+        data = stream.read(XLSX_MAX_BYTES + 1)
+        if len(data) > XLSX_MAX_BYTES: raise ValueError(f"XLSX больше {XLSX_MAX_BYTES // 1024 // 1024} МБ, загрузите CSV")
+        sheet = openpyxl.load_workbook(io.BytesIO(data), read_only=True).active
+        cell = lambda v: "" if v is None else str(int(v)) if isinstance(v, float) and v.is_integer() else str(v)
+        rows = ([cell(v) for v in row] for row in sheet.iter_rows(values_only=True))
+    else:
+        text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+        first = text.readline()
+        try: dialect = csv.Sniffer().sniff(first, ";,\t")
+        except csv.Error: dialect = csv.excel
+        rows = csv.reader(itertools.chain([first], text), dialect)
+    header = next(rows, None) or []
+    names = [next((name for name, aliases in UPLOAD_COLUMNS.items() if h.strip().lower() in aliases), None) for h in header]
+    if "quantity" not in names or not {"offer_id", "sku"} & set(names):
+        raise ValueError("Нужны колонки offer_id или sku и quantity")
+    for line, row in enumerate(rows, 2):
+        if any(v.strip() for v in row):
+            yield line, {name: v.strip() for name, v in zip(names, row) if name and v.strip()}
+
+def bulk_drafts(rows, warehouse_id=None, cluster_id=None):
+    """Проверяет строки по каталогу, собирает их в минимум черновиков
+    (по складу/кластеру, не больше DRAFT_MAX_ITEMS SKU) и создаёт их параллельно."""
+    report, groups, catalog = [], {}, ACCOUNT.get().catalog
+    for line, row in rows:
+        entry = {"row": line, "offer_id": row.get("offer_id"), "sku": row.get("sku"), "quantity": row.get("quantity"), "status": "error"}
+        report.append(entry)
+        product = catalog.find(row["offer_id"]) if row.get("offer_id") else catalog.find(row.get("sku", ""))
+        target = row.get("warehouse_id") or warehouse_id, row.get("cluster_id") or cluster_id
+        try: quantity = float(row.get("quantity", ""))
+        except ValueError: quantity = 0
+        quantity = int(quantity) if math.isfinite(quantity) else 0  # inf/1e999 - ошибка строки, а не OverflowError
+        if product is None: entry["error"] = "Товар не найден в каталоге"
+        elif quantity <= 0: entry["error"] = "Количество должно быть больше 0"
+        elif not any(target) or not all(str(t).isdigit() for t in target if t): entry["error"] = "Не указан склад или кластер"
+        else:
+            sku = product.get("sku") or min(Catalog.skus(product), default=product["product_id"])
+            entry.update(quantity=quantity, sku=sku, status="pending")
+            key = ("warehouse_id", int(target[0])) if target[0] else ("cluster_id", int(target[1]))
+            groups.setdefault(key, {}).setdefault(sku, []).append(entry)
+
+    drafts = []
+    for (kind, target_id), by_sku in groups.items():
+        for part in chunks(by_sku.items(), DRAFT_MAX_ITEMS):
+            body = {"items": [{"sku": sku, "quantity": sum(e["quantity"] for e in entries)} for sku, entries in part]}
+            body.update({"warehouse_id": target_id} if kind == "warehouse_id" else {"cluster_ids": [target_id]})
+            drafts.append((body, [e for _, entries in part for e in entries]))
+
+    def submit(draft):
+        body, entries = draft
+        result, _, _ = ozon_cached("/v1/draft/create", body)
+        for e in entries:
+            if result.get("error"): e.update(status="error", error=str(result.get("message"))[:300])
+            else: e.update(status="ok", draft_id=result.get("draft_id") or result.get("operation_id"))
+
+    with ThreadPoolExecutor(4) as pool: list(pool.map(bound(submit), drafts))
+    ok = sum(e["status"] == "ok" for e in report)
+    return {"rows": len(report), "ok": ok, "errors": len(report) - ok, "drafts": len(drafts), "report": report}
+
+
+
+class JobError(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, kind, params, first_step):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind, self.params = kind, params
+        self.step, self.state = first_step, "queued"
+        self.result, self.error = {}, None
+        self.created = time.time()
+        self.updated = self.created
+        self.deadline = self.created + JOB_TIMEOUT
+        self.scratch = {}  # служебное состояние шагов, в to_dict не попадает
+        self.account = ACCOUNT.get()  # шаги выполняются от имени аккаунта, создавшего задачу
+        self.lock = threading.Lock()
+
+    def update(self, step=None, state=None, error=None, **result):
+        with self.lock:
+            moved = (step and step != self.step) or (state and state != self.state)
+            if step: self.step = step
+            if state: self.state = state
+            if error: self.error = error
+            self.result.update(result)
+            self.updated = time.time()
+        if moved: EVENTS.publish("job", self.to_dict(), self.account)
+
+    def to_dict(self):
+        with self.lock:
+            return {"id": self.id, "type": self.kind, "state": self.state, "step": self.step, "result": dict(self.result),
+                    "error": self.error, "created": self.created, "updated": self.updated, "account": self.account.name}
+
+
+def ozon_checked(endpoint, body):
+    result, _, _ = ozon_cached(endpoint, body)
+    if isinstance(result, dict) and result.get("error"):
+        raise JobError(f"{endpoint}: {str(result.get('message'))[:300]}")
+    return result
+
+# Шаги задачи "draft": черновик -> расчёт -> таймслот -> заявка -> статус заявки.
+# Шаг возвращает (следующий шаг, пауза в секундах), None - задача завершена.
+def draft_create(job):
+    if not job.params.get("draft"): raise JobError("Не передан состав черновика")
+    d = ozon_checked("/v1/draft/create", job.params["draft"])
+    if d.get("draft_id"):
+        job.update(draft_id=d["draft_id"])
+        return "timeslots", 0
+    job.update(operation_id=d.get("operation_id"))
+    return "draft_info", JOB_POLL
+
+def draft_info(job):
+    d = ozon_checked("/v1/draft/create/info", {"operation_id": job.result["operation_id"]})
+    status = d.get("status") or ""
+    if status.endswith("IN_PROGRESS") or not status: return "draft_info", JOB_POLL
+    if not status.endswith("SUCCESS"): raise JobError(f"Черновик не рассчитан: {d.get('errors') or status}")
+    warehouses = [w["supply_warehouse"]["warehouse_id"] for c in d.get("clusters") or [] for w in c.get("warehouses") or []
+                  if (w.get("status") or {}).get("is_available", True) and w.get("supply_warehouse")]
+    job.update(draft_id=d.get("draft_id"), warehouses=warehouses)
+    return "timeslots", 0
+
+def draft_timeslots(job):
+    if job.params.get("timeslot"):
+        job.update(timeslot=job.params["timeslot"], warehouse_id=job.params.get("warehouse_id"))
+        return "supply_create", 0
+    warehouse_ids = [job.params["warehouse_id"]] if job.params.get("warehouse_id") else job.result.get("warehouses", [])
+    if not warehouse_ids: raise JobError("Нет доступных складов для черновика")
+    found, _ = SLOTS.find(job.result["draft_id"], warehouse_ids, (), job.params.get("date_from"), job.params.get("date_to"),
+                          fresh=job.scratch.get("slots_checked", False))
+    if found["slots"]:
+        slot = found["slots"][0]  # самый ранний слот среди всех складов
+        job.update(warehouse_id=slot["warehouse_id"], timeslot=slot["timeslot"])
+        return "supply_create", 0
+    if found["errors"] and len(found["errors"]) == found["queries"]: raise JobError(f"/v1/draft/timeslot/info: {found['errors'][0]}")
+    if job.params.get("wait_slot"):
+        job.scratch["slots_checked"] = True  # повторный поиск - мимо кэша сводки
+        return "timeslots", max(JOB_POLL, 30)
+    raise JobError("Нет свободных таймслотов в выбранном периоде")
+
+def draft_supply_create(job):
+    d = ozon_checked("/v1/draft/supply/create", {
+        "draft_id": job.result["draft_id"], "warehouse_id": job.result["warehouse_id"], "timeslot": job.result["timeslot"],
+    })
+    job.update(supply_operation_id=d.get("operation_id"))
+    return "supply_status", JOB_POLL
+
+def draft_supply_status(job):
+    d = ozon_checked("/v1/draft/supply/create/status", {"operation_id": job.result["supply_operation_id"]})
+    status = d.get("status") or ""
+    if status.endswith("IN_PROGRESS") or not status: return "supply_status", JOB_POLL
+    if not status.endswith("SUCCESS"): raise JobError(f"Заявка не создана: {d.get('error_messages') or status}")
+    job.update(order_ids=(d.get("result") or {}).get("order_ids") or [])
+    ACCOUNT.get().supplies.invalidate()
+    return None, 0
+
+# Задача "slot_watch": периодический поиск слотов, новые слоты попадают в result.new_slots и в лог
+def slot_watch(job):
+    p = job.params
+    if "seen" not in job.scratch:
+        job.deadline = job.created + min(float(p.get("duration") or JOB_TIMEOUT), 86400)
+    interval = max(float(p.get("interval") or SLOT_WATCH), 10)
+    try:
+        found, _ = SLOTS.find(p.get("draft_id"), p.get("warehouse_ids") or (), p.get("cluster_ids") or (),
+                              p.get("date_from"), p.get("date_to"), fresh=True)
+    except ValueError as e:
+        raise JobError(str(e))
+    keys = {(s["warehouse_id"], s["from"]) for s in found["slots"]}
+    if "seen" in job.scratch:
+        new = [s for s in found["slots"] if (s["warehouse_id"], s["from"]) not in job.scratch["seen"]]
+        if new:
+            log("success", "slots", f"Черновик {p.get('draft_id')}: новых слотов {len(new)}, ближайший {new[0]['from']} на складе {new[0]['warehouse_id']}")
+            EVENTS.publish("slots", {"job": job.id, "draft_id": p.get("draft_id"), "slots": new[:50]})
+            job.update(new_slots=new[:50], found=job.result.get("found", 0) + len(new), found_at=time.time())
+    job.scratch["seen"] = keys
+    job.update(slots=len(keys), best=found["slots"][:1], checks=job.result.get("checks", 0) + 1, errors=found["errors"][:3])
+    if time.time() + interval > job.deadline: return None, 0
+    return "watch", interval
+
+# Задача "cargoes": расчёт грузомест -> отправка пачками по CARGO_BATCH -> ожидание операций
+def cargo_plan(job):
+    if not job.params.get("supply_id"): raise JobError("Не передан supply_id")
+    try: plan = CARGOES.plan(CargoPacker.request_items(job.params), job.params.get("cargo_type"), job.params.get("templates"))
+    except ValueError as e: raise JobError(str(e))
+    if plan["unpacked"]:
+        first = plan["unpacked"][0]
+        raise JobError(f"Не разложено товаров: {len(plan['unpacked'])} ({first.get('offer_id') or first.get('sku')}: {first['reason']})")
+    if not plan["items"]: raise JobError("Нет товаров для грузомест")
+    missing = [line["offer_id"] or line["sku"] for line in plan["items"] if not line["barcode"]]
+    if missing: raise JobError(f"Нет штрихкода у товаров: {', '.join(map(str, missing[:5]))}")
+    job.scratch["batches"] = list(chunks(CargoPacker.cargoes(plan), CARGO_BATCH))
+    job.update(places=plan["places"], batches=len(job.scratch["batches"]), sent=0, operation_ids=[])
+    return "submit", 0
+
+def cargo_submit(job):
+    sent = job.result["sent"]
+    d = ozon_checked("/v1/cargoes/create", {"supply_id": job.params["supply_id"], "delete_current_version": sent == 0,
+                                            "cargoes": job.scratch["batches"][sent]})
+    if not d.get("operation_id"): raise JobError(f"/v1/cargoes/create: нет operation_id в ответе {str(d)[:200]}")
+    if sent == 0: LABELS.invalidate(job.params["supply_id"])  # прежний набор мест удалён вместе с его этикетками
+    job.update(sent=sent + 1, operation_ids=job.result["operation_ids"] + [d["operation_id"]])
+    return ("submit", 0) if sent + 1 < job.result["batches"] else ("cargo_status", JOB_POLL)
+
+def cargo_status(job):
+    done = job.scratch.setdefault("cargo_ids", {})
+    for op in job.result["operation_ids"]:
+        if op in done: continue
+        d = ozon_checked("/v1/cargoes/create/info", {"operation_id": op})
+        status = d.get("status") or ""
+        if status.endswith("IN_PROGRESS") or not status: continue
+        if not status.endswith("SUCCESS"): raise JobError(f"Грузоместа не созданы: {d.get('errors') or status}")
+        done[op] = [(c.get("value") or {}).get("cargo_id") for c in (d.get("result") or {}).get("cargoes") or []]
+    if len(done) < len(job.result["operation_ids"]): return "cargo_status", JOB_POLL
+    job.update(cargo_ids=[i for op in job.result["operation_ids"] for i in done[op]])
+    return None, 0
+
+# Задача "labels": этикетки для многих поставок параллельно -> опрос с растущей паузой -> файлы на диске.
+# Уже скачанные этикетки повторно не запрашиваются, если не передан "fresh": true
+def labels_create(job):
+    p = job.params
+    try:
+        targets = [(int(t["supply_id"]), tuple(sorted(map(int, t.get("cargo_ids") or []))))
+                   for t in p.get("supplies") or [{"supply_id": s} for s in p.get("supply_ids") or []]]
+    except (KeyError, TypeError, ValueError):
+        raise JobError("Неверный список поставок")
+    if not targets: raise JobError("Не переданы поставки (supply_ids или supplies)")
+    LABELS.evict()
+    fresh = [t for t in dict.fromkeys(targets) if p.get("fresh") or not LABELS.file(LABELS.key(*t))]
+
+    def create(target):
+        supply_id, cargo_ids = target
+        body = {"supply_id": supply_id, **({"cargoes": [{"cargo_id": c} for c in cargo_ids]} if cargo_ids else {})}
+        d = ozon_checked("/v1/cargoes-label/create", body)
+        if not d.get("operation_id"): raise JobError(f"/v1/cargoes-label/create: нет operation_id для поставки {supply_id}")
+        return LABELS.key(*target), d["operation_id"]
+
+    with ThreadPoolExecutor(4) as pool: job.scratch["pending"] = dict(pool.map(bound(create), fresh))
+    job.scratch["polls"] = 0
+    keys = list(dict.fromkeys(LABELS.key(*t) for t in targets))
+    job.update(keys=keys, ready=len(keys) - len(fresh), cached=len(keys) - len(fresh))
+    return "poll", JOB_POLL if fresh else 0
+
+def labels_poll(job):
+    pending = job.scratch["pending"]
+
+    def check(item):
+        key, operation_id = item
+        d = ozon_checked("/v1/cargoes-label/get", {"operation_id": operation_id})
+        d = d.get("result") or d
+        status = (d.get("status") or "").upper()
+        if d.get("file_guid") and "FAIL" not in status and "ERROR" not in status: return key, LABELS.download(d["file_guid"], key)
+        if "FAIL" in status or "ERROR" in status: raise JobError(f"Этикетки {key} не сформированы: {d.get('error') or status}")
+        return key, None
+
+    with ThreadPoolExecutor(4) as pool: done = [key for key, size in pool.map(bound(check), list(pending.items())) if size is not None]
+    for key in done: del pending[key]
+    job.update(ready=job.result["ready"] + len(done))
+    if pending:
+        job.scratch["polls"] += 1
+        return "poll", min(JOB_POLL * 2 ** job.scratch["polls"], 60)
+    job.update(download=LABELS.url(job.result["keys"]))
+    return None, 0
+
+JOB_PIPELINES = {
+    "draft": {"create": draft_create, "draft_info": draft_info, "timeslots": draft_timeslots,
+              "supply_create": draft_supply_create, "supply_status": draft_supply_status},
+    "slot_watch": {"watch": slot_watch},
+    "cargoes": {"plan": cargo_plan, "submit": cargo_submit, "cargo_status": cargo_status},
+    "labels": {"labels_create": labels_create, "poll": labels_poll},
+}
+
+
+class JobEngine:
+    """Фоновые многошаговые задачи. Ожидание между опросами держит не поток,
+    а запись в куче планировщика; шаги выполняет небольшой пул воркеров."""
+    KEEP = 500  # сколько завершённых задач помнить
+
+    def __init__(self, pipelines=JOB_PIPELINES, workers=JOB_WORKERS):
+        self.pipelines = pipelines
+        self.jobs = OrderedDict()
+        self.heap = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="job")
+        self.started = False
+
+    def submit(self, kind, params):
+        if kind not in self.pipelines: raise ValueError(f"Неизвестный тип задачи: {kind}")
+        job = Job(kind, params, next(iter(self.pipelines[kind])))
+        with self.cond:
+            self.jobs[job.id] = job
+            finished = [j.id for j in self.jobs.values() if j.state in ("done", "failed")]
+            for job_id in finished[:max(len(finished) - self.KEEP, 0)]: del self.jobs[job_id]
+            if not self.started:
+                threading.Thread(target=self.loop, name="job-scheduler", daemon=True).start()
+                self.started = True
+        self.schedule(job, 0)
+        return job
+
+    def schedule(self, job, delay):
+        with self.cond:
+            heapq.heappush(self.heap, (time.monotonic() + delay, next(self.seq), job))
+            self.cond.notify()
+
+    def loop(self):
+        while True:
+            with self.cond:
+                while not self.heap or self.heap[0][0] > time.monotonic():
+                    self.cond.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                job = heapq.heappop(self.heap)[2]
+            self.pool.submit(self.run, job)
+
+    def run(self, job):
+        with using(job.account): self.step(job)
+
+    def step(self, job):
+        job.update(state="running")
+        try:
+            if time.time() > job.deadline: raise JobError("Превышено время ожидания")
+            step, delay = self.pipelines[job.kind][job.step](job)
+        except Exception as e:
+            job.update(state="failed", error=str(e))
+            log("error", f"job {job.id}", f"{job.step}: {e}")
+            return
+        if step is None:
+            job.update(state="done")
+            log("success", f"job {job.id}", f"Готово: {job.to_dict()['result']}")
+            return
+        job.update(step=step, state="waiting" if delay else "queued")
+        self.schedule(job, delay)
+
+    def get(self, job_id):
+        # Задачи видны только своему аккаунту
+        with self.cond: job = self.jobs.get(job_id)
+        return job and job.account is ACCOUNT.get() and job.to_dict()
+
+    def list(self, limit=100):
+        account = ACCOUNT.get()
+        with self.cond: jobs = [job for job in self.jobs.values() if job.account is account][-limit:]
+        return [job.to_dict() for job in reversed(jobs)]
+
+JOBS = JobEngine()
 
 HTML = r'''<!DOCTYPE html>
 <html lang="ru">
@@ -65,6 +2522,7 @@ body{font-family:-apple-system,BlinkMacSystemFont,"Segoe UI",Roboto,sans-serif;b
 .header-nav a:hover{background:#f2f3f5}
 .header-nav a.active{background:#005bff;color:#fff}
 .header-right{margin-left:auto;display:flex;align-items:center;gap:16px}
+.account-select{padding:6px 10px;border:1px solid #e4e7ed;border-radius:8px;font-size:13px;background:#fff}
 .conn-status{display:flex;align-items:center;gap:6px;font-size:13px;padding:6px 12px;background:#f2f3f5;border-radius:8px}
 .conn-dot{width:8px;height:8px;border-radius:50%}
 .conn-dot.ok{background:#00a676}
@@ -199,6 +2657,13 @@ body{font-family:-apple-system,BlinkMacSystemFont,"Segoe UI",Roboto,sans-serif;b
 .log-level.success{background:#e6f9f1;color:#00a676}
 .log-level.error{background:#ffe6eb;color:#f91155}
 .log-level.request{background:#e6f4ff;color:#005bff}
+.log-level.retry{background:#fff8e6;color:#d48806}
+
+/* Supply orders */
+.supply-filters{display:flex;gap:12px;flex-wrap:wrap;margin-bottom:12px}
+.supply-summary{font-size:13px;color:#5c6b7a;margin-bottom:8px}
+.supply-viewport{height:60vh;overflow-y:auto;border:1px solid #e4e7ed;border-radius:12px}
+.supply-row{position:absolute;left:0;right:0;height:64px;box-sizing:border-box;padding:10px 16px;border-bottom:1px solid #f2f3f5;display:flex;justify-content:space-between;align-items:center}
 
 /* Selected products summary */
 .selected-products{margin-top:16px}
@@ -220,6 +2685,7 @@ body{font-family:-apple-system,BlinkMacSystemFont,"Segoe UI",Roboto,sans-serif;b
         <a href="#" onclick="showPage('logs')">Логи</a>
     </div>
     <div class="header-right">
+        <select class="account-select" id="account" style="display:none" onchange="setAccount(this.value)"></select>
         <div class="conn-status" id="conn">
             <div class="conn-dot load"></div>
             <span>Проверка...</span>
@@ -248,10 +2714,22 @@ var S = {
     dateTo: '',
     pointType: 'SC',
     points: [],
+    origin: '',
     selectedPoint: null,
+    units: {}, // {product_id: {volume, weight}} per unit, from /drafts/estimate
+    pallet: null,
+    account: localStorage.getItem('account') || '',
     draftId: null
 };
 
+// Every request to the server is made on behalf of the selected seller account
+var serverFetch = window.fetch.bind(window);
+window.fetch = function(url, opts) {
+    opts = Object.assign({}, opts);
+    if (S.account) opts.headers = Object.assign({}, opts.headers, {'X-Ozon-Account': S.account});
+    return serverFetch(url, opts);
+};
+
 // Init dates
 var today = new Date();
 var tomorrow = new Date(today.getTime() + 24*60*60*1000);
@@ -279,6 +2757,40 @@ function api(ep, body) {
     }).then(r => r.json());
 }
 
+function loadAccounts() {
+    fetch('/accounts').then(r => r.json()).then(d => {
+        if (d.error) {  // the saved account is gone from the server config
+            S.account = '';
+            localStorage.removeItem('account');
+            connectEvents();
+            return loadAccounts();
+        }
+        var sel = document.getElementById('account');
+        sel.innerHTML = d.accounts.map(a => `<option value="${a.name}">${a.name} (${a.client_id})</option>`).join('');
+        sel.value = S.account = d.current;
+        sel.style.display = d.accounts.length > 1 ? '' : 'none';
+    });
+}
+
+function setAccount(name) {
+    S.account = name;
+    localStorage.setItem('account', name);
+    S.lastLogId = 0;
+    // Products, demand and the draft in progress belong to the previous account
+    S.draftId = null;
+    S.step = 1;
+    S.products = [];
+    S.selectedProducts = {};
+    S.selectedPoint = null;
+    S.units = {};
+    S.pallet = null;
+    S.demandClusters = null;
+    S.demandCluster = null;
+    connectEvents();
+    render();
+    testConn();
+}
+
 function showPage(p) {
     S.page = p;
     document.querySelectorAll('.header-nav a').forEach((a, i) => {
@@ -337,7 +2849,8 @@ function renderCreate(c) {
 function renderSidebar() {
     var totalQty = Object.values(S.selectedProducts).reduce((a, b) => a + b.qty, 0);
     var totalProducts = Object.keys(S.selectedProducts).length;
-    var totalVolume = Object.values(S.selectedProducts).reduce((a, b) => a + (b.qty * 0.3), 0).toFixed(1);
+    var est = estimateSelection();
+    var totalVolume = est.pending ? '…' : est.volume.toFixed(1);
     
     var hasProducts = totalProducts > 0;
     var hasPoint = S.selectedPoint !== null;
@@ -354,6 +2867,13 @@ function renderSidebar() {
                         ${totalProducts} товар, ${totalQty} шт, ${totalVolume} л
                     </span>
                 </div>
+                <div class="sidebar-row">
+                    <span class="sidebar-label">${S.pallet ? 'Вес и палеты' : 'Вес'}</span>
+                    <span class="sidebar-value">
+                        ${est.pending ? '…' : `${est.weight.toFixed(1)} кг` + (S.pallet ? `, ≈ ${est.pallets.toFixed(2)} палет` : '')}
+                        ${est.unknown ? `<br><span style="color:#e53935">без габаритов: ${est.unknown}</span>` : ''}
+                    </span>
+                </div>
                 <div class="sidebar-row">
                     <span class="sidebar-label">Период отгрузки</span>
                     <span class="sidebar-value">
@@ -405,6 +2925,12 @@ function renderStep1(sc) {
             <input type="text" class="search-input" id="search" placeholder="Название, артикул или SKU" onkeyup="searchProducts(this.value)">
         </div>
         
+        <div class="supply-filters">
+            <select class="date-input" id="demand-cluster"><option value="">Кластер для пополнения</option></select>
+            <input type="number" class="date-input" id="demand-cover" value="28" min="1" title="Дней покрытия" style="width:90px">
+            <button class="btn btn-secondary" onclick="fillByDemand()">📈 Заполнить по спросу</button>
+        </div>
+        
         <div style="font-size:13px;color:#5c6b7a;margin-bottom:12px">Некоторые из ваших товаров</div>
         
         <div class="product-list" id="product-list">
@@ -420,16 +2946,76 @@ function renderStep1(sc) {
     `;
     
     loadProducts();
+    loadDemandClusters();
+}
+
+// Suggested quantities come from stock and sales per cluster (/replenishment)
+function loadDemandClusters() {
+    var fill = clusters => {
+        var sel = document.getElementById('demand-cluster');
+        if (!sel) return;
+        sel.innerHTML = '<option value="">Кластер для пополнения</option>' + clusters.filter(c => c.units > 0)
+            .sort((a, b) => b.units - a.units)
+            .map(c => `<option value="${c.cluster_id}">${c.name} — ${c.units} шт</option>`).join('');
+    };
+    if (S.demandClusters) return fill(S.demandClusters);
+    fetch('/replenishment?limit=1').then(r => r.json()).then(d => {
+        if (!d.syncing || d.clusters.length) return fill(S.demandClusters = d.clusters);
+        // Stock and sales are still loading on the server: ask again later while step 1 is open
+        if (!S.demandRetry) S.demandRetry = setTimeout(() => {
+            S.demandRetry = null;
+            if (S.page === 'create' && S.step === 1) loadDemandClusters();
+        }, 10000);
+    });
 }
 
-function loadProducts() {
+function fillByDemand() {
+    var cluster = document.getElementById('demand-cluster').value;
+    if (!cluster) {
+        toast('Выберите кластер', 'error');
+        return;
+    }
+    var cover = document.getElementById('demand-cover').value || 28;
+    var name = document.getElementById('demand-cluster').selectedOptions[0].textContent.split(' — ')[0];
+    fetch(`/replenishment?cluster_id=${cluster}&cover_days=${cover}&limit=1`).then(r => r.json()).then(d => {
+        if (d.syncing && !d.lines) {
+            toast('Остатки и продажи ещё загружаются, попробуйте позже', '');
+            return;
+        }
+        if (!d.draft || !d.draft.products.length) {
+            toast('Пополнение не требуется', '');
+            return;
+        }
+        S.selectedProducts = {};
+        d.draft.products.forEach(p => S.selectedProducts[p.product_id] = {product: p, qty: p.quantity});
+        // Quantities were computed for this cluster, so the draft goes to it as well
+        S.demandCluster = {ids: d.draft.cluster_ids, name: name};
+        toast(`Добавлено товаров: ${d.draft.products.length}, кластер ${name}`, 'success');
+        renderStepContent();
+        updateSidebar();
+    });
+}
+
+function loadProducts(q) {
+    fetch('/products/search?limit=20&q=' + encodeURIComponent(q || '')).then(r => r.json()).then(d => {
+        if (!d.synced) {
+            loadProductsDirect(q);
+            return;
+        }
+        S.products = d.items;
+        renderProductList();
+    });
+}
+
+// Каталог на сервере ещё не синхронизирован - берём первую страницу напрямую из Ozon
+function loadProductsDirect(q) {
     api('/v3/product/list', {filter: {visibility: 'ALL'}, limit: 50}).then(d => {
         if (d.error) {
             document.getElementById('product-list').innerHTML = `<div class="empty-state"><div class="empty-icon">❌</div><div class="empty-title">Ошибка загрузки</div><div class="empty-text">${d.message}</div></div>`;
             return;
         }
         S.products = d.result ? d.result.items : [];
-        renderProductList();
+        renderProductList(q);
     });
 }
 
@@ -469,8 +3055,10 @@ function renderProductList(filter) {
     }).join('');
 }
 
+var searchTimer = null;
 function searchProducts(val) {
-    renderProductList(val);
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => loadProducts(val), 150);
 }
 
 function changeQty(pid, delta) {
@@ -534,6 +3122,10 @@ function renderStep2(sc) {
         
         <div style="font-size:14px;font-weight:600;margin-bottom:12px">Точка отгрузки</div>
         <div style="font-size:13px;color:#5c6b7a;margin-bottom:12px">Можно указать свой склад — покажем точки возле него</div>
+        <div class="search-box">
+            <span class="search-icon">📍</span>
+            <input type="text" class="search-input" id="point-origin" value="${S.origin || ''}" placeholder="Город, адрес или координаты склада" onchange="S.origin=this.value.trim();loadPoints()">
+        </div>
         
         <div class="point-types">
             ${pointTypes.map(pt => `<div class="point-type ${S.pointType === pt.id ? 'active' : ''}" onclick="selectPointType('${pt.id}')">${pt.name}</div>`).join('')}
@@ -561,35 +3153,21 @@ function selectPointType(type) {
 }
 
 function loadPoints() {
-    // Load FBO warehouses for supply - use correct FBO endpoint
-    api('/v1/warehouse/fbo/list', {}).then(d => {
-        if (d.error) {
-            // Fallback to regular warehouse list if FBO endpoint fails
-            console.log('FBO list failed, trying regular warehouse list...');
-            api('/v1/warehouse/list', {}).then(d2 => {
-                if (d2.error) {
-                    document.getElementById('points-list').innerHTML = `<div class="empty-state"><div class="empty-icon">❌</div><div class="empty-text">${d2.message || d.message}</div></div>`;
-                    return;
-                }
-                processWarehouses(d2.result || []);
-            });
+    // Nearest points of the selected type come from the server-side index (/points)
+    var q = new URLSearchParams({type: S.pointType, limit: 20});
+    if (S.origin) q.set('near', S.origin);
+    fetch('/points?' + q).then(r => r.json()).then(d => {
+        var pl = document.getElementById('points-list');
+        if (!pl) return;
+        if (d.error && !d.items) {
+            pl.innerHTML = `<div class="empty-state"><div class="empty-icon">❌</div><div class="empty-text">${d.message}</div></div>`;
             return;
         }
-        processWarehouses(d.result || []);
+        S.points = d.items;
+        renderPoints();
     });
 }
 
-function processWarehouses(warehouses) {
-    // Map warehouse data to unified format
-    S.points = warehouses.map(p => ({
-        warehouse_id: p.warehouse_id || p.id,
-        name: p.name || ('Склад ' + (p.warehouse_id || p.id)),
-        address: p.address || p.city || '',
-        is_fbo: p.is_fbo !== false
-    }));
-    renderPoints();
-}
-
 function renderPoints() {
     var pl = document.getElementById('points-list');
 
@@ -598,13 +3176,13 @@ function renderPoints() {
         return;
     }
 
-    pl.innerHTML = S.points.slice(0, 15).map((p, i) => {
+    pl.innerHTML = S.points.map((p, i) => {
         var isSelected = S.selectedPoint && S.selectedPoint.warehouse_id === p.warehouse_id;
         return `<div class="point-item ${isSelected ? 'selected' : ''}" onclick="selectPoint(${i})">
             <div class="point-icon">📍</div>
             <div class="point-info">
                 <div class="point-name">${p.name || 'Точка ' + p.warehouse_id}</div>
-                <div class="point-address">${p.address ? p.address + ' • ' : ''}ID: ${p.warehouse_id}</div>
+                <div class="point-address">${p.address ? p.address + ' • ' : ''}${p.distance_km != null ? p.distance_km + ' км • ' : ''}ID: ${p.warehouse_id}</div>
             </div>
         </div>`;
     }).join('');
@@ -619,6 +3197,41 @@ function selectPoint(idx) {
     if (btn) btn.disabled = false;
 }
 
+// Per-unit volume and weight are fetched once per product from /drafts/estimate,
+// totals are recomputed locally on every quantity change
+function estimateSelection() {
+    var est = {volume: 0, weight: 0, pallets: 0, pending: 0, unknown: 0}, missing = [];
+    Object.entries(S.selectedProducts).forEach(([pid, item]) => {
+        var u = S.units[pid];
+        if (!u) missing.push(pid);
+        else if (u.unknown) est.unknown++;
+        else {
+            est.volume += u.volume * item.qty;
+            est.weight += u.weight * item.qty;
+        }
+    });
+    if (S.pallet) est.pallets = Math.max(est.volume / S.pallet.volume_l, est.weight / S.pallet.max_weight_kg);
+    est.pending = missing.length;
+    if (missing.length && !S.unitsLoading) fetchUnits(missing);
+    return est;
+}
+
+function fetchUnits(pids) {
+    S.unitsLoading = true;
+    fetch('/drafts/estimate', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({items: pids.map(pid => ({product_id: pid, quantity: 1}))})
+    }).then(r => r.json()).then(d => {
+        if (d.error) throw new Error(d.message);
+        d.items.forEach(i => S.units[i.product_id] = {volume: i.unit_volume_l, weight: i.unit_weight_kg});
+        pids.forEach(pid => S.units[pid] = S.units[pid] || {unknown: true});
+        S.pallet = d.pallet;
+        S.unitsLoading = false;
+        if (document.querySelector('.sidebar')) updateSidebar();
+    }).catch(() => S.unitsLoading = false);
+}
+
 function updateSidebar() {
     document.querySelector('.sidebar').innerHTML = renderSidebar();
 }
@@ -637,6 +3250,7 @@ function renderStep3(sc) {
                 <strong>Товаров:</strong> ${totalProducts} наименований, ${totalQty} шт<br>
                 <strong>Период:</strong> ${formatDateShort(S.dateFrom)} — ${formatDateShort(S.dateTo)}<br>
                 <strong>Точка:</strong> ${S.selectedPoint ? S.selectedPoint.name : 'Не выбрана'}
+                ${S.demandCluster ? `<br><strong>Кластер:</strong> ${S.demandCluster.name}` : ''}
             </div>
         </div>
         
@@ -650,11 +3264,51 @@ function renderStep3(sc) {
             `).join('')}
         </div>
         
+        <div style="margin:24px 0">
+            <div style="display:flex;justify-content:space-between;align-items:center;margin-bottom:12px">
+                <span style="font-weight:600">Грузоместа (один SKU в месте):</span>
+                <select class="date-input" id="cargo-type" onchange="planCargoes()">
+                    <option value="BOX">Коробки</option><option value="PALLET">Палеты</option>
+                </select>
+            </div>
+            <div id="cargo-plan"><div class="loading"><div class="spinner"></div></div></div>
+        </div>
+        
         <div class="footer-actions">
             <button class="btn btn-secondary" onclick="prevStep()">Назад</button>
             <button class="btn btn-success btn-lg" onclick="createDraft()">🚀 Создать черновик</button>
         </div>
     `;
+    planCargoes();
+}
+
+// Cargo places are packed on the server from catalog dimensions and weights
+function planCargoes() {
+    var box = document.getElementById('cargo-plan');
+    var items = Object.values(S.selectedProducts).map(item => ({
+        sku: item.product.sku || item.product.product_id,
+        quantity: item.qty
+    }));
+    if (!box || !items.length) return;
+    fetch('/cargoes/plan', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({items: items, cargo_type: document.getElementById('cargo-type').value})
+    }).then(r => r.json()).then(p => {
+        if (p.error) {
+            box.innerHTML = `<div class="info-text">${p.message}</div>`;
+            return;
+        }
+        box.innerHTML = `<div class="info-text" style="margin-bottom:8px">
+                <strong>${p.places}</strong> мест, ${p.volume_l} л, ${p.weight_kg} кг, заполнение ${Math.round(p.fill * 100)}%
+            </div>` + p.items.concat(p.unpacked).map(line => `
+            <div style="display:flex;justify-content:space-between;padding:8px 0;border-bottom:1px solid #e4e7ed">
+                <span>${(line.name || line.offer_id || line.sku || '').slice(0, 50)}</span>
+                <span>${line.places ? line.places.map(g => `${g.count} × ${g.template} по ${g.quantity} шт`).join(', ')
+                                    : `<span style="color:#e53935">${line.reason}</span>`}</span>
+            </div>
+        `).join('');
+    });
 }
 
 function createDraft() {
@@ -662,31 +3316,93 @@ function createDraft() {
     
     // Prepare items
     var items = Object.values(S.selectedProducts).map(item => ({
-        sku: item.product.product_id,
+        sku: item.product.sku || item.product.product_id,
         quantity: item.qty
     }));
+    var warehouseId = S.selectedPoint ? S.selectedPoint.warehouse_id : undefined;
     
-    api('/v1/draft/create', {
-        items: items,
-        warehouse_id: S.selectedPoint ? S.selectedPoint.warehouse_id : undefined
-    }).then(d => {
-        if (d.error) {
-            toast('Ошибка: ' + (d.message || '').slice(0, 100), 'error');
+    // Черновик, таймслот и заявку проводит фоновая задача на сервере
+    fetch('/jobs', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({
+            type: 'draft',
+            draft: Object.assign({items: items, warehouse_id: warehouseId},
+                                 S.demandCluster ? {cluster_ids: S.demandCluster.ids} : {}),
+            warehouse_id: warehouseId,
+            date_from: S.dateFrom,
+            date_to: S.dateTo
+        })
+    }).then(r => r.json()).then(job => {
+        if (job.error) {
+            toast('Ошибка: ' + (job.message || '').slice(0, 100), 'error');
             return;
         }
-        S.draftId = d.draft_id || d.operation_id || d.result;
-        toast('Черновик создан! ID: ' + S.draftId, 'success');
+        toast('Задача ' + job.id + ' запущена', '');
+        watchJob(job.id, null);
         
         // Reset
-        setTimeout(() => {
-            S.step = 1;
-            S.selectedProducts = {};
-            S.selectedPoint = null;
-            render();
-        }, 2000);
+        S.step = 1;
+        S.selectedProducts = {};
+        S.selectedPoint = null;
+        S.demandCluster = null;
+        render();
+    });
+}
+
+var JOB_STEPS = {create: 'создание черновика', draft_info: 'расчёт черновика', timeslots: 'поиск таймслота',
+                 supply_create: 'создание заявки', supply_status: 'ожидание заявки', watch: 'отслеживание слотов',
+                 plan: 'расчёт грузомест', submit: 'отправка грузомест', cargo_status: 'ожидание грузомест',
+                 labels_create: 'запрос этикеток', poll: 'ожидание этикеток'};
+
+// Labels are generated by a background job; the finished files are served from the server's disk cache
+function makeLabels(supplyIds) {
+    fetch('/jobs', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({type: 'labels', supply_ids: supplyIds})
+    }).then(r => r.json()).then(job => {
+        if (job.error) {
+            toast('Ошибка: ' + (job.message || '').slice(0, 100), 'error');
+            return;
+        }
+        toast('Формирование этикеток...', '');
+        watchJob(job.id, null);
     });
 }
 
+// Job progress arrives as "job" events; without EventSource the job is polled every 2 s
+function watchJob(id, lastStep) {
+    var finished = false;
+    function apply(job) {
+        if (finished || job.id !== id) return;
+        if (job.state === 'done' && job.type === 'labels') {
+            toast('Этикетки готовы: ' + job.result.keys.length, 'success');
+            window.location = job.result.download;
+        } else if (job.state === 'done') {
+            S.draftId = job.result.draft_id;
+            toast('Заявка создана! ' + (job.result.order_ids || []).join(', '), 'success');
+        } else if (job.state === 'failed') {
+            toast('Ошибка: ' + (job.error || '').slice(0, 100), 'error');
+        } else {
+            if (job.step !== lastStep) toast('Задача ' + id + ': ' + (JOB_STEPS[job.step] || job.step), '');
+            lastStep = job.step;
+            return;
+        }
+        finished = true;
+        off('job', apply);
+        if (S.page === 'drafts') loadLocalDrafts();
+    }
+    function poll() {
+        fetch('/jobs/' + id).then(r => r.json()).then(job => {
+            apply(job);
+            if (!finished && !EV.source) setTimeout(poll, 2000);
+        });
+    }
+    if (EV.source) on('job', apply);
+    poll();
+}
+
 function goStep(n) {
     if (n <= S.step) {
         S.step = n;
@@ -713,54 +3429,157 @@ function renderDrafts(c) {
         <div class="card">
             <div class="card-header">
                 <div class="card-title">Черновики заявок</div>
-                <button class="btn btn-primary" onclick="loadDrafts()">🔄 Обновить</button>
+                <div style="display:flex;gap:8px">
+                    <label class="btn btn-secondary">📄 Загрузить CSV/XLSX<input type="file" accept=".csv,.xlsx" style="display:none" onchange="uploadDrafts(this)"></label>
+                    <button class="btn btn-primary" onclick="loadDrafts(true)">🔄 Обновить</button>
+                </div>
             </div>
-            <div class="card-body" id="drafts-list">
-                <div class="info-box blue">
-                    <span class="info-icon">💡</span>
-                    <div class="info-text">Здесь будут отображаться созданные черновики. Нажмите "Обновить" для загрузки.</div>
+            <div class="card-body">
+                <div id="upload-report"></div>
+                <div class="supply-filters">
+                    <select class="date-input" id="sup-state" onchange="loadDrafts()"><option value="">Все статусы</option></select>
+                    <select class="date-input" id="sup-warehouse" onchange="loadDrafts()"><option value="">Все склады</option></select>
+                    <input type="date" class="date-input" id="sup-from" onchange="loadDrafts()">
+                    <input type="date" class="date-input" id="sup-to" onchange="loadDrafts()">
                 </div>
+                <div class="supply-summary" id="sup-summary"></div>
+                <div class="supply-viewport" id="drafts-list" onscroll="scheduleSupplies()"><div id="sup-spacer" style="position:relative"></div></div>
             </div>
         </div>
+        <div class="card" style="margin-top:16px">
+            <div class="card-header"><div class="card-title">Созданные в приложении</div></div>
+            <div class="card-body" id="local-drafts"><div class="loading"><div class="spinner"></div></div></div>
+        </div>
     `;
+    loadDrafts();
+    loadLocalDrafts();
 }
 
-function loadDrafts() {
-    var dl = document.getElementById('drafts-list');
-    dl.innerHTML = '<div class="loading"><div class="spinner"></div>Загрузка...</div>';
+function uploadDrafts(input) {
+    var file = input.files[0];
+    if (!file) return;
+    input.value = '';
+    toast('Загрузка ' + file.name + '...', '');
+    var xlsx = /\.xlsx$/i.test(file.name);
+    fetch('/drafts/upload' + (xlsx ? '?format=xlsx' : ''), {method: 'POST', body: file}).then(r => r.json()).then(d => {
+        if (d.error) {
+            toast('Ошибка: ' + (d.message || '').slice(0, 100), 'error');
+            return;
+        }
+        toast(`Черновиков: ${d.drafts}, строк: ${d.ok} из ${d.rows}`, d.errors ? 'error' : 'success');
+        var errors = d.report.filter(r => r.status !== 'ok');
+        document.getElementById('upload-report').innerHTML = errors.length ? `<table class="log-table">
+            <thead><tr><th>Строка</th><th>Товар</th><th>Кол-во</th><th>Ошибка</th></tr></thead>
+            <tbody>${errors.map(r => `<tr><td>${r.row}</td><td>${r.offer_id || r.sku || ''}</td><td>${r.quantity || ''}</td><td>${r.error || ''}</td></tr>`).join('')}</tbody>
+        </table>` : '<div class="empty-state"><div class="empty-icon">✅</div><div class="empty-title">Все строки загружены</div></div>';
+        loadLocalDrafts();
+    });
+}
 
-    // Try multiple endpoints for supply orders (API changed over time)
-    var endpoints = [
-        '/v1/supply-order/list',
-        '/v1/supply/list'
-    ];
+function loadLocalDrafts() {
+    fetch('/drafts').then(r => r.json()).then(drafts => {
+        var ld = document.getElementById('local-drafts');
+        if (!drafts.length) {
+            ld.innerHTML = '<div class="empty-state"><div class="empty-icon">📋</div><div class="empty-title">Черновиков пока нет</div></div>';
+            return;
+        }
+        ld.innerHTML = drafts.map(d => `
+            <div style="padding:16px;border:1px solid #e4e7ed;border-radius:12px;margin-bottom:8px">
+                <div style="font-weight:600">#${d.id}</div>
+                <div style="font-size:13px;color:#5c6b7a">${d.endpoint} • ${d.created_at}</div>
+            </div>
+        `).join('');
+    });
+}
+
+// Supply orders: the server keeps the full list, the page renders only the visible rows
+var SUP = {rows: [], total: 0, cursor: null, done: false, loading: false, seq: 0, frame: 0};
+var SUP_ROW = 64;
+var SUP_STATES = {
+    DATA_FILLING: 'Заполнение данных', READY_TO_SUPPLY: 'Готова к отгрузке', ACCEPTED_AT_SUPPLY_WAREHOUSE: 'Принята на точке',
+    IN_TRANSIT: 'В пути', ACCEPTANCE_AT_STORAGE_WAREHOUSE: 'Приёмка на складе', REPORTS_CONFIRMATION_AWAITING: 'Согласование актов',
+    REPORT_REJECTED: 'Акт отклонён', COMPLETED: 'Завершена', REJECTED_AT_SUPPLY_WAREHOUSE: 'Отказано в приёмке',
+    CANCELLED: 'Отменена', OVERDUE: 'Просрочена'
+};
+
+function loadDrafts(refresh) {
+    SUP = {rows: [], total: 0, cursor: null, done: false, loading: false, seq: SUP.seq + 1, frame: 0};
+    var dl = document.getElementById('drafts-list');
+    if (!dl) return;
+    dl.scrollTop = 0;
+    document.getElementById('sup-spacer').innerHTML = '<div class="loading"><div class="spinner"></div>Загрузка...</div>';
+    fetchSupplies(refresh);
+}
 
-    function tryEndpoint(idx) {
-        if (idx >= endpoints.length) {
-            dl.innerHTML = '<div class="empty-state"><div class="empty-icon">📋</div><div class="empty-title">Нет данных</div><div class="empty-text">API поставок недоступен или нет заявок</div></div>';
+function fetchSupplies(refresh) {
+    if (SUP.loading || SUP.done) return;
+    SUP.loading = true;
+    var seq = SUP.seq;
+    var q = new URLSearchParams({limit: 200});
+    [['state', 'sup-state'], ['warehouse_id', 'sup-warehouse'], ['date_from', 'sup-from'], ['date_to', 'sup-to']].forEach(f => {
+        var v = document.getElementById(f[1]).value;
+        if (v) q.set(f[0], v);
+    });
+    if (SUP.cursor) q.set('cursor', SUP.cursor);
+    if (refresh) q.set('refresh', '1');
+    fetch('/supplies?' + q).then(r => r.json()).then(d => {
+        if (seq !== SUP.seq) return;  // filters changed while the request was in flight
+        SUP.loading = false;
+        if (d.error && !d.items) {
+            document.getElementById('sup-spacer').innerHTML = `<div class="empty-state"><div class="empty-icon">❌</div><div class="empty-text">${d.message}</div></div>`;
             return;
         }
+        SUP.rows = SUP.rows.concat(d.items);
+        SUP.total = d.total;
+        SUP.cursor = d.next_cursor;
+        SUP.done = !d.next_cursor;
+        if (SUP.rows.length === d.items.length) renderSupplyFilters(d);
+        renderSupplies();
+    });
+}
 
-        api(endpoints[idx], {filter: {}, limit: 50}).then(d => {
-            if (d.error || d.code === 404) {
-                tryEndpoint(idx + 1);
-                return;
-            }
-            var items = d.supply_orders || d.result || d.items || [];
-            if (!items.length) {
-                dl.innerHTML = '<div class="empty-state"><div class="empty-icon">📋</div><div class="empty-title">Нет заявок</div></div>';
-                return;
-            }
-            dl.innerHTML = items.map(s => `
-                <div style="padding:16px;border:1px solid #e4e7ed;border-radius:12px;margin-bottom:8px">
-                    <div style="font-weight:600">#${s.supply_order_id || s.supply_id || s.id}</div>
-                    <div style="font-size:13px;color:#5c6b7a">${s.state || s.status || 'Статус неизвестен'}</div>
-                </div>
-            `).join('');
-        });
-    }
+function renderSupplyFilters(d) {
+    var state = document.getElementById('sup-state'), wh = document.getElementById('sup-warehouse');
+    var sv = state.value, wv = wh.value;
+    var states = Object.assign({}, d.counts.states);
+    if (sv && !(sv in states)) states[sv] = 0;
+    state.innerHTML = '<option value="">Все статусы</option>' + Object.keys(states).map(k =>
+        `<option value="${k}"${k === sv ? ' selected' : ''}>${SUP_STATES[k] || k} (${states[k]})</option>`).join('');
+    wh.innerHTML = '<option value="">Все склады</option>' + d.counts.warehouses.map(w =>
+        `<option value="${w.warehouse_id}"${String(w.warehouse_id) === wv ? ' selected' : ''}>${w.name || w.warehouse_id} (${w.count})</option>`).join('');
+    document.getElementById('sup-summary').textContent = `Заявок: ${d.total}` +
+        (d.synced_at ? ` • обновлено ${d.synced_at.slice(11)}` : '') + (d.error ? ` • ошибка: ${d.error.slice(0, 100)}` : '');
+}
+
+function scheduleSupplies() {
+    if (!SUP.frame) SUP.frame = requestAnimationFrame(() => { SUP.frame = 0; renderSupplies(); });
+}
 
-    tryEndpoint(0);
+function renderSupplies() {
+    var dl = document.getElementById('drafts-list'), spacer = document.getElementById('sup-spacer');
+    if (!dl) return;
+    if (!SUP.total) {
+        spacer.style.height = '';
+        spacer.innerHTML = '<div class="empty-state"><div class="empty-icon">📋</div><div class="empty-title">Нет заявок</div></div>';
+        return;
+    }
+    var first = Math.max(0, Math.floor(dl.scrollTop / SUP_ROW) - 5);
+    var last = Math.ceil((dl.scrollTop + dl.clientHeight) / SUP_ROW) + 5;
+    spacer.style.height = SUP.total * SUP_ROW + 'px';
+    spacer.innerHTML = SUP.rows.slice(first, Math.min(last, SUP.rows.length)).map((s, i) => `
+        <div class="supply-row" style="top:${(first + i) * SUP_ROW}px">
+            <div>
+                <div style="font-weight:600">#${s.number}</div>
+                <div style="font-size:13px;color:#5c6b7a">${s.warehouse_name || s.warehouse_id || ''}${s.timeslot_from ? ' • слот ' + s.timeslot_from.slice(0, 16).replace('T', ' ') : ''}</div>
+            </div>
+            <div style="text-align:right">
+                <div style="font-size:13px">${SUP_STATES[s.state] || s.state || 'Статус неизвестен'}</div>
+                <div style="font-size:12px;color:#5c6b7a">${s.created_at.slice(0, 10)}
+                    ${(s.supply_ids || []).length ? `<a href="#" title="Этикетки" onclick="makeLabels([${s.supply_ids}]);return false">🏷️</a>` : ''}</div>
+            </div>
+        </div>
+    `).join('');
+    if (last >= SUP.rows.length - 20) fetchSupplies();
 }
 
 // Logs page
@@ -777,26 +3596,66 @@ function renderLogs(c) {
         </div>
     `;
     
-    fetch('/logs').then(r => r.json()).then(logs => {
+    fetch('/logs?limit=50').then(r => r.json()).then(logs => {
         var lc = document.getElementById('logs-container');
-        if (!logs.length) {
-            lc.innerHTML = '<div class="empty-state"><div class="empty-icon">📝</div><div class="empty-title">Логов пока нет</div></div>';
-            return;
-        }
         lc.innerHTML = `<table class="log-table">
             <thead><tr><th>Время</th><th>Статус</th><th>Endpoint</th><th>Сообщение</th></tr></thead>
-            <tbody>${logs.slice(0, 50).map(l => `
-                <tr>
-                    <td>${l.time}</td>
-                    <td><span class="log-level ${l.level}">${l.level}</span></td>
-                    <td style="font-family:monospace;color:#005bff">${l.endpoint}</td>
-                    <td style="max-width:300px;font-size:11px;color:#5c6b7a;word-break:break-all">${l.message}</td>
-                </tr>
-            `).join('')}</tbody>
+            <tbody id="logs-body">${logs.map(logRow).join('')}</tbody>
         </table>`;
+        S.lastLogId = logs.length ? logs[0].id : 0;
     });
 }
 
+function logRow(l) {
+    return `
+        <tr>
+            <td>${l.time}</td>
+            <td><span class="log-level ${l.level}">${l.level}</span></td>
+            <td style="font-family:monospace;color:#005bff">${l.endpoint}</td>
+            <td style="max-width:300px;font-size:11px;color:#5c6b7a;word-break:break-all">${l.message}</td>
+        </tr>
+    `;
+}
+
+// Live updates over /events (Server-Sent Events); the browser reconnects and resumes by Last-Event-ID itself
+var EV = {source: null, handlers: {}};
+
+function on(type, fn) {
+    (EV.handlers[type] = EV.handlers[type] || []).push(fn);
+}
+
+function off(type, fn) {
+    EV.handlers[type] = (EV.handlers[type] || []).filter(h => h !== fn);
+}
+
+function connectEvents() {
+    if (!window.EventSource) return;
+    // The server only sends events of the account named in the URL (EventSource cannot set headers)
+    if (EV.source) EV.source.close();
+    EV.source = new EventSource('/events' + (S.account ? '?account=' + encodeURIComponent(S.account) : ''));
+    ['log', 'job', 'slots', 'supplies', 'catalog', 'cache'].forEach(type => EV.source.addEventListener(type, e => {
+        var data = JSON.parse(e.data);
+        (EV.handlers[type] || []).slice().forEach(fn => fn(data));
+    }));
+}
+
+on('log', entry => {
+    var body = document.getElementById('logs-body');
+    if (S.page !== 'logs' || !body || entry.account !== S.account || entry.id <= (S.lastLogId || 0)) return;
+    S.lastLogId = entry.id;
+    body.insertAdjacentHTML('afterbegin', logRow(entry));
+    while (body.rows.length > 200) body.deleteRow(-1);
+});
+
+on('supplies', d => {
+    if (d.stale && S.page === 'drafts') loadDrafts();
+});
+
+on('slots', d => {
+    var best = d.slots[0];
+    toast(`Новые слоты: ${d.slots.length}, ближайший ${best.from.slice(0, 16).replace('T', ' ')} (склад ${best.warehouse_id})`, 'success');
+});
+
 // Utils
 function formatDateShort(d) {
     if (!d) return '';
@@ -817,61 +3676,405 @@ function testConn() {
 }
 
 // Init
+loadAccounts();
 render();
 testConn();
+connectEvents();
 </script>
 </body>
 </html>'''
 
 
+def accepted_encodings(header):
+    """Кодировки из Accept-Encoding с q > 0."""
+    codings = {}
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        q = re.search(r"q=([0-9.]+)", params)
+        if coding: codings[coding.strip().lower()] = float(q.group(1)) if q else 1.0
+    if codings.get("*", 0) > 0:
+        for coding in ("br", "gzip"): codings.setdefault(coding, 1.0)
+    return {coding for coding, q in codings.items() if q > 0}
+
+
+class StaticAsset:
+    """Содержимое, сжатое один раз при старте, с сильным ETag для каждого варианта кодирования."""
+
+    def __init__(self, body, content_type):
+        self.content_type = content_type
+        tag = hashlib.sha256(body).hexdigest()[:20]
+        self.variants = {"identity": (body, f'"{tag}"'), "gzip": (gzip.compress(body, 9, mtime=0), f'"{tag}-gzip"')}
+        if brotli: self.variants["br"] = (brotli.compress(body, quality=11), f'"{tag}-br"')
+
+    def pick(self, accept_encoding):
+        """(кодировка, байты, ETag) с лучшим сжатием из принимаемых клиентом."""
+        accepted = accepted_encodings(accept_encoding)
+        for coding in ("br", "gzip"):
+            if coding in accepted and coding in self.variants: return (coding,) + self.variants[coding]
+        return ("identity",) + self.variants["identity"]
+
+UI_ASSET = StaticAsset(HTML.encode(), "text/html; charset=utf-8")
+
+
 class Handler(BaseHTTPRequestHandler):
+    timeout = CLIENT_TIMEOUT or None  # таймаут чтения сокета: медленный или молчащий клиент освобождает воркер
+
     def do_OPTIONS(self):
         self.send_response(200)
         self.send_header("Access-Control-Allow-Origin", "*")
         self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type, X-Ozon-Account")
         self.end_headers()
     
     def do_GET(self):
-        if self.path in ["/", "/index.html"]:
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(HTML.encode())
-        elif self.path == "/logs":
-            self.json_resp(LOGS)
-        elif self.path == "/health":
-            self.json_resp({"status": "ok", "version": "3.0"})
+        path, _, query = self.path.partition("?")
+        params = dict(urllib.parse.parse_qsl(query))
+        if path in ["/", "/index.html"]:
+            self.send_asset(UI_ASSET)
+        elif path == "/logs":
+            limit = int_arg(params, "limit", 0)
+            self.json_resp(ACCOUNT.get().logs.query(int_arg(params, "since", 0), params.get("level"), params.get("endpoint"), max(limit, 0)))
+        elif path == "/accounts":
+            self.json_resp({"accounts": ACCOUNTS.list(), "current": ACCOUNT.get().name})
+        elif path == "/products/search":
+            offset, limit = max(int_arg(params, "offset", 0), 0), min(max(int_arg(params, "limit", 20), 1), 100)
+            self.json_resp(ACCOUNT.get().catalog.search(params.get("q", ""), offset, limit))
+        elif path == "/drafts":
+            self.json_resp(STORE.drafts(min(max(int_arg(params, "limit", 100), 1), 1000)))
+        elif path == "/jobs":
+            self.json_resp(JOBS.list(min(max(int_arg(params, "limit", 100), 1), 500)))
+        elif path.startswith("/jobs/"):
+            job = JOBS.get(path[6:])
+            if job: self.json_resp(job)
+            else: self.send_error(404)
+        elif path == "/catalog":
+            self.json_resp(ACCOUNT.get().catalog.status())
+        elif path == "/points":
+            try:
+                lat, lon = (float(params["lat"]), float(params["lon"])) if params.get("lat") and params.get("lon") else (None, None)
+                radius = float(params["radius_km"]) if params.get("radius_km") else None
+                self.json_resp(POINTS.query(params.get("type") or None, lat, lon, params.get("near"), radius,
+                                            min(max(int_arg(params, "limit", 20), 1), 500)))
+            except ValueError as e:
+                self.json_resp({"error": True, "message": str(e)})
+        elif path == "/replenishment":
+            demand = ACCOUNT.get().demand
+            if params.get("refresh") == "1" and not demand.sync_lock.locked():
+                threading.Thread(target=bound(demand.sync), daemon=True).start()
+            cluster_ids = {int(c) for c in params.get("cluster_id", "").split(",") if c.isdigit()}
+            self.json_resp(demand.plan(max(int_arg(params, "cover_days", 28), 1), max(int_arg(params, "lead_days", 7), 0), cluster_ids,
+                                       max(int_arg(params, "min_qty", 1), 1), min(max(int_arg(params, "limit", 500), 1), 5000)))
+        elif path == "/supplies":
+            states = {s for s in params.get("state", "").split(",") if s}
+            try:
+                self.json_resp(ACCOUNT.get().supplies.query(states, int_arg(params, "warehouse_id", 0) or None, params.get("date_from"),
+                                              params.get("date_to"), params.get("cursor"),
+                                              min(max(int_arg(params, "limit", 100), 1), 500), params.get("refresh") == "1"))
+            except ValueError as e:
+                self.json_resp({"error": True, "message": f"Неверный cursor: {e}"})
+        elif path == "/events":
+            self.events(params)
+        elif path.startswith("/labels/"):
+            self.labels(path[8:], params)
+        elif path == "/metrics":
+            self.send_body(METRICS.render().encode(), "text/plain; version=0.0.4; charset=utf-8")
+        elif path == "/health":
+            self.json_resp({"status": "ok", "version": "3.0", "json": JSON_CODEC, "subscribers": EVENTS.count()})
         else:
             self.send_error(404)
     
     def do_POST(self):
+        path, _, query = self.path.partition("?")
         length = int(self.headers.get("Content-Length", 0))
-        body = json.loads(self.rfile.read(length)) if length > 0 else {}
-        if self.path.startswith("/ozon/"):
-            self.json_resp(ozon_request(self.path[5:], body))
+        if path == "/drafts/upload":
+            params = dict(urllib.parse.parse_qsl(query))
+            xlsx = "spreadsheet" in self.headers.get("Content-Type", "") or params.get("format") == "xlsx"
+            body = BodyStream(self.rfile, length)
+            try:
+                rows = upload_rows(io.BufferedReader(body), xlsx)
+                self.json_resp(bulk_drafts(rows, params.get("warehouse_id"), params.get("cluster_id")))
+            except (ValueError, OverflowError, csv.Error) as e:
+                self.close_connection = body.left > 0  # недочитанное тело не должно стать следующим запросом
+                self.json_resp({"error": True, "message": str(e)})
+            return
+        if path.startswith("/ozon/") and ozon_passthrough(path[5:]):
+            self.proxy_stream(path[5:], self.rfile.read(length) if length > 0 else b"{}")
+            return
+        try:
+            body = json_loads(self.rfile.read(length)) if length > 0 else {}
+            if not isinstance(body, dict): raise ValueError("ожидается JSON-объект")
+        except ValueError as e:
+            return self.json_resp({"error": True, "message": f"Тело запроса: {e}"}, status=400)
+        if path == "/jobs":
+            try: self.json_resp(JOBS.submit(body.get("type", "draft"), body).to_dict())
+            except ValueError as e: self.json_resp({"error": True, "message": str(e)})
+        elif path == "/slots":
+            try:
+                found, raw = SLOTS.find(body.get("draft_id"), body.get("warehouse_ids") or (), body.get("cluster_ids") or (),
+                                        body.get("date_from"), body.get("date_to"), bool(body.get("fresh")))
+            except ValueError as e:
+                self.json_resp({"error": True, "message": str(e)})
+            else:
+                if raw is not None: self.send_body(raw, "application/json", {"X-Cache": "HIT"})
+                else: self.json_resp(found)
+        elif path == "/drafts/estimate":
+            try: self.json_resp(CARGOES.estimate(body.get("items") or []))
+            except ValueError as e: self.json_resp({"error": True, "message": str(e)})
+        elif path == "/cargoes/plan":
+            try: self.json_resp(CARGOES.plan(CargoPacker.request_items(body), body.get("cargo_type"), body.get("templates")))
+            except ValueError as e: self.json_resp({"error": True, "message": str(e)})
+        elif path == "/catalog/sync":
+            catalog = ACCOUNT.get().catalog
+            if not catalog.sync_lock.locked():
+                threading.Thread(target=bound(catalog.sync), args=(bool(body.get("full")),), daemon=True).start()
+            self.json_resp(catalog.status())
+        elif path.startswith("/ozon/"):
+            result, raw, cache_status = ozon_cached(path[5:], body, decode=False)
+            count_cache(path[5:], cache_status)
+            # Ответ Ozon уходит клиенту в исходном виде, без повторной сериализации
+            if raw is not None: self.send_body(raw, "application/json", {"X-Cache": cache_status})
+            else: self.json_resp(result, {"X-Cache": cache_status})
         else:
             self.send_error(404)
     
-    def json_resp(self, data):
+    def proxy_stream(self, endpoint, data):
+        """Ответ Seller API уходит клиенту кусками по мере чтения, при поддержке клиентом - в gzip."""
+        gz = "gzip" in accepted_encodings(self.headers.get("Accept-Encoding"))
+
+        def consume(resp):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.send_header("X-Cache", "BYPASS")
+            if gz:
+                self.send_header("Content-Encoding", "gzip")
+                self.send_header("Vary", "Accept-Encoding")
+            elif resp.getheader("Content-Length"):
+                self.send_header("Content-Length", resp.getheader("Content-Length"))
+            self.end_headers()
+            z = zlib.compressobj(6, zlib.DEFLATED, 31) if gz else None
+            size = 0
+            while chunk := resp.read(65536):
+                size += len(chunk)
+                out = z.compress(chunk) if z else chunk
+                self.wfile.write(out)
+                self.response_bytes += len(out)
+            if z:
+                out = z.flush()
+                self.wfile.write(out)
+                self.response_bytes += len(out)
+            return size
+
+        count_cache(endpoint, "BYPASS")
+        try:
+            status, _, payload = ozon_send(endpoint, data, consume)
+        except StreamAborted as e:
+            log("error", endpoint, f"Ответ прерван: {str(e)[:300]}")
+            self.close_connection = True
+            return
+        except Exception as e:
+            log("error", endpoint, str(e)[:300])
+            self.json_resp({"error": True, "message": str(e)}, {"X-Cache": "BYPASS"})
+            return
+        if status >= 400: self.json_resp(ozon_error(endpoint, status, payload), {"X-Cache": "BYPASS"})
+
+    def json_resp(self, data, headers=None, status=200):
+        self.send_body(json_dumps(data), "application/json", headers, status)
+
+    def send_body(self, payload, content_type, headers=None, status=200):
+        gz = len(payload) > 1024 and "gzip" in accepted_encodings(self.headers.get("Accept-Encoding"))
+        if gz: payload = gzip.compress(payload, 5)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        if gz:
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Vary", "Accept-Encoding")
+        for k, v in (headers or {}).items(): self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
+        self.response_bytes = len(payload)
+
+    def send_asset(self, asset):
+        encoding, payload, etag = asset.pick(self.headers.get("Accept-Encoding"))
+        not_modified = {t.strip().removeprefix("W/") for t in self.headers.get("If-None-Match", "").split(",")}
+        self.send_response(304 if etag in not_modified or "*" in not_modified else 200)
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Vary", "Accept-Encoding")
+        if self.status_code == 304:
+            self.end_headers()
+            return
+        self.send_header("Content-Type", asset.content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        if encoding != "identity": self.send_header("Content-Encoding", encoding)
+        self.end_headers()
+        self.wfile.write(payload)
+        self.response_bytes = len(payload)
+
+    def labels(self, name, params):
+        """Этикетки с диска: /labels/<key>.pdf или /labels/download?keys=a,b&format=pdf|zip.
+        Несколько файлов склеиваются в один PDF (при установленном pypdf) или отдаются ZIP-потоком."""
+        if name != "download":
+            key = name.removesuffix(".pdf")
+            path = LABELS.file(key)
+            return self.send_file(path, "application/pdf", f"{key}.pdf") if path else self.send_error(404)
+        keys = list(dict.fromkeys(k for k in params.get("keys", "").split(",") if k))
+        if not keys or not all(map(LABELS.file, keys)): return self.send_error(404)
+        fmt = params.get("format") or ("pdf" if len(keys) == 1 or pypdf else "zip")
+        if fmt == "pdf" and len(keys) > 1 and pypdf is None:
+            return self.json_resp({"error": True, "message": "Для склейки в один PDF нужен pypdf, используйте format=zip"})
+        if fmt == "pdf":
+            key = keys[0] if len(keys) == 1 else LABELS.merged(keys)
+            return self.send_file(LABELS.file(key), "application/pdf", f"{key}.pdf")
+        # Файлы уже сжаты: ZIP без сжатия пишется прямо в сокет, длина заранее неизвестна
+        self.send_response(200)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Disposition", f'attachment; filename="labels-{len(keys)}.zip"')
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.close_connection = True
+        with zipfile.ZipFile(self.wfile, "w", zipfile.ZIP_STORED) as zf:
+            for key in keys: zf.write(LABELS.file(key), f"{key}.pdf")
+        self.response_bytes = sum(os.path.getsize(LABELS.file(key)) for key in keys)
+
+    def send_file(self, path, content_type, filename):
+        """Файл с диска через sendfile, без чтения в память."""
+        size = os.path.getsize(path)
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(size))
+        self.send_header("Content-Disposition", f'attachment; filename="{filename}"')
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        with open(path, "rb") as f: self.connection.sendfile(f)
+        self.response_bytes = size
+
+    def events(self, params):
+        """Поток Server-Sent Events: после заголовков соединение уходит в EVENTS, воркер свободен.
+        ?types=log,job ограничивает типы событий; Last-Event-ID (или ?last_id) повторяет пропущенное."""
+        types = {t for t in params.get("types", "").split(",") if t} or None
+        try: last_id = int(self.headers.get("Last-Event-ID") or params.get("last_id") or 0)
+        except ValueError: last_id = 0
         self.send_response(200)
-        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("X-Accel-Buffering", "no")
         self.send_header("Access-Control-Allow-Origin", "*")
         self.end_headers()
-        self.wfile.write(json.dumps(data, ensure_ascii=False).encode())
+        self.wfile.flush()
+        self.close_connection = True
+        self.server.detach(self.connection)
+        EVENTS.subscribe(self.connection, types, last_id)
+
+    def send_response(self, code, message=None):
+        self.status_code = code
+        super().send_response(code, message)
+
+    def parse_request(self):
+        """Аккаунт запроса - из заголовка X-Ozon-Account или ?account=; без них - аккаунт по умолчанию."""
+        if not super().parse_request(): return False
+        selector = self.headers.get("X-Ozon-Account") or dict(urllib.parse.parse_qsl(self.path.partition("?")[2])).get("account")
+        try:
+            self.account_token = ACCOUNT.set(ACCOUNTS.get(selector or None))
+        except ValueError as e:
+            self.close_connection = True  # тело запроса не прочитано
+            self.json_resp({"error": True, "message": str(e)})
+            return False
+        return True
+
+    def handle_one_request(self):
+        self.status_code, self.response_bytes, started = None, 0, time.perf_counter()
+        self.account_token = None
+        try: super().handle_one_request()
+        finally:
+            if self.account_token: ACCOUNT.reset(self.account_token)
+        if self.status_code is None: return  # соединение закрылось, запроса не было
+        route = route_label(self.path)
+        METRICS.inc("http_requests_total", method=self.command, route=route, code=self.status_code)
+        METRICS.observe("http_request_seconds", time.perf_counter() - started, route=route)
+        METRICS.observe("http_response_bytes", self.response_bytes, route=route)
     
     def log_message(self, f, *a): pass
 
 
+ROUTES = {"/", "/index.html", "/logs", "/metrics", "/health", "/products/search", "/catalog", "/catalog/sync",
+          "/drafts", "/drafts/upload", "/jobs", "/supplies", "/slots", "/events", "/points", "/cargoes/plan", "/drafts/estimate", "/replenishment", "/accounts"}
+
+def count_cache(endpoint, status):
+    METRICS.inc("ozon_cache_total", endpoint=endpoint_label(endpoint), account=ACCOUNT.get().name, status=status)
+
+def route_label(path):
+    # Метка маршрута с ограниченным набором значений: без query и идентификаторов
+    path = path.partition("?")[0]
+    if path.startswith("/ozon/"): return "/ozon/"
+    if path.startswith("/jobs/"): return "/jobs/:id"
+    if path.startswith("/labels/"): return "/labels/:file"
+    return path if path in ROUTES else "other"
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer с фиксированным пулом воркеров и ограниченной очередью.
+    Когда очередь заполнена, соединение сразу получает 503."""
+    request_queue_size = 128
+
+    def __init__(self, addr, handler, workers=WORKERS, queue_limit=QUEUE_LIMIT):
+        super().__init__(addr, handler)
+        self.pending = queue.Queue(max(queue_limit, 1))
+        self.detached = set()  # соединения, переданные другому владельцу (EVENTS)
+        for i in range(max(workers, 1)):
+            threading.Thread(target=self.worker, name=f"http-worker-{i}", daemon=True).start()
+
+    def worker(self):
+        while True:
+            request, client_address, queued = self.pending.get()
+            METRICS.observe("http_queue_wait_seconds", time.perf_counter() - queued)
+            try: self.finish_request(request, client_address)
+            except Exception: self.handle_error(request, client_address)
+            finally:
+                if request in self.detached: self.detached.discard(request)
+                else: self.shutdown_request(request)
+
+    def detach(self, request):
+        """После обработки запроса воркер не закрывает это соединение."""
+        self.detached.add(request)
+
+    def process_request(self, request, client_address):
+        try:
+            self.pending.put_nowait((request, client_address, time.perf_counter()))
+        except queue.Full:
+            METRICS.inc("http_rejected_total")
+            self.reject(request)
+
+    def reject(self, request):
+        body = json.dumps({"error": True, "code": 503, "message": "Server busy"}).encode()
+        head = ("HTTP/1.0 503 Service Unavailable\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\nRetry-After: 1\r\nConnection: close\r\n\r\n")
+        try: request.sendall(head.encode() + body)
+        except OSError: pass
+        self.shutdown_request(request)
+
+
 if __name__ == "__main__":
+    ACCOUNTS.load()
     print(f"""
 ╔══════════════════════════════════════════════════╗
 ║      📦 FBO Supply Manager v3.0                  ║
 ╠══════════════════════════════════════════════════╣
 ║  Интерфейс как в Ozon Seller                     ║
-║  Client ID: {OZON_CLIENT_ID}                            ║
+║  Client ID: {ACCOUNTS.default.client_id}                            ║
 ║                                                  ║
 ║  🌐 http://localhost:{PORT}                         ║
 ╚══════════════════════════════════════════════════╝
 """)
-    HTTPServer(("0.0.0.0", PORT), Handler).serve_forever()
+    STORE.open()
+    POINTS.load()
+    if POINTS_REFRESH > 0: POINTS.start_refresh()
+    for account in ACCOUNTS:
+        with using(account):
+            account.catalog.load()
+            if CATALOG_REFRESH > 0: account.catalog.start_refresh()
+            account.demand.load()
+            if DEMAND_REFRESH > 0: account.demand.start_refresh()
+    PooledHTTPServer(("0.0.0.0", PORT), Handler).serve_forever()
@@ -0,0 +1,588 @@
+#!/usr/bin/env python3
+"""
+Бенчмарки FBO Supply Manager.
+
+    python bench.py codec [--items 1000] [--rounds 200]
+    python bench.py mock [--port 9000] [--latency 80] [--error-rate 0.02] [--products 5000]
+    python bench.py load [--duration 10] [--concurrency 32] [--routes search,fbo_list] [--json]
+
+mock — локальная заглушка Seller API: OZON_API=http://127.0.0.1:9000 python app.py.
+load — поднимает заглушку и приложение в одном процессе (или бьёт в --target)
+и печатает пропускную способность и p50/p95/p99 по маршрутам.
+"""
+
+import os, gzip, argparse, contextlib, itertools, json, time, math, random, uuid, threading, http.client, urllib.parse
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import app
+
+
+def product(i):
+    # Похоже на элемент ответа /v3/product/info/list: вложенные объекты, кириллица, числа
+    return {
+        "id": 100000 + i, "offer_id": f"ART-{i:06d}", "name": f"Футболка хлопковая синяя, размер {40 + i % 12}",
+        "sku": 900000000 + i, "barcodes": [f"46{i:011d}"], "price": f"{990 + i % 500}.00",
+        "sources": [{"sku": 900000000 + i, "source": "fbo", "created_at": "2025-03-01T10:00:00Z"}],
+        "stocks": {"has_stock": True, "stocks": [{"present": i % 40, "reserved": i % 3, "source": "fbo"}]},
+    }
+
+
+def dimensions(i):
+    # Элемент ответа /v4/product/info/attributes: габариты в мм, вес в граммах
+    return {"id": 100000 + i, "offer_id": f"ART-{i:06d}", "sku": 900000000 + i,
+            "depth": 1500 if i % 97 == 0 else 100 + i % 7 * 50, "width": 80 + i % 5 * 40, "height": 20 + i % 11 * 30,
+            "dimension_unit": "mm", "weight": 150 + i % 13 * 400, "weight_unit": "g"}
+
+
+def label_pdf(title, pages=1):
+    # Минимальный корректный PDF: по странице 100×70 мм на грузоместо
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for n in range(pages):
+        text = f"BT /F1 14 Tf 20 150 Td ({title} #{n + 1}) Tj ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(text), text))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 283 198] /Contents %d 0 R "
+                       b"/Resources << /Font << /F1 3 0 R >> >> >>" % len(objects))
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % k for k in kids), pages)
+    out, offsets = bytearray(b"%PDF-1.4\n"), []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (i, obj)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1) + b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def product_page(items):
+    return {"items": [product(i) for i in range(items)]}
+
+
+def per_call_us(fn, rounds):
+    fn()
+    started = time.process_time()
+    for _ in range(rounds): fn()
+    return (time.process_time() - started) / rounds * 1e6
+
+
+def bench_codec(args):
+    body_raw = json.dumps({"filter": {"visibility": "ALL"}, "last_id": "", "limit": args.items}).encode()
+    resp_raw = json.dumps(product_page(args.items), ensure_ascii=False).encode()
+
+    def before():
+        # Пять проходов stdlib json на запрос, как было в do_POST -> ozon_request -> json_resp
+        body = json.loads(body_raw)
+        json.dumps(body, ensure_ascii=False)[:200]
+        json.dumps(body).encode()
+        result = json.loads(resp_raw)
+        json.dumps(result, ensure_ascii=False).encode()
+
+    def decoded():
+        # Кэшируемый метод: тело запроса разобрано и собрано заново, ответ разобран один раз и уходит как есть
+        body = app.json_loads(body_raw)
+        app.json_dumps(body)
+        app.json_loads(resp_raw)
+
+    def passthrough():
+        # Потоковый прокси: только срез сырого тела для лога
+        body_raw[:200].decode(errors="replace")
+
+    print(f"JSON codec: {app.JSON_CODEC}; ответ {len(resp_raw) / 1024:.0f} KB ({args.items} товаров), CPU на запрос:")
+    base = per_call_us(before, args.rounds)
+    for name, fn in [("до: 5 проходов stdlib", before), ("кэшируемый метод", decoded), ("потоковый прокси", passthrough)]:
+        us = base if fn is before else per_call_us(fn, args.rounds)
+        print(f"  {name:<24} {us:>10.1f} мкс  ({base / max(us, 1e-3):.1f}x)")
+
+
+CITIES = [("Москва", 55.75, 37.62), ("Санкт-Петербург", 59.94, 30.31), ("Казань", 55.79, 49.12),
+          ("Екатеринбург", 56.84, 60.61), ("Новосибирск", 55.03, 82.92), ("Ростов-на-Дону", 47.22, 39.72),
+          ("Краснодар", 45.04, 38.98), ("Самара", 53.2, 50.15), ("Хабаровск", 48.48, 135.08), ("Воронеж", 51.66, 39.2)]
+WAREHOUSE_TYPES = [("WAREHOUSE_TYPE_SORTING_CENTER", "СЦ"), ("WAREHOUSE_TYPE_FULL_FILLMENT", "РФЦ"),
+                   ("WAREHOUSE_TYPE_ORDERS_RECEIVING_POINT", "ППЗ"), ("WAREHOUSE_TYPE_DELIVERY_POINT", "ПВЗ")]
+ORDER_STATES = ["DATA_FILLING", "READY_TO_SUPPLY", "ACCEPTED_AT_SUPPLY_WAREHOUSE", "IN_TRANSIT",
+                "ACCEPTANCE_AT_STORAGE_WAREHOUSE", "COMPLETED", "CANCELLED"]
+
+
+class MockOzon:
+    """Заглушка Seller API: детерминированные данные заданного размера, задержка
+    с разбросом, доля 500 и 429, асинхронные операции черновиков и заявок."""
+
+    def __init__(self, products=5000, warehouses=200, supplies=500, latency=0.05, jitter=0.3,
+                 error_rate=0.0, throttle_rate=0.0, op_delay=0.5, slot_density=0.3, seed=1):
+        self.latency, self.jitter, self.op_delay, self.slot_density = latency, jitter, op_delay, slot_density
+        self.error_rate, self.throttle_rate = error_rate, throttle_rate
+        self.products = products
+        self.rnd = random.Random(seed)
+        self.warehouses = []
+        for i in range(warehouses):
+            city, lat, lon = CITIES[i % len(CITIES)]
+            kind, short = WAREHOUSE_TYPES[i // len(CITIES) % len(WAREHOUSE_TYPES)]
+            self.warehouses.append({
+                "warehouse_id": 1000 + i, "name": f"{city.upper()}_{short}_{i}", "city": city,
+                "address": f"{city}, ул. Складская, {i + 1}", "warehouse_type": kind, "cluster_id": 10 + i % len(CITIES),
+                "coordinates": {"latitude": round(lat + self.rnd.uniform(-0.3, 0.3), 5),
+                                "longitude": round(lon + self.rnd.uniform(-0.5, 0.5), 5)},
+            })
+        self.clusters = [{"id": 10 + c, "name": city, "type": "CLUSTER_TYPE_OZON", "logistic_clusters": [{"warehouses": [
+            {"warehouse_id": w["warehouse_id"], "name": w["name"], "type": w["warehouse_type"]}
+            for w in self.warehouses if w["cluster_id"] == 10 + c]}]} for c, (city, _, _) in enumerate(CITIES)]
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.orders = {}
+        for i in range(supplies):
+            self.add_order(self.rnd.choice(self.warehouses), ORDER_STATES[i % len(ORDER_STATES)],
+                           today - timedelta(days=self.rnd.randint(0, 120)))
+        self.operations = {}
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.routes = {
+            "/v1/cluster/list": self.cluster_list,
+            "/v1/warehouse/fbo/list": self.fbo_list,
+            "/v1/warehouse/list": self.warehouse_list,
+            "/v3/product/list": self.product_list,
+            "/v3/product/info/list": self.product_info,
+            "/v4/product/info/attributes": self.product_attributes,
+            "/v1/draft/create": self.draft_create,
+            "/v1/draft/create/info": self.draft_info,
+            "/v1/draft/timeslot/info": self.timeslot_info,
+            "/v1/draft/supply/create": self.supply_create,
+            "/v1/draft/supply/create/status": self.supply_status,
+            "/v1/supply-order/list": self.order_list,
+            "/v2/supply-order/list": self.order_ids,
+            "/v2/supply-order/get": self.order_get,
+            "/v1/supply-order/cancel": self.order_cancel,
+            "/v1/cargoes/create": self.cargoes_create,
+            "/v1/cargoes/create/info": self.cargoes_info,
+            "/v1/cargoes-label/create": self.label_create,
+            "/v1/cargoes-label/get": self.label_get,
+            "/v2/analytics/stock_on_warehouses": self.stock_on_warehouses,
+            "/v2/posting/fbo/list": self.fbo_postings,
+        }
+
+    def add_order(self, warehouse, state, created):
+        oid = 50000 + len(self.orders)
+        slot = created + timedelta(days=3, hours=9 + oid % 8)
+        self.orders[oid] = {
+            "supply_order_id": oid, "supply_order_number": f"{2000000 + oid}", "state": state,
+            "created_date": created.isoformat(timespec="seconds") + "Z",
+            "timeslot": {"from": slot.isoformat() + "Z", "to": (slot + timedelta(hours=1)).isoformat() + "Z"},
+            "drop_off_warehouse": {"warehouse_id": warehouse["warehouse_id"], "name": warehouse["name"]},
+            "supplies": [{"supply_id": 70000 + oid, "bundle_id": str(uuid.UUID(int=oid)),
+                          "storage_warehouse": {"warehouse_id": warehouse["warehouse_id"], "name": warehouse["name"]}}],
+        }
+        return oid
+
+    def handle(self, path, body):
+        """(HTTP-статус, тело, доп. заголовки) на запрос к методу path."""
+        with self.lock:
+            self.calls[path] += 1
+            delay = max(self.latency * self.rnd.uniform(1 - self.jitter, 1 + self.jitter), 0)
+            roll = self.rnd.random()
+        time.sleep(delay)
+        if roll < self.throttle_rate:
+            return 429, {"code": 8, "message": "You have reached request rate limit per second"}, {"Retry-After": "1"}
+        if roll < self.throttle_rate + self.error_rate:
+            return 500, {"code": 13, "message": "Internal error"}, {}
+        route = self.routes.get(path)
+        if not route: return 404, {"code": 5, "message": "Not Found"}, {}
+        try: result = route(body)
+        except (KeyError, TypeError, ValueError) as e:
+            return 400, {"code": 3, "message": f"invalid request: {e}"}, {}
+        return result if isinstance(result, tuple) else (200, result, {})
+
+    def cluster_list(self, body):
+        return {"clusters": self.clusters}
+
+    def fbo_list(self, body):
+        search = (body.get("search") or "").lower()
+        return {"search": [w for w in self.warehouses if search in w["name"].lower() or search in w["city"].lower()]}
+
+    def warehouse_list(self, body):
+        return {"result": [{"warehouse_id": w["warehouse_id"], "name": w["name"], "is_rfbs": False, "status": "created"}
+                           for w in self.warehouses[:20]]}
+
+    def product_list(self, body):
+        limit = min(int(body.get("limit") or 100), 1000)
+        start = int(body.get("last_id") or 0)
+        items = [{"product_id": 100000 + i, "offer_id": f"ART-{i:06d}", "archived": False, "has_fbo_stocks": True,
+                  "has_fbs_stocks": False, "quants": []} for i in range(start, min(start + limit, self.products))]
+        last_id = str(start + len(items)) if start + len(items) < self.products else ""
+        return {"result": {"items": items, "total": self.products, "last_id": last_id}}
+
+    def product_info(self, body):
+        ids = body.get("product_id") or []
+        if len(ids) > 1000: raise ValueError("product_id: не больше 1000")
+        return {"items": [product(int(pid) - 100000) for pid in ids if 0 <= int(pid) - 100000 < self.products]}
+
+    def product_attributes(self, body):
+        ids = (body.get("filter") or {}).get("product_id") or []
+        if len(ids) > 1000: raise ValueError("filter.product_id: не больше 1000")
+        items = [dimensions(int(pid) - 100000) for pid in ids if 0 <= int(pid) - 100000 < self.products]
+        return {"result": items, "total": len(items), "last_id": ""}
+
+    def operation(self, **result):
+        op = str(uuid.uuid4())
+        with self.lock: self.operations[op] = (time.monotonic() + self.op_delay, result)
+        return {"operation_id": op}
+
+    def pending(self, body):
+        ready_at, result = self.operations[body["operation_id"]]
+        return None if time.monotonic() < ready_at else result
+
+    def draft_create(self, body):
+        if not body.get("items"): raise ValueError("items: пусто")
+        return self.operation(draft_id=self.rnd.randint(10 ** 7, 10 ** 8), cluster_ids=body.get("cluster_ids"),
+                              warehouse_id=body.get("warehouse_id"))
+
+    def draft_info(self, body):
+        if body.get("operation_id") not in self.operations: return 404, {"code": 5, "message": "operation not found"}, {}
+        result = self.pending(body)
+        if result is None: return {"status": "CALCULATION_STATUS_IN_PROGRESS"}
+        clusters = [c for c in self.clusters if not result["cluster_ids"] or c["id"] in result["cluster_ids"]]
+        return {"status": "CALCULATION_STATUS_SUCCESS", "draft_id": result["draft_id"], "errors": [], "clusters": [{
+            "cluster_id": c["id"], "cluster_name": c["name"], "warehouses": [{
+                "supply_warehouse": {"warehouse_id": w["warehouse_id"], "name": w["name"], "address": ""},
+                "status": {"is_available": w["warehouse_id"] % 4 != 0}} for w in c["logistic_clusters"][0]["warehouses"][:5]],
+        } for c in clusters[:5]]}
+
+    def timeslot_info(self, body):
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        date_from = datetime.fromisoformat((body.get("date_from") or today.isoformat())[:19])
+        date_to = datetime.fromisoformat((body.get("date_to") or (today + timedelta(days=7)).isoformat())[:19])
+        days = min(max((date_to - date_from).days, 1), 28)
+        result = []
+        for wid in body.get("warehouse_ids") or []:
+            schedule = []
+            for d in range(days):
+                day = date_from + timedelta(days=d)
+                rnd = random.Random(f"{wid}:{day.date()}")  # одни и те же слоты на повторный запрос
+                slots = [{"from_in_timezone": (day + timedelta(hours=h)).isoformat() + "Z",
+                          "to_in_timezone": (day + timedelta(hours=h + 1)).isoformat() + "Z"}
+                         for h in range(8, 20) if rnd.random() < self.slot_density]
+                schedule.append({"date_in_timezone": day.date().isoformat(), "timeslots": slots})
+            result.append({"drop_off_warehouse_id": wid, "warehouse_timezone": "Europe/Moscow", "days": schedule})
+        return {"drop_off_warehouse_timeslots": result, "requested_date_from": date_from.isoformat() + "Z",
+                "requested_date_to": date_to.isoformat() + "Z"}
+
+    def supply_create(self, body):
+        warehouse = next((w for w in self.warehouses if w["warehouse_id"] == body["warehouse_id"]), self.warehouses[0])
+        return self.operation(warehouse=warehouse)
+
+    def supply_status(self, body):
+        if body.get("operation_id") not in self.operations: return 404, {"code": 5, "message": "operation not found"}, {}
+        result = self.pending(body)
+        if result is None: return {"status": "IN_PROGRESS"}
+        with self.lock:
+            if "order_id" not in result: result["order_id"] = self.add_order(result["warehouse"], "DATA_FILLING", datetime.now())
+        return {"status": "SUCCESS", "result": {"order_ids": [result["order_id"]]}, "error_messages": []}
+
+    def filtered_orders(self, flt):
+        states = set(flt.get("states") or [])
+        return [o for oid, o in sorted(self.orders.items()) if not states or o["state"] in states]
+
+    def order_list(self, body):
+        start = int(body.get("last_id") or 0)
+        limit = min(int(body.get("limit") or 50), 100)
+        page = [o for o in self.filtered_orders(body.get("filter") or {}) if o["supply_order_id"] > start][:limit]
+        return {"supply_orders": page, "last_id": str(page[-1]["supply_order_id"]) if len(page) == limit else ""}
+
+    def order_ids(self, body):
+        paging = body.get("paging") or {}
+        start, limit = int(paging.get("from_supply_order_id") or 0), min(int(paging.get("limit") or 100), 100)
+        page = [o["supply_order_id"] for o in self.filtered_orders(body.get("filter") or {}) if o["supply_order_id"] > start][:limit]
+        return {"supply_order_id": page, "last_supply_order_id": page[-1] if len(page) == limit else 0}
+
+    def order_get(self, body):
+        ids = body.get("order_ids") or []
+        if len(ids) > 50: raise ValueError("order_ids: не больше 50")
+        return {"orders": [self.orders[int(i)] for i in ids if int(i) in self.orders]}
+
+    def cargoes_create(self, body):
+        cargoes = body.get("cargoes") or []
+        if not body.get("supply_id") or not cargoes: raise ValueError("supply_id и cargoes обязательны")
+        for cargo in cargoes:
+            if len({i["barcode"] for i in cargo["value"]["items"]}) != 1: raise ValueError("в грузоместе должен быть один SKU")
+        return self.operation(supply_id=body["supply_id"], keys=[c["key"] for c in cargoes])
+
+    def cargoes_info(self, body):
+        if body.get("operation_id") not in self.operations: return 404, {"code": 5, "message": "operation not found"}, {}
+        result = self.pending(body)
+        if result is None: return {"status": "IN_PROGRESS"}
+        return {"status": "SUCCESS", "result": {"supply_id": result["supply_id"], "cargoes": [
+            {"key": key, "value": {"cargo_id": abs(hash((result["supply_id"], key))) % 10 ** 9}} for key in result["keys"]]}}
+
+    def stock_on_warehouses(self, body):
+        # По две строки на товар: остатки на двух складах, по строке без остатка через раз
+        offset, limit = int(body.get("offset") or 0), min(int(body.get("limit") or 100), 1000)
+        rows = []
+        for r in range(offset, min(offset + limit, self.products * 2)):
+            i, w = r // 2, self.warehouses[(r * 7) % len(self.warehouses)]
+            rows.append({"sku": 900000000 + i, "item_code": f"ART-{i:06d}", "item_name": f"Товар {i}",
+                         "free_to_sell_amount": (r * 31) % 40 if r % 4 else 0, "promised_amount": r % 3,
+                         "reserved_amount": r % 2, "warehouse_name": w["name"]})
+        return {"result": {"rows": rows}}
+
+    def fbo_postings(self, body):
+        # Три отправления на товар за период, кластер доставки меняется по кругу, каждое десятое отменено
+        offset, limit = int(body.get("offset") or 0), min(int(body.get("limit") or 100), 1000)
+        since = datetime.fromisoformat(((body.get("filter") or {}).get("since") or datetime.now().isoformat())[:19])
+        postings = []
+        for n in range(offset, min(offset + limit, self.products * 3)):
+            i = n // 3
+            postings.append({"posting_number": f"{10000000 + n}-0001-1", "status": "cancelled" if n % 10 == 0 else "delivered",
+                             "created_at": (since + timedelta(hours=n % 600)).isoformat() + "Z",
+                             "products": [{"sku": 900000000 + i, "offer_id": f"ART-{i:06d}", "quantity": 1 + (n * 13) % 9}],
+                             "financial_data": {"cluster_from": CITIES[0][0], "cluster_to": CITIES[(n * 3 + i) % len(CITIES)][0]}})
+        return {"result": postings}
+
+    def label_create(self, body):
+        if not body.get("supply_id"): raise ValueError("supply_id обязателен")
+        return self.operation(supply_id=body["supply_id"], pages=len(body.get("cargoes") or []) or 3)
+
+    def label_get(self, body):
+        if body.get("operation_id") not in self.operations: return 404, {"code": 5, "message": "operation not found"}, {}
+        result = self.pending(body)
+        if result is None: return {"result": {"status": "IN_PROGRESS"}}
+        return {"result": {"status": "SUCCESS", "file_guid": body["operation_id"]}}
+
+    def label_file(self, guid):
+        """PDF этикеток по file_guid из label_get или None."""
+        with self.lock: self.calls["/v1/cargoes-label/file"] += 1
+        time.sleep(self.latency)
+        if guid not in self.operations or self.pending({"operation_id": guid}) is None: return None
+        result = self.operations[guid][1]
+        return label_pdf(f"Supply {result['supply_id']}", result["pages"])
+
+    def order_cancel(self, body):
+        order = self.orders[int(body["order_id"])]
+        order["state"] = "CANCELLED"
+        return self.operation(order_id=order["supply_order_id"])
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, как у настоящего API: пул соединений приложения работает
+    disable_nagle_algorithm = True  # заголовки и тело уходят отдельными write: без этого +40 мс на delayed ACK
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not self.headers.get("Api-Key"):
+            status, payload, headers = 401, {"code": 16, "message": "Api-Key is required"}, {}
+        else:
+            try: body = json.loads(raw or b"{}")
+            except ValueError: status, payload, headers = 400, {"code": 3, "message": "invalid JSON"}, {}
+            else: status, payload, headers = self.server.mock.handle(self.path, body)
+        data = app.json_dumps(payload)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items(): self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        # Файл этикеток: GET /v1/cargoes-label/file/{file_guid}
+        prefix, _, guid = self.path.rpartition("/")
+        data = self.server.mock.label_file(guid) if prefix == "/v1/cargoes-label/file" and self.headers.get("Api-Key") else None
+        self.send_response(200 if data else 404)
+        self.send_header("Content-Type", "application/pdf" if data else "application/json")
+        data = data or app.json_dumps({"code": 5, "message": "Not Found"})
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, f, *a): pass
+
+
+def start_mock(args, port=0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockHandler)
+    server.mock = MockOzon(products=args.products, warehouses=args.warehouses, supplies=args.supplies,
+                           latency=args.latency / 1000, jitter=args.jitter, error_rate=args.error_rate,
+                           throttle_rate=args.throttle_rate, op_delay=args.op_delay, slot_density=args.slot_density)
+    threading.Thread(target=server.serve_forever, name="mock-ozon", daemon=True).start()
+    return server
+
+
+def bench_mock(args):
+    server = start_mock(args, args.port)
+    print(f"Заглушка Seller API на http://127.0.0.1:{server.server_port}: {args.products} товаров, "
+          f"{args.warehouses} складов, {args.supplies} заявок, задержка {args.latency:.0f} мс")
+    print(f"  OZON_API=http://127.0.0.1:{server.server_port} python app.py")
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+def load_routes():
+    """Маршруты нагрузки: имя -> (метод, путь, тело)."""
+    today = datetime.now().date()
+    return {
+        "health": ("GET", "/health", None),
+        "ui": ("GET", "/", None),
+        "search": ("GET", "/products/search?" + urllib.parse.urlencode({"q": "футболка 42", "limit": 20}), None),
+        "clusters": ("POST", "/ozon/v1/cluster/list", {"cluster_type": "CLUSTER_TYPE_OZON"}),
+        "fbo_list": ("POST", "/ozon/v1/warehouse/fbo/list", {"filter_by_supply_type": ["CREATE_TYPE_CROSSDOCK"], "search": ""}),
+        "product_list": ("POST", "/ozon/v3/product/list", {"filter": {"visibility": "ALL"}, "last_id": "", "limit": 100}),
+        "supply_orders": ("POST", "/ozon/v1/supply-order/list", {"filter": {}, "limit": 50}),
+        "supplies": ("GET", "/supplies?" + urllib.parse.urlencode({"state": "COMPLETED", "limit": 100}), None),
+        "timeslots": ("POST", "/ozon/v1/draft/timeslot/info", {
+            "draft_id": 1, "warehouse_ids": [1000, 1001, 1002, 1003, 1004],
+            "date_from": f"{today}T00:00:00Z", "date_to": f"{today + timedelta(days=7)}T00:00:00Z"}),
+        "points": ("GET", "/points?" + urllib.parse.urlencode({"type": "SC", "near": "Казань", "limit": 20}), None),
+        "slots": ("POST", "/slots", {"draft_id": 1, "warehouse_ids": list(range(1000, 1030)),
+                                     "date_from": str(today), "date_to": str(today + timedelta(days=13))}),
+        "draft_create": ("POST", "/ozon/v1/draft/create", {"items": [{"sku": 900000001, "quantity": 10}], "cluster_ids": [10]}),
+    }
+
+# draft_create сбрасывает кэш справочников и в смесь по умолчанию не входит
+DEFAULT_ROUTES = ["health", "ui", "search", "clusters", "fbo_list", "product_list", "supply_orders", "supplies", "timeslots", "slots", "points"]
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, max(math.ceil(p / 100 * len(ordered)) - 1, 0))] if ordered else 0.0
+
+
+def call(host, port, method, path, data):
+    """Один запрос к приложению отдельным соединением; 0 вместо статуса при сетевой ошибке.
+    Ошибку Seller API прокси отдаёт с кодом 200 и {"error": true} - она считается как 502."""
+    conn = http.client.HTTPConnection(host, port, timeout=60)
+    try:
+        conn.request(method, path, body=data, headers={"Content-Type": "application/json", "Accept-Encoding": "gzip"})
+        resp = conn.getresponse()
+        body = resp.read()
+        if resp.getheader("Content-Encoding") == "gzip": body = gzip.decompress(body)
+        return 502 if body.startswith(b'{"error":true') else resp.status
+    except (OSError, http.client.HTTPException):
+        return 0
+    finally:
+        conn.close()
+
+
+def drive(host, port, routes, concurrency, duration):
+    """concurrency потоков по кругу обходят routes в течение duration секунд.
+    Возвращает ({маршрут: [секунды]}, {маршрут: ошибок}, фактическая длительность)."""
+    samples, errors = {name: [] for name in routes}, Counter()
+    lock = threading.Lock()
+    names = list(routes)
+    encoded = {name: (method, path, app.json_dumps(body) if body is not None else None)
+               for name, (method, path, body) in routes.items()}
+    stop = time.monotonic() + duration
+
+    def worker(k):
+        for i in itertools.count(k):
+            if time.monotonic() >= stop: return
+            name = names[i % len(names)]
+            started = time.perf_counter()
+            status = call(host, port, *encoded[name])
+            elapsed = time.perf_counter() - started
+            with lock:
+                samples[name].append(elapsed)
+                if not 200 <= status < 400: errors[name] += 1
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(k,), daemon=True) for k in range(concurrency)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return samples, errors, time.monotonic() - started
+
+
+def bench_load(args):
+    routes = load_routes()
+    names = args.routes.split(",") if args.routes else DEFAULT_ROUTES
+    unknown = [n for n in names if n not in routes]
+    if unknown: raise SystemExit(f"Неизвестные маршруты: {', '.join(unknown)}; есть: {', '.join(routes)}")
+    routes = {n: routes[n] for n in names}
+    mock = None
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):  # log() приложения печатает каждый запрос
+        if args.target:
+            target = urllib.parse.urlsplit(args.target)
+            host, port = target.hostname, target.port or 80
+        else:
+            mock = start_mock(args)
+            app.OZON_API = f"http://127.0.0.1:{mock.server_port}"
+            if not args.limits: app.ACCOUNTS.default.limiter = app.RateLimiter({"default": (1e6, 1e6)})
+            if args.no_cache: app.CACHE_TTL.clear()
+            if args.db: app.STORE = app.Store(args.db).open()
+            synced = time.perf_counter()
+            app.CATALOG.sync()
+            synced = time.perf_counter() - synced
+            server = app.PooledHTTPServer(("127.0.0.1", 0), app.Handler, workers=args.workers, queue_limit=args.queue)
+            threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+            host, port = "127.0.0.1", server.server_port
+        for method, path, body in routes.values():  # прогрев: кэши и пул соединений
+            call(host, port, method, path, app.json_dumps(body) if body is not None else None)
+        if mock: mock.mock.calls.clear()
+        samples, errors, wall = drive(host, port, routes, args.concurrency, args.duration)
+
+    report = {"duration": round(wall, 2), "concurrency": args.concurrency, "routes": {}}
+    for name, values in samples.items():
+        values.sort()
+        report["routes"][name] = {
+            "requests": len(values), "errors": errors[name], "rps": round(len(values) / wall, 1),
+            **{f"p{p}_ms": round(percentile(values, p) * 1000, 2) for p in (50, 95, 99)},
+            "max_ms": round(values[-1] * 1000, 2) if values else 0.0,
+        }
+    total = sum(r["requests"] for r in report["routes"].values())
+    report["rps"] = round(total / wall, 1)
+    if mock:
+        report["catalog_sync_s"] = round(synced, 3)
+        report["upstream_calls"] = dict(mock.mock.calls.most_common())
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    where = args.target or f"приложение в процессе, заглушка {args.latency:.0f} мс ± {args.jitter:.0%}, ошибки {args.error_rate:.0%}"
+    print(f"{where}; {args.concurrency} потоков, {wall:.1f} с, JSON codec: {app.JSON_CODEC}")
+    if mock: print(f"Синхронизация каталога ({args.products} товаров): {synced:.2f} с")
+    print(f"  {'маршрут':<14} {'запросов':>9} {'ошибок':>7} {'rps':>8} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9} {'max мс':>9}")
+    for name, r in report["routes"].items():
+        print(f"  {name:<14} {r['requests']:>9} {r['errors']:>7} {r['rps']:>8.1f} {r['p50_ms']:>9.2f} "
+              f"{r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['max_ms']:>9.2f}")
+    print(f"  {'всего':<14} {total:>9} {sum(errors.values()):>7} {report['rps']:>8.1f}")
+    if mock:
+        print("Запросы к Seller API за прогон: " + (", ".join(f"{k} {v}" for k, v in report["upstream_calls"].items()) or "нет"))
+
+
+def mock_options(parser):
+    parser.add_argument("--latency", type=float, default=50, help="средняя задержка ответа, мс")
+    parser.add_argument("--jitter", type=float, default=0.3, help="разброс задержки, доля от средней")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="доля ответов 429 с Retry-After")
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--warehouses", type=int, default=200)
+    parser.add_argument("--supplies", type=int, default=500)
+    parser.add_argument("--slot-density", type=float, default=0.3, help="доля занятых часов 8-20 со свободным слотом")
+    parser.add_argument("--op-delay", type=float, default=0.5, help="через сколько секунд готовы операции черновика")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    codec = sub.add_parser("codec", help="CPU на JSON-проходы одного проксируемого запроса")
+    codec.add_argument("--items", type=int, default=1000)
+    codec.add_argument("--rounds", type=int, default=200)
+    codec.set_defaults(run=bench_codec)
+    mock = sub.add_parser("mock", help="заглушка Seller API для ручной проверки и нагрузки")
+    mock.add_argument("--port", type=int, default=9000)
+    mock_options(mock)
+    mock.set_defaults(run=bench_mock)
+    load = sub.add_parser("load", help="нагрузка на маршруты приложения: rps и p50/p95/p99")
+    load.add_argument("--duration", type=float, default=10)
+    load.add_argument("--concurrency", type=int, default=32)
+    load.add_argument("--routes", default="", help=f"через запятую, по умолчанию {','.join(DEFAULT_ROUTES)}")
+    load.add_argument("--target", default="", help="URL уже запущенного приложения вместо встроенного")
+    load.add_argument("--workers", type=int, default=app.WORKERS)
+    load.add_argument("--queue", type=int, default=app.QUEUE_LIMIT)
+    load.add_argument("--limits", action="store_true", help="оставить лимиты RATE_LIMITS (по умолчанию сняты)")
+    load.add_argument("--no-cache", action="store_true", help="отключить кэш справочников")
+    load.add_argument("--db", default="", help="открыть SQLite-хранилище по этому пути")
+    load.add_argument("--json", action="store_true", help="отчёт в JSON для сравнения прогонов")
+    mock_options(load)
+    load.set_defaults(run=bench_load)
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()